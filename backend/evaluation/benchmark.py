@@ -0,0 +1,1041 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the Prompt2Shell backend.
+Run from the backend directory: python evaluation/benchmark.py <benchmark>
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add src to path
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+BACKEND_DIR = Path(__file__).parent.parent
+EXTRACTION_GOLDEN_PATH = Path(__file__).parent / "extraction_golden.json"
+
+# Evaluation prompts paired with paraphrases that should map to the same command
+PARAPHRASES = [
+    ("Create a new Git branch and switch to it.", "make a new git branch and check it out"),
+    ("Compress the folder reports into reports.tar.gz.", "compress the reports folder into reports.tar.gz"),
+    ("List all Python files in the current directory recursively.", "recursively list all python files in the current dir"),
+    ("Set up a virtual environment and install requests.", "create a venv and install requests"),
+    ("Fetch only the first ten lines of a file named output.log.", "get the first 10 lines of output.log"),
+    ("Remove all .pyc files but keep the .py files intact", "delete every .pyc file but keep .py files"),
+]
+
+# Similar prompts that must NOT share an answer
+NEAR_MISSES = [
+    ("Remove all .pyc files", "Remove all .py files"),
+    ("Fetch the first ten lines of output.log", "Fetch the last ten lines of output.log"),
+    ("Create a new Git branch", "Delete a Git branch"),
+    # Same sentence, different literal argument
+    ("recursively delete all log files older than 7 days in the /var/log/nginx directory",
+     "recursively delete all log files older than 30 days in the /var/log/nginx directory"),
+    ("run the nginx docker image in the background and map host port 8080 to container port 80",
+     "run the nginx docker image in the background and map host port 9090 to container port 80"),
+    ("Compress the folder reports into reports.tar.gz", "Compress the folder reports into backup.tar.gz"),
+]
+
+# Prompt sets from static_eval.py (with reference answers) and test_agent.py
+EVAL_PROMPTS = [
+    ("Create a new Git branch and switch to it.", "git checkout -b <branch-name>"),
+    ("Compress the folder reports into reports.tar.gz.", "tar -czvf reports.tar.gz reports/"),
+    ("List all Python files in the current directory recursively.", "find . -name '*.py'"),
+    ("Set up a virtual environment and install requests.", "python3 -m venv venv"),
+    ("Fetch only the first ten lines of a file named output.log.", "head -n 10 output.log"),
+    ("Remove all .pyc files but keep the .py files intact", "find . -name '*.pyc' -delete"),
+    ("Find all files larger than 100MB in the current directory and its subdirectories, then sort them by size",
+     "find . -type f -size +100M -exec ls -lh {} + | sort -k 5 -rh"),
+    ("List all files in current directory", None),
+    ("Initialize a new Git repository", None),
+    ("Install a Python package using pip", None),
+    ("Create a new directory", None),
+    ("Copy a file to another location", None),
+    ("Check Git status", None),
+    ("Compress a folder using tar", None),
+    ("Search for text in files using grep", None),
+    ("Run a Python script", None),
+]
+
+_VERBS = ["list", "show", "find", "delete", "copy", "move", "compress", "count", "sort", "create", "download", "search"]
+_OBJECTS = ["files", "directories", "logs", "images", "python files", "branches", "containers", "packages", "processes", "lines"]
+_MODIFIERS = ["larger than {n}MB", "modified in the last {n} days", "named file{n}.txt", "in folder dir{n}",
+              "owned by user{n}", "older than {n} hours", "matching pattern{n}", "on port {n}"]
+
+
+def synthetic_instructions(count, seed=0):
+    """Distinct template-generated instructions for load testing"""
+    rng = random.Random(seed)
+    return [
+        f"{rng.choice(_VERBS)} {rng.choice(_OBJECTS)} "
+        + rng.choice(_MODIFIERS).format(n=i)
+        for i in range(count)
+    ]
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def token_f1(candidate, reference):
+    """Token-overlap F1 between two commands (a cheap stand-in for ROUGE)"""
+    candidate_tokens, reference_tokens = candidate.split(), reference.split()
+    common = sum(min(candidate_tokens.count(t), reference_tokens.count(t)) for t in set(candidate_tokens))
+    if not common:
+        return 0.0
+    precision, recall = common / len(candidate_tokens), common / len(reference_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def bench_semantic_cache(args):
+    from semantic_cache import SemanticCache
+
+    cache = SemanticCache(max_entries=args.entries + len(PARAPHRASES) + len(NEAR_MISSES))
+    start = time.perf_counter()
+    for instruction in synthetic_instructions(args.entries):
+        cache.put(instruction, ("<cmd>", ""))
+    for original, _ in PARAPHRASES + NEAR_MISSES:
+        cache.put(original, (original, ""))
+    print(f"Inserted {args.entries} entries in {time.perf_counter() - start:.2f}s")
+
+    queries = synthetic_instructions(args.queries, seed=1)
+    latencies = []
+    for query in queries:
+        t0 = time.perf_counter()
+        cache.get(query)
+        latencies.append(time.perf_counter() - t0)
+    print(f"Lookup latency over {len(queries)} queries: "
+          f"mean {statistics.mean(latencies) * 1e3:.3f} ms, "
+          f"p50 {_percentile(latencies, 0.5) * 1e3:.3f} ms, "
+          f"p99 {_percentile(latencies, 0.99) * 1e3:.3f} ms")
+
+    hits = sum(cache.get(paraphrase) == (original, "") for original, paraphrase in PARAPHRASES)
+    print(f"Paraphrase hit rate: {hits}/{len(PARAPHRASES)}")
+    false_hits = sum(cache.get(other) == (original, "") for original, other in NEAR_MISSES)
+    print(f"Near-miss false hits: {false_hits}/{len(NEAR_MISSES)} (threshold {cache.threshold})")
+
+
+def bench_retrieval(args):
+    from retrieval import load_index, RETRIEVAL_THRESHOLD
+
+    start = time.perf_counter()
+    index = load_index()
+    print(f"Index ready in {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    generate = None
+    if args.with_model:
+        from agent_utils import generate_command, initialize_model
+        initialize_model()
+        generate = lambda prompt: generate_command(prompt, fast_paths=False)[0]
+
+    print(f"\n| Prompt | Retrieved (score) | Retrieval ms | Retrieval F1 | Model | Model ms | Model F1 |")
+    print("|---|---|---|---|---|---|---|")
+    hits, retrieval_f1, model_f1 = 0, [], []
+    for prompt, reference in EVAL_PROMPTS:
+        t0 = time.perf_counter()
+        entry, score = index.search(prompt)
+        retrieval_ms = (time.perf_counter() - t0) * 1e3
+        retrieved = entry["command"] if entry is not None and score >= RETRIEVAL_THRESHOLD else None
+        hits += retrieved is not None
+
+        row = [prompt[:50], f"{retrieved or '-'} ({score:.2f})", f"{retrieval_ms:.3f}"]
+        if reference and retrieved:
+            retrieval_f1.append(token_f1(retrieved, reference))
+            row.append(f"{retrieval_f1[-1]:.2f}")
+        else:
+            row.append("-")
+
+        if generate is not None:
+            t0 = time.perf_counter()
+            command = generate(prompt)
+            row += [command, f"{(time.perf_counter() - t0) * 1e3:.0f}"]
+            if reference:
+                model_f1.append(token_f1(command, reference))
+                row.append(f"{model_f1[-1]:.2f}")
+            else:
+                row.append("-")
+        else:
+            row += ["(skipped)", "-", "-"]
+        print("| " + " | ".join(row) + " |")
+
+    print(f"\nRetrieval answered {hits}/{len(EVAL_PROMPTS)} prompts at threshold {RETRIEVAL_THRESHOLD}")
+    if retrieval_f1:
+        print(f"Mean token F1 of retrieved answers vs reference: {statistics.mean(retrieval_f1):.2f}")
+    if model_f1:
+        print(f"Mean token F1 of model answers vs reference: {statistics.mean(model_f1):.2f}")
+    elif generate is None:
+        print("Pass --with-model to compare against pure generation")
+
+
+def bench_rules(args):
+    from rules import Rule, RuleSet, FALLBACK_RULES
+
+    rng = random.Random(0)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 8)))
+                  for _ in range(5000)]
+    instructions = [" ".join(rng.choice(vocabulary) for _ in range(10)) for _ in range(200)]
+    instructions += [prompt for prompt, _ in EVAL_PROMPTS]
+
+    def cascade(rules, instruction):
+        # The pre-rule-table style: lowercase and scan keyword lists for every rule
+        for groups, command in rules:
+            if all(any(word in instruction.lower() for word in group) for group in groups):
+                return command
+        return None
+
+    def per_call_us(fn):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for instruction in instructions:
+                fn(instruction)
+        return (time.perf_counter() - start) / (args.repeat * len(instructions)) * 1e6
+
+    print(f"FALLBACK_RULES ({len(FALLBACK_RULES)} rules): {per_call_us(FALLBACK_RULES.resolve):.2f} us/call\n")
+    print("| Rules | Compile ms | Rule table us/call | if/elif cascade us/call |")
+    print("|---|---|---|---|")
+    for count in (10, 100, 1000, 5000):
+        specs = [
+            ([tuple(rng.sample(vocabulary, 3)), tuple(rng.sample(vocabulary, 2))], f"cmd-{i}")
+            for i in range(count)
+        ]
+        start = time.perf_counter()
+        rule_set = RuleSet(Rule(command, groups, command) for groups, command in specs)
+        compile_ms = (time.perf_counter() - start) * 1e3
+        compiled = per_call_us(rule_set.resolve)
+        naive = per_call_us(lambda instruction: cascade(specs, instruction))
+        print(f"| {count} | {compile_ms:.1f} | {compiled:.2f} | {naive:.2f} |")
+
+# Hand-written edge cases for fenced blocks, which the dataset answers rarely contain
+_FENCED_CASES = [
+    "Run this:\n```bash\ngit status\n```",
+    "```bash\n# comment first\nfor f in *; do echo $f; done\nls -la\n```\nthen\n```bash\npwd\n```",
+    "```bash\n```\ngit init\n```",
+    "Unclosed:\n```bash\ngit status\n",
+    "inline ```bash\n  mkdir demo  \n``` trailing\n```bash\nformat disk\n```",
+    "``````bash\ncd src\n``` ```bash\ncp a b\n```",
+    "```bash\r\ngit log\r\n```",
+    "```bash\na b c d e f g h i j k\n```",
+    "```python\nprint('hi')\n```\n$ python3 app.py\n`ls -la`\nUse `grep -r foo .` or `find . -name x`\n```git pull```",
+    "`` \n`x`\n`cd`\n`cd `\n` git status`\nsudo  apt update\ngit\tstatus\n$ \n$",
+]
+
+
+def extraction_corpus(long_plans=50, seed=0):
+    """Texts from the dataset answers, trace log, fenced-block edge cases and synthetic multi-KB plans"""
+    texts = []
+    dataset_path = BACKEND_DIR / "data" / "data" / "command_qa_cleaned.json"
+    if dataset_path.exists():
+        texts.extend(qa["answer"] for qa in json.loads(dataset_path.read_text(encoding="utf-8")))
+    trace_path = BACKEND_DIR / "logs" / "trace.jsonl"
+    if trace_path.exists():
+        plans = {}
+        for line in trace_path.read_text(encoding="utf-8").splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("step"):
+                texts.append(record["step"])
+                plans.setdefault(record.get("instruction"), []).append(record["step"])
+        texts.extend("\n".join(steps) for steps in plans.values())
+    texts.extend(_FENCED_CASES)
+
+    # Long plans: shuffled concatenations of the texts above, 4-32 KB each
+    rng = random.Random(seed)
+    pieces = list(texts)
+    for _ in range(long_plans if pieces else 0):
+        size = rng.randint(4096, 32768)
+        parts, length = [], 0
+        while length < size:
+            part = rng.choice(pieces)
+            parts.append(part)
+            length += len(part) + 1
+        texts.append("\n".join(parts))
+    return texts
+
+
+def _text_key(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def bench_extraction(args):
+    from agent_utils import extract_commands_from_text
+
+    corpus = extraction_corpus()
+    if args.update_golden:
+        golden = {_text_key(text): extract_commands_from_text(text) for text in corpus}
+        EXTRACTION_GOLDEN_PATH.write_text(json.dumps(golden, indent=0, sort_keys=True), encoding="utf-8")
+        print(f"Wrote {len(golden)} golden outputs to {EXTRACTION_GOLDEN_PATH}")
+        return
+
+    golden = json.loads(EXTRACTION_GOLDEN_PATH.read_text(encoding="utf-8"))
+    checked = mismatches = 0
+    for text in corpus:
+        expected = golden.get(_text_key(text))
+        if expected is None:
+            continue
+        checked += 1
+        if extract_commands_from_text(text) != expected:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"MISMATCH on {text[:80]!r}...")
+    print(f"Golden corpus: {checked}/{len(corpus)} texts checked, {mismatches} mismatches")
+
+    long_plans = [text for text in corpus if len(text) >= 4096]
+    for label, texts in (("all texts", corpus), ("multi-KB plans", long_plans)):
+        total_bytes = sum(len(text) for text in texts)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for text in texts:
+                extract_commands_from_text(text)
+        elapsed = time.perf_counter() - start
+        print(f"{label}: {len(texts)} texts, {total_bytes / 1024:.0f} KB, "
+              f"{total_bytes * args.repeat / elapsed / 1e6:.1f} MB/s, "
+              f"{elapsed / (args.repeat * len(texts)) * 1e6:.1f} us/text")
+    if mismatches:
+        sys.exit(1)
+
+# Runs in a fresh interpreter so imports, weights and RSS are measured from a cold process
+_COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import agent_utils
+from model_status import rss_mb
+agent_utils.start_model_loading(sys.argv[1], sys.argv[2] or None).join()
+status = agent_utils.load_status.snapshot()
+print(json.dumps({"ready": status["ready"], "error": status["error"], "stages": status["stage_seconds"],
+                  "seconds": time.perf_counter() - start, "rss_mb": rss_mb()}))
+"""
+
+
+def _cold_start(base_model, lora, artifact_path):
+    import os
+    import subprocess
+
+    env = dict(os.environ, MODEL_ARTIFACT_PATH=artifact_path)
+    result = subprocess.run(
+        [sys.executable, "-c", _COLD_START_SCRIPT, base_model, lora or ""],
+        cwd=str(BACKEND_DIR / "src"), env=env, capture_output=True, text=True,
+    )
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"cold start failed:\n{result.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+
+def bench_cli(args):
+    import os
+    import subprocess
+    import tempfile
+
+    prompts = [prompt for prompt, _ in EVAL_PROMPTS[:5]]
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep benchmark runs out of the real trace log and away from a user's daemon;
+        # no retrieval, so every call runs the model
+        env = dict(os.environ, AGENT_SOCKET=os.path.join(tmp, "agent.sock"), RETRIEVAL_THRESHOLD="0",
+                   TRACE_LOG_PATH=os.path.join(tmp, "trace.jsonl"), AGENT_DAEMON_LOG=os.path.join(tmp, "daemon.log"))
+        command = [sys.executable, str(BACKEND_DIR / "src" / "agent.py"), "--base-model", args.base_model]
+        if args.lora:
+            command += ["--lora", args.lora]
+
+        def run(prompt, *flags):
+            start = time.perf_counter()
+            result = subprocess.run(command + list(flags) + [prompt], env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"agent.py failed:\n{result.stderr[-2000:]}")
+            return time.perf_counter() - start
+
+        print(f"Wall time per `agent.py` invocation, {len(prompts)} prompts\n")
+        print("| Mode | Mean s | Min s | Max s |")
+        print("|---|---|---|---|")
+        try:
+            for label, flags, runs in (("in-process (--no-daemon)", ["--no-daemon"], prompts),
+                                       ("daemon, first call (auto-start + load)", [], prompts[:1]),
+                                       ("daemon, warm", [], prompts)):
+                times = [run(prompt, *flags) for prompt in runs]
+                print(f"| {label} | {statistics.mean(times):.2f} | {min(times):.2f} | {max(times):.2f} |")
+        finally:
+            subprocess.run(command + ["--stop-daemon"], env=env, capture_output=True)
+
+
+def bench_cold_start(args):
+    from model_artifact import read_manifest, MODEL_ARTIFACT_PATH
+
+    artifact_path = args.artifact or MODEL_ARTIFACT_PATH
+    manifest = read_manifest(artifact_path)
+    runs = [("base + LoRA", "")]
+    if manifest is None:
+        print(f"No artifact at {artifact_path}; build one with 'python src/model_artifact.py build'")
+    else:
+        runs.append((f"artifact ({manifest['quantization']}, {manifest['dtype']})", artifact_path))
+
+    print("| Load path | Time to ready s | RSS MB | Stages |")
+    print("|---|---|---|---|")
+    for label, path in runs:
+        result = _cold_start(args.base_model, args.lora, path)
+        if not result["ready"]:
+            print(f"| {label} | failed: {result['error']} | | |")
+            continue
+        stages = ", ".join(f"{stage} {seconds:.2f}" for stage, seconds in result["stages"].items())
+        print(f"| {label} | {result['seconds']:.2f} | {result['rss_mb']:.0f} | {stages} |")
+
+# Loads the model under one CPU configuration and times fixed-length greedy generations
+_CPU_SCRIPT = """
+import json, sys, time
+import torch
+import agent_utils
+from model_status import rss_mb
+base_model, lora, new_tokens, prompts = sys.argv[1], sys.argv[2] or None, int(sys.argv[3]), json.loads(sys.argv[4])
+start = time.perf_counter()
+model, tokenizer, _ = agent_utils.initialize_model(base_model, lora)
+load_seconds = time.perf_counter() - start
+prompts = [agent_utils.build_prompt(p, tokenizer, base_model) for p in prompts]
+
+def run(prompt):
+    inputs = tokenizer([prompt], return_tensors="pt")
+    with torch.inference_mode():
+        model.generate(**inputs, max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False,
+                       pad_token_id=tokenizer.pad_token_id)
+
+run(prompts[0])
+start = time.perf_counter()
+for prompt in prompts:
+    run(prompt)
+elapsed = time.perf_counter() - start
+print(json.dumps({"tokens_per_second": new_tokens * len(prompts) / elapsed, "latency": elapsed / len(prompts),
+                  "load_seconds": load_seconds, "rss_mb": rss_mb(), "threads": torch.get_num_threads()}))
+"""
+
+
+def bench_cpu(args):
+    import os
+    import subprocess
+
+    prompts = [prompt for prompt, _ in EVAL_PROMPTS[:8]]
+    thread_counts = [int(t) for t in args.threads.split(",")]
+    print(f"{len(prompts)} prompts x {args.new_tokens} new tokens, greedy\n")
+    print("| Mode | Threads | Tokens/s | Latency s | Load s | RSS MB |")
+    print("|---|---|---|---|---|---|")
+    for mode in ("none", "bf16", "int8"):
+        for threads in thread_counts:
+            env = dict(os.environ, CPU_QUANTIZATION=mode, CPU_THREADS=str(threads), CUDA_VISIBLE_DEVICES="")
+            if args.artifact is not None:
+                env["MODEL_ARTIFACT_PATH"] = args.artifact
+            result = subprocess.run(
+                [sys.executable, "-c", _CPU_SCRIPT, args.base_model, args.lora or "", str(args.new_tokens),
+                 json.dumps(prompts)],
+                cwd=str(BACKEND_DIR / "src"), env=env, capture_output=True, text=True,
+            )
+            lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+            if result.returncode != 0 or not lines:
+                print(f"| {mode} | {threads or 'auto'} | failed: {result.stderr.strip().splitlines()[-1:]} | | | |")
+                continue
+            r = json.loads(lines[-1])
+            print(f"| {mode} | {r['threads']} | {r['tokens_per_second']:.1f} | {r['latency']:.2f} | "
+                  f"{r['load_seconds']:.1f} | {r['rss_mb']:.0f} |")
+
+
+# Local HTTP/1.1 (keep-alive) stand-in for model_server.py, run in its own process so it
+# does not compete with the client for the GIL. Prints its port, then serves until killed.
+_STUB_SCRIPT = """
+import json, random, sys, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+delay, slow_fraction, slow_delay = map(float, sys.argv[1:4])
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Like uvicorn: without TCP_NODELAY, keep-alive responses stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(slow_delay if random.random() < slow_fraction else delay)
+        body = json.dumps({"response": "ls -la"}).encode("utf-8")
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the losing request of a hedged pair was cancelled
+
+    def log_message(self, *args):
+        pass
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for a connection per request from the per-call client
+    request_queue_size = 256
+
+server = Server(("127.0.0.1", 0), Handler)
+print(server.server_port, flush=True)
+server.serve_forever()
+"""
+
+
+def _stub_endpoint(delay, slow_fraction=0.0, slow_delay=0.0):
+    """Start a stub endpoint that answers after `delay` seconds; returns (process, url)"""
+    import subprocess
+
+    process = subprocess.Popen([sys.executable, "-c", _STUB_SCRIPT, str(delay), str(slow_fraction), str(slow_delay)],
+                               stdout=subprocess.PIPE, text=True)
+    port = int(process.stdout.readline())
+    return process, f"http://127.0.0.1:{port}/generate"
+
+def _proxy_run(call, prompts, concurrency):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def timed(prompt):
+        t0 = time.perf_counter()
+        call(prompt)
+        return time.perf_counter() - t0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(timed, prompts))
+    return latencies, len(prompts) / (time.perf_counter() - start)
+
+
+def bench_proxy(args):
+    import requests
+    from remote_client import RemoteModelClient
+    import remote_client
+
+    delay = 0.002
+    server, url = _stub_endpoint(delay)
+    prompts = synthetic_instructions(args.queries)
+    pooled = RemoteModelClient([url])
+
+    def per_call(prompt):
+        # What RemoteBackend did before: a new connection per request
+        resp = requests.post(url, json={"prompt": prompt}, timeout=120)
+        resp.raise_for_status()
+        return resp.json()
+
+    print(f"Stub endpoint answering in {delay * 1e3:.0f} ms, {len(prompts)} requests; "
+          f"overhead = latency - stub delay\n")
+    print("| Client | Concurrency | Overhead p50 ms | Overhead p99 ms | Requests/s |")
+    print("|---|---|---|---|---|")
+    for concurrency in (1, args.concurrency):
+        for label, call in (("requests.post per call", per_call), ("pooled httpx client", pooled.generate_sync)):
+            _proxy_run(call, prompts[:20], concurrency)
+            latencies, throughput = _proxy_run(call, prompts, concurrency)
+            print(f"| {label} | {concurrency} | {(_percentile(latencies, 0.5) - delay) * 1e3:.2f} | "
+                  f"{(_percentile(latencies, 0.99) - delay) * 1e3:.2f} | {throughput:.0f} |")
+    pooled.close()
+    server.kill()
+
+    # Tail latency with two endpoints where 5% of responses are slow
+    servers = [_stub_endpoint(delay, slow_fraction=0.05, slow_delay=0.2) for _ in range(2)]
+    urls = [endpoint for _, endpoint in servers]
+    print("\nTwo endpoints, 5% of responses take 200 ms:\n")
+    print("| Hedging | p50 ms | p99 ms | Hedged requests |")
+    print("|---|---|---|---|")
+    for hedge_ms in (0, 20):
+        client = RemoteModelClient(urls, hedge_delay_ms=hedge_ms)
+        hedges = remote_client._hedges.value
+        # One client at a time, so queueing on a busy machine does not trigger hedges
+        latencies, _ = _proxy_run(client.generate_sync, prompts, 1)
+        print(f"| {f'after {hedge_ms} ms' if hedge_ms else 'off'} | {_percentile(latencies, 0.5) * 1e3:.1f} | "
+              f"{_percentile(latencies, 0.99) * 1e3:.1f} | {remote_client._hedges.value - hedges} |")
+        client.close()
+    for stub, _ in servers:
+        stub.kill()
+
+
+def _old_log_command(instruction, command, log_path):
+    """log_command before the trace logger: makedirs, open, append, close per call"""
+    import os
+
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, "a", encoding="utf-8") as logf:
+        logf.write(json.dumps({"instruction": instruction, "step": command}) + "\n")
+
+
+def bench_trace_log(args):
+    import gzip
+    import os
+    import tempfile
+    import trace_log
+
+    instructions = synthetic_instructions(1000)
+    rng = random.Random(0)
+    records = [{"instruction": instructions[i % len(instructions)], "step": "find . -name '*.py' | head",
+                "ts": 1.7e9 + i, "latency_ms": round(rng.uniform(1, 800), 1), "cache_hit": rng.random() < 0.3,
+                "backend": rng.choice(["transformers", "remote"])} for i in range(args.entries)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        calls = records[:min(len(records), 20000)]
+        print(f"Request-path cost over {len(calls)} calls:\n")
+        print("| Logger | Mean us | p99 us |")
+        print("|---|---|---|")
+        old_path = os.path.join(tmp, "old", "trace.jsonl")
+        logger = trace_log.TraceLogger(os.path.join(tmp, "new", "trace.jsonl"), buffer_size=len(calls))
+        for label, call in (("open/append/close per call", lambda r: _old_log_command(r["instruction"], r["step"], old_path)),
+                            ("ring buffer + background flusher", lambda r: logger.log(dict(r)))):
+            latencies = []
+            for record in calls:
+                t0 = time.perf_counter()
+                call(record)
+                latencies.append(time.perf_counter() - t0)
+            print(f"| {label} | {statistics.mean(latencies) * 1e6:.1f} | {_percentile(latencies, 0.99) * 1e6:.1f} |")
+        logger.close()
+
+        # Scanning the analysis columns of a rotated segment
+        jsonl_path = os.path.join(tmp, "segment.jsonl")
+        with open(jsonl_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        with open(jsonl_path, "rb") as src, gzip.open(jsonl_path + ".gz", "wb") as dst:
+            dst.write(src.read())
+        npz_path = os.path.join(tmp, "segment.npz")
+        trace_log.write_columnar(jsonl_path, npz_path)
+
+        print(f"\nScanning latency_ms/cache_hit/backend of {len(records)} records:\n")
+        print("| Segment format | Size MB | Scan s | Records/s |")
+        print("|---|---|---|---|")
+        columns = ("latency_ms", "cache_hit", "backend")
+        for label, path, scan in (
+            ("JSONL + gzip", jsonl_path + ".gz", lambda: trace_log._select(
+                trace_log._columns_from_records(trace_log._read_jsonl(jsonl_path + ".gz")), columns)),
+            ("columnar .npz", npz_path, lambda: trace_log._read_columnar(npz_path, columns)),
+        ):
+            start = time.perf_counter()
+            data = scan()
+            elapsed = time.perf_counter() - start
+            assert len(data["latency_ms"]) == len(records)
+            print(f"| {label} | {os.path.getsize(path) / 1e6:.1f} | {elapsed:.3f} | {len(records) / elapsed:,.0f} |")
+
+
+# Modules imported at startup by the API, the agent daemon's client and everything else
+_STARTUP_MODULES = ("agent_daemon", "agent_utils", "api")
+# Only the local-inference path may import these
+_LOCAL_ONLY_MODULES = ("torch", "transformers", "peft", "accelerate", "bitsandbytes", "llama_cpp")
+
+
+def _import_profile(module, env):
+    """Parse `python -X importtime -c "import module"` into (cumulative_us, self_us, depth, name) rows"""
+    import subprocess
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=str(BACKEND_DIR / "src"), env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative_us), int(self_us), depth, name.strip()))
+    return rows
+
+
+def bench_import_time(args):
+    import os
+
+    env = dict(os.environ, MODEL_ENDPOINT_URL="http://127.0.0.1:9/generate")
+    print(f"Proxy-mode import time (MODEL_ENDPOINT_URL set), best of {args.repeat}, budget {args.budget_ms:.0f} ms\n")
+    print("| Module | Import ms | Local-inference modules imported | Heaviest imports |")
+    print("|---|---|---|---|")
+    failures = []
+    for module in _STARTUP_MODULES:
+        profiles = [_import_profile(module, env) for _ in range(args.repeat)]
+        rows = min(profiles, key=lambda rows: next(r[0] for r in rows if r[3] == module and r[2] == 0))
+        # Children are reported before their parent: the module's subtree is the run of rows above its own
+        end = next(i for i, r in enumerate(rows) if r[3] == module and r[2] == 0)
+        start = end
+        while start > 0 and rows[start - 1][2] > 0:
+            start -= 1
+        total_ms = rows[end][0] / 1000
+        heavy = [m for m in _LOCAL_ONLY_MODULES if m in {r[3] for r in rows}]
+        children = sorted((r for r in rows[start:end] if r[2] == 1), reverse=True)[:4]
+        heaviest = ", ".join(f"{r[3]} {r[0] / 1000:.0f}" for r in children)
+        print(f"| {module} | {total_ms:.0f} | {', '.join(heavy) or 'none'} | {heaviest} |")
+        if heavy:
+            failures.append(f"{module} imports {', '.join(heavy)}")
+        if total_ms > args.budget_ms:
+            failures.append(f"{module} takes {total_ms:.0f} ms to import (budget {args.budget_ms:.0f} ms)")
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+
+
+def bench_overhead(args):
+    import agent_utils
+    from prompt_templates import SYSTEM_PROMPT
+
+    model, tokenizer, _ = agent_utils.initialize_model(args.base_model, args.lora)
+    backend = agent_utils.TransformersBackend(args.base_model, args.lora)
+    prompts = [prompt for prompt, _ in EVAL_PROMPTS]
+    agent_utils.GENERATION_KWARGS.update(max_new_tokens=args.new_tokens)
+
+    # Time spent inside model.generate; everything else is per-request overhead
+    inside = []
+    generate = model.generate
+
+    def timed_generate(*a, **kw):
+        start = time.perf_counter()
+        try:
+            return generate(*a, **kw)
+        finally:
+            inside.append(time.perf_counter() - start)
+
+    model.generate = timed_generate
+    try:
+        backend.generate(prompts[0])  # warm up
+        overhead, leaked = [], 0
+        for _ in range(args.repeat):
+            for prompt in prompts:
+                inside.clear()
+                start = time.perf_counter()
+                _, plan = backend.generate(prompt)
+                overhead.append(time.perf_counter() - start - sum(inside))
+                leaked += SYSTEM_PROMPT in plan or prompt in plan
+    finally:
+        del model.generate
+
+    def per_call(fn, count=2000):
+        start = time.perf_counter()
+        for i in range(count):
+            fn(prompts[i % len(prompts)])
+        return (time.perf_counter() - start) / count * 1e6
+
+    print(f"{len(overhead)} requests, {args.new_tokens} max new tokens\n")
+    print("| Stage | us/request |")
+    print("|---|---|")
+    print(f"| build_prompt | {per_call(lambda p: agent_utils.build_prompt(p, tokenizer, args.base_model)):.1f} |")
+    print(f"| build_prompt + tokenize | "
+          f"{per_call(lambda p: tokenizer([agent_utils.build_prompt(p, tokenizer, args.base_model)])):.1f} |")
+    print(f"| Total outside model.generate (p50) | {_percentile(overhead, 0.5) * 1e6:.0f} |")
+    print(f"| Total outside model.generate (p99) | {_percentile(overhead, 0.99) * 1e6:.0f} |")
+    print(f"\nPlans containing the prompt: {leaked}/{len(overhead)}")
+
+
+def _memory_mb(pid):
+    """Summed RSS and PSS of a process and all its descendants (PSS splits shared pages between them)"""
+    rss = pss = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                stack.extend(int(child) for child in f.read().split())
+            with open(f"/proc/{current}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Rss:"):
+                        rss += int(line.split()[1])
+                    elif line.startswith("Pss:"):
+                        pss += int(line.split()[1])
+        except OSError:
+            pass
+    return rss / 1024, pss / 1024
+
+
+def bench_workers(args):
+    import http.client
+    import os
+    import signal
+    import socket
+    import subprocess
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    requests = args.concurrency * 4
+    prompts = synthetic_instructions(requests * len(args.workers.split(",")), seed=1)
+
+    def post(port, prompt):
+        start = time.perf_counter()
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+        try:
+            conn.request("POST", "/generate", json.dumps({"prompt": prompt}), {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError(f"/generate returned {response.status}")
+        finally:
+            conn.close()
+        return time.perf_counter() - start
+
+    def ready(port):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/ready")
+            return conn.getresponse().status == 200
+        except OSError:
+            return False
+
+    print(f"{requests} distinct prompts per run, {args.concurrency} concurrent clients, caches off\n")
+    print("| Workers | Requests/s | p50 latency s | Total RSS MB | Total PSS MB | Separate processes PSS MB (est.) |")
+    print("|---|---|---|---|---|---|")
+    single_pss = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for run, workers in enumerate(int(w) for w in args.workers.split(",")):
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+            env = dict(os.environ, BASE_MODEL=args.base_model, RESPONSE_CACHE_SIZE="0", SEMANTIC_CACHE_SIZE="0",
+                       RETRIEVAL_THRESHOLD="0", COALESCE_REQUESTS="0", TRACE_LOG_PATH=os.path.join(tmp, "trace.jsonl"))
+            if args.lora:
+                env["LORA_ADAPTER_PATH"] = args.lora
+            server = subprocess.Popen(
+                [sys.executable, str(BACKEND_DIR / "run_server.py"), "--host", "127.0.0.1", "--port", str(port),
+                 "--workers", str(workers)],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                # Each /ready lands on some worker: wait until a run of them all answer ready
+                streak = 0
+                while streak < 3 * workers:
+                    if server.poll() is not None:
+                        raise RuntimeError(f"run_server.py exited with code {server.returncode}")
+                    streak = streak + 1 if ready(port) else 0
+                    time.sleep(0.05 if streak else 0.5)
+                batch = prompts[run * requests:(run + 1) * requests]
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                    latencies = list(pool.map(lambda prompt: post(port, prompt), batch))
+                elapsed = time.perf_counter() - start
+                rss, pss = _memory_mb(server.pid)
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=60)
+            if single_pss is None and workers == 1:
+                single_pss = pss
+            separate = f"{single_pss * workers:.0f}" if single_pss is not None else "-"
+            print(f"| {workers} | {requests / elapsed:.2f} | {_percentile(latencies, 0.5):.2f} | {rss:.0f} | "
+                  f"{pss:.0f} | {separate} |")
+
+
+def bench_prefix_cache(args):
+    import agent_utils
+
+    model, tokenizer, _ = agent_utils.initialize_model(args.base_model, args.lora)
+    prefix = agent_utils._prompt_prefix(model, tokenizer, args.base_model)
+    if prefix is None:
+        print(f"No shared prompt prefix for {args.base_model} (or PREFIX_CACHE=0)")
+        return
+    words = " ".join(synthetic_instructions(200)).split()
+    batch_sizes = sorted({1, max(1, args.concurrency // 4)})
+    print(f"Prefill (generate with max_new_tokens=1), best of {args.repeat}; "
+          f"cached prefix = {len(prefix)} tokens (template + SYSTEM_PROMPT)\n")
+    print("| Instruction words | Prompt tokens | Batch | Full prefill ms/request | Prefix KV ms/request | Speedup |")
+    print("|---|---|---|---|---|---|")
+    for length in (4, 16, 64, 256):
+        for batch in batch_sizes:
+            prompts = [agent_utils.build_prompt(" ".join(words[i * 7:i * 7 + length]), tokenizer, args.base_model)
+                       for i in range(batch)]
+            tokens = max(len(row) for row in tokenizer(prompts)["input_ids"])
+            timings = []
+            for use_prefix in (None, prefix):
+                best = float("inf")
+                for _ in range(args.repeat + 1):  # first pass warms up
+                    start = time.perf_counter()
+                    agent_utils.generate_texts(prompts, model, tokenizer, prefix=use_prefix,
+                                               max_new_tokens=1, do_sample=False)
+                    best = min(best, time.perf_counter() - start)
+                timings.append(best * 1e3 / batch)
+            print(f"| {length} | {tokens} | {batch} | {timings[0]:.1f} | {timings[1]:.1f} | "
+                  f"{timings[0] / timings[1]:.2f}x |")
+
+
+def bench_adapters(args):
+    import agent_utils
+    from adapters import parse_adapters
+
+    extra = parse_adapters(args.adapters)
+    if not extra:
+        print("Pass the adapters to load with --adapters name=path[,name=path...]")
+        return
+    agent_utils.initialize_model(args.base_model, args.lora)
+    adapters = agent_utils.get_adapters(args.base_model, args.lora)
+    loaded = [name for name, path in extra.items() if name not in adapters.names()]
+    for name in loaded:
+        agent_utils.load_adapter(name, extra[name], args.base_model, args.lora)
+    info = adapters.snapshot()["adapters"]
+    print("| Adapter | Load s | Weights MB | RSS delta MB |")
+    print("|---|---|---|---|")
+    for name, entry in info.items():
+        print(f"| {name} | {entry['load_seconds'] if entry['load_seconds'] is not None else 'startup'} | "
+              f"{entry['weights_mb']} | {entry['rss_delta_mb'] if entry['rss_delta_mb'] is not None else '-'} |")
+
+    names = list(info)
+    swaps = []
+    for i in range(args.queries):
+        start = time.perf_counter()
+        with adapters.use(names[i % len(names)]):
+            swaps.append(time.perf_counter() - start)
+    print(f"\nSwap (use() with a different adapter each time), {len(swaps)} swaps: "
+          f"p50 {_percentile(swaps, 0.5) * 1e3:.2f} ms, p99 {_percentile(swaps, 0.99) * 1e3:.2f} ms")
+
+    agent_utils.GENERATION_KWARGS.update(max_new_tokens=args.new_tokens)
+    prompts = [prompt for prompt, _ in EVAL_PROMPTS]
+    print(f"\n{len(prompts) * args.repeat} requests per row, {args.new_tokens} max new tokens\n")
+    print("| Requests | p50 ms | p99 ms |")
+    print("|---|---|---|")
+    for label, pick in (("all on the default adapter", lambda i: None),
+                        ("alternating between adapters", lambda i: names[i % len(names)])):
+        agent_utils.generate_command(prompts[0], base_model_name=args.base_model, lora_adapter_path=args.lora,
+                                     fast_paths=False, adapter=pick(1))  # warm up
+        latencies = []
+        for i in range(len(prompts) * args.repeat):
+            start = time.perf_counter()
+            agent_utils.generate_command(prompts[i % len(prompts)], base_model_name=args.base_model,
+                                         lora_adapter_path=args.lora, fast_paths=False, adapter=pick(i))
+            latencies.append(time.perf_counter() - start)
+        print(f"| {label} | {_percentile(latencies, 0.5) * 1e3:.0f} | {_percentile(latencies, 0.99) * 1e3:.0f} |")
+
+    for name in loaded:
+        agent_utils.unload_adapter(name, args.base_model, args.lora)
+
+
+def bench_constrained(args):
+    import agent_utils
+    import constrained
+
+    agent_utils.initialize_model(args.base_model, args.lora)
+    agent_utils.GENERATION_KWARGS.update(max_new_tokens=args.new_tokens, do_sample=False)
+    generated = agent_utils._generated_tokens
+    print(f"Greedy, {len(EVAL_PROMPTS) * args.repeat} requests per mode, {args.new_tokens} max new tokens\n")
+    print("| Output | p50 ms | p99 ms | Tokens/request | Token F1 | No command | Incomplete |")
+    print("|---|---|---|---|---|---|---|")
+    for mode in constrained.MODES:
+        constrained.CONSTRAINED_OUTPUT = mode
+        agent_utils.generate_command(EVAL_PROMPTS[0][0], base_model_name=args.base_model,
+                                     lora_adapter_path=args.lora, fast_paths=False)  # warm up (and build the grammar)
+        tokens, count, unparsed = generated._sum, generated._count, constrained._unparsed.value
+        latencies, f1, missing = [], [], 0
+        for _ in range(args.repeat):
+            for prompt, reference in EVAL_PROMPTS:
+                start = time.perf_counter()
+                command, _ = agent_utils.generate_command(prompt, base_model_name=args.base_model,
+                                                          lora_adapter_path=args.lora, fast_paths=False)
+                latencies.append(time.perf_counter() - start)
+                if reference:
+                    f1.append(token_f1(command, reference))
+                missing += command.startswith("#")
+        print(f"| {mode} | {_percentile(latencies, 0.5) * 1e3:.0f} | {_percentile(latencies, 0.99) * 1e3:.0f} | "
+              f"{(generated._sum - tokens) / (generated._count - count):.1f} | {sum(f1) / len(f1):.2f} | "
+              f"{missing}/{len(latencies)} | {constrained._unparsed.value - unparsed}/{len(latencies)} |")
+
+
+def bench_profiles(args):
+    import agent_utils
+    from generation_profiles import PROFILES
+    from response_cache import is_cacheable
+
+    agent_utils.initialize_model(args.base_model, args.lora)
+    generated = agent_utils._generated_tokens
+    requests = len(EVAL_PROMPTS) * args.repeat
+    print(f"{requests} requests per profile, one at a time, model only (no caches or fast paths)\n")
+    print("| Profile | Settings | p50 ms | p99 ms | Tokens/request | Tokens/s | Cacheable |")
+    print("|---|---|---|---|---|---|---|")
+    for name, settings in PROFILES.items():
+        agent_utils.generate_command(EVAL_PROMPTS[0][0], base_model_name=args.base_model, lora_adapter_path=args.lora,
+                                     fast_paths=False, profile=name)  # warm up
+        tokens, count = generated._sum, generated._count
+        latencies = []
+        for i in range(requests):
+            start = time.perf_counter()
+            agent_utils.generate_command(EVAL_PROMPTS[i % len(EVAL_PROMPTS)][0], base_model_name=args.base_model,
+                                         lora_adapter_path=args.lora, fast_paths=False, profile=name)
+            latencies.append(time.perf_counter() - start)
+        tokens, count = generated._sum - tokens, generated._count - count
+        described = ", ".join(f"{key}={value}" for key, value in settings.items())
+        print(f"| {name} | {described} | {_percentile(latencies, 0.5) * 1e3:.0f} | "
+              f"{_percentile(latencies, 0.99) * 1e3:.0f} | {tokens / count:.1f} | {tokens / sum(latencies):.1f} | "
+              f"{'yes' if is_cacheable(settings) else 'no'} |")
+
+
+def bench_speculative(args):
+    import agent_utils
+    import speculative
+
+    model, tokenizer, _ = agent_utils.initialize_model(args.base_model, args.lora)
+    if args.draft_model:
+        speculative.DRAFT_MODEL = args.draft_model
+    prompts = [agent_utils.build_prompt(prompt, tokenizer, args.base_model) for prompt, _ in EVAL_PROMPTS]
+    settings = dict(max_new_tokens=args.new_tokens, do_sample=False,
+                    pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id)
+    print(f"Greedy, one prompt per generate call, {len(prompts) * args.repeat} prompts, "
+          f"{args.new_tokens} max new tokens, {speculative.SPECULATIVE_TOKENS} draft tokens per step; "
+          f"draft model {speculative.DRAFT_MODEL}\n")
+    print("| Mode | Tokens/s | ms/request | Acceptance | Same output as off |")
+    print("|---|---|---|---|---|")
+    baseline = None
+    for mode in speculative.MODES:
+        def generate(prompt):
+            inputs = tokenizer([prompt], return_tensors="pt").to(model.device)
+            outputs = speculative.assisted_generate(model, tokenizer, inputs, mode=mode, **settings)
+            return outputs[0, inputs["input_ids"].shape[1]:].tolist()
+
+        generate(prompts[0])  # warm up (and load the draft model)
+        drafted, accepted = speculative._drafted.value, speculative._accepted.value
+        tokens, results = 0, []
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for prompt in prompts:
+                results.append(generate(prompt))
+                tokens += len(results[-1])
+        elapsed = time.perf_counter() - start
+        baseline = baseline or results
+        drafted = speculative._drafted.value - drafted
+        acceptance = f"{(speculative._accepted.value - accepted) / drafted:.0%}" if drafted else "-"
+        same = sum(result == expected for result, expected in zip(results, baseline))
+        print(f"| {mode} | {tokens / elapsed:.1f} | {elapsed * 1e3 / len(results):.0f} | {acceptance} | "
+              f"{same}/{len(results)} |")
+
+
+BENCHMARKS = {
+    "adapters": bench_adapters,
+    "cli": bench_cli,
+    "cold-start": bench_cold_start,
+    "constrained": bench_constrained,
+    "cpu": bench_cpu,
+    "extraction": bench_extraction,
+    "import-time": bench_import_time,
+    "overhead": bench_overhead,
+    "prefix-cache": bench_prefix_cache,
+    "profiles": bench_profiles,
+    "proxy": bench_proxy,
+    "retrieval": bench_retrieval,
+    "rules": bench_rules,
+    "semantic-cache": bench_semantic_cache,
+    "speculative": bench_speculative,
+    "trace-log": bench_trace_log,
+    "workers": bench_workers,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--entries", type=int, default=100000, help="cache/index size to benchmark against")
+    parser.add_argument("--queries", type=int, default=1000, help="number of timed queries")
+    parser.add_argument("--with-model", action="store_true", help="also run the local model for comparison")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the inputs for microbenchmarks")
+    parser.add_argument("--base-model", default="microsoft/Phi-3-mini-4k-instruct", help="base model to load")
+    parser.add_argument("--lora", default=None, help="LoRA adapter path (default: lora_adapter/lora_adapter)")
+    parser.add_argument("--artifact", default=None, help="model artifact directory (default: MODEL_ARTIFACT_PATH)")
+    parser.add_argument("--threads", default="0", help="comma-separated CPU thread counts (0 = from cgroup quota)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients for load benchmarks")
+    parser.add_argument("--new-tokens", type=int, default=64, help="tokens generated per prompt")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated server worker counts")
+    parser.add_argument("--adapters", default="", help="adapters for the adapters benchmark, as name=path,...")
+    parser.add_argument("--draft-model", default=None, help="draft model for the speculative benchmark (default: DRAFT_MODEL)")
+    parser.add_argument("--budget-ms", type=float, default=500, help="import-time budget per startup module")
+    parser.add_argument("--update-golden", action="store_true",
+                        help="record the current extraction outputs as the golden corpus")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
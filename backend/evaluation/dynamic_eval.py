@@ -12,6 +12,7 @@ PROMPTS = [
 ]
 
 print("# Dynamic Evaluation Results\n")
+print(f"Generation profile: {os.getenv('GENERATION_PROFILE', 'balanced')}\n")
 print("## Scoring Table\n")
 print("| Prompt | Agent Output Quality (0-2) | Comments (optional) |")
 print("|--------|----------------------------|---------------------|")
@@ -21,6 +22,8 @@ print("\n---\n")
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SRC_DIR = os.path.join(PROJECT_ROOT, "src")
+# Generation profile the agent answers with (see src/generation_profiles.py)
+PROFILE = os.getenv("GENERATION_PROFILE", "balanced")
 
 for i, prompt in enumerate(PROMPTS, 1):
     print(f"## Prompt {i}")
@@ -28,7 +31,7 @@ for i, prompt in enumerate(PROMPTS, 1):
     print("**Agent Output:**\n```")
     try:
         result = subprocess.run(
-            ["python", "agent.py", prompt],
+            ["python", "agent.py", "--profile", PROFILE, prompt],
             cwd=SRC_DIR,
             capture_output=True, text=True, check=True
         )
@@ -5,6 +5,9 @@ from peft import PeftModel
 import torch
 from rouge_score import rouge_scorer
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from generation_profiles import GENERATION_PROFILE, get_profile
+
 # Prompts for evaluation
 PROMPTS = [
     "Create a new Git branch and switch to it.",
@@ -35,11 +38,7 @@ def generate_response(model, tokenizer, prompt, device):
     inputs = tokenizer(prompt_text, return_tensors="pt").to(device)
     outputs = model.generate(
         **inputs,
-        max_new_tokens=150,
-        do_sample=True,
-        temperature=0.7,
-        top_p=0.9,
-        repetition_penalty=1.1,
+        **get_profile(),
         pad_token_id=tokenizer.eos_token_id,
         eos_token_id=tokenizer.eos_token_id
     )
@@ -53,7 +52,7 @@ def generate_response(model, tokenizer, prompt, device):
 
 def main():
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Using device: {device}")
+    print(f"Using device: {device}, generation profile: {GENERATION_PROFILE}")
     print("Loading base model and tokenizer...")
     tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
     base_model = AutoModelForCausalLM.from_pretrained(
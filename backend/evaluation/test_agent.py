@@ -12,11 +12,14 @@ from pathlib import Path
 # Add src to path
 sys.path.append(str(Path(__file__).parent.parent / "src"))
 
+# Generation profile the agent answers with (see src/generation_profiles.py)
+PROFILE = os.getenv("GENERATION_PROFILE", "balanced")
+
 def test_agent(instruction):
     """Test the agent with a given instruction"""
     try:
         result = subprocess.run(
-            [sys.executable, "../src/agent.py", instruction],
+            [sys.executable, "../src/agent.py", "--profile", PROFILE, instruction],
             capture_output=True,
             text=True,
             timeout=30
@@ -57,7 +60,7 @@ def main():
         "Run a Python script"
     ]
     
-    print("🚀 Testing CLI Agent Performance\n")
+    print(f"🚀 Testing CLI Agent Performance (profile: {PROFILE})\n")
     print("=" * 50)
     
     results = []
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 """
 Start the FastAPI server for Prompt2Shell backend.
-Run from the backend directory: python run_server.py
+Run from the backend directory: python run_server.py [--workers N]
+
+With more than one worker the model is loaded once and shared by forked
+worker processes (see src/prefork.py).
 """
-import uvicorn
+import argparse
 import sys
 import os
 
@@ -13,8 +16,15 @@ src_dir = os.path.join(backend_dir, "src")
 sys.path.insert(0, src_dir)
 
 # Now import the app directly
-from api import app
+from api import app, BASE_MODEL, LORA_ADAPTER_PATH
+import prefork
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=5000, reload=False)
-
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "5000")))
+    parser.add_argument("--workers", type=int, default=prefork.SERVER_WORKERS,
+                        help="server processes sharing one loaded model (default: SERVER_WORKERS)")
+    args = parser.parse_args()
+    prefork.serve(app, host=args.host, port=args.port, workers=args.workers,
+                  base_model_name=BASE_MODEL, lora_adapter_path=LORA_ADAPTER_PATH)
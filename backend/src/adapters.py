@@ -0,0 +1,191 @@
+"""
+Named LoRA adapters on one base model.
+PEFT keeps every loaded adapter next to the shared base weights and runs one
+of them at a time, so a request for another adapter only switches the active
+one (no weight copy). Generations on the active adapter run concurrently;
+a swap waits until they have finished, and requests for other adapters that
+are already waiting go first so no adapter is starved. Loading and unloading
+take the model exclusively.
+"""
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from model_status import rss_mb
+
+
+# Extra adapters loaded at startup, as comma-separated name=path pairs
+LORA_ADAPTERS = os.getenv("LORA_ADAPTERS", "")
+# Name of the adapter loaded from LORA_ADAPTER_PATH (PEFT's default adapter name)
+DEFAULT_ADAPTER = "default"
+
+_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+
+_swaps = metrics.counter("adapter_swaps_total", "Active LoRA adapter changes")
+_swap_seconds = metrics.histogram(
+    "adapter_swap_seconds",
+    [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1],
+    "Time to make another loaded adapter the active one",
+)
+_swap_wait = metrics.histogram(
+    "adapter_wait_seconds",
+    [0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0],
+    "Time a generation waited for the model to run its adapter",
+)
+
+
+class AdapterError(ValueError):
+    """An adapter request that cannot be served (unknown name, unsupported model, ...)"""
+
+
+def parse_adapters(value=LORA_ADAPTERS):
+    """Parse "name=path,name=path" into a dict"""
+    adapters = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        name, separator, path = entry.partition("=")
+        if not separator or not name.strip() or not path.strip():
+            raise AdapterError(f"LORA_ADAPTERS entries must look like name=path, got {entry!r}")
+        adapters[name.strip()] = path.strip()
+    return adapters
+
+
+class LoraAdapters:
+    """The adapters loaded into one PeftModel, and which of them is active."""
+
+    def __init__(self, model, default_path):
+        self.model = model
+        self._condition = threading.Condition()
+        self._active = model.active_adapter
+        self._users = 0
+        self._exclusive = False
+        # Generations waiting per adapter; arrivals are numbered, and those numbered up to
+        # _last_swap arrived before the latest swap
+        self._waiting = {}
+        self._arrivals = 0
+        self._last_swap = 0
+        self._adapters = {DEFAULT_ADAPTER: self._info(DEFAULT_ADAPTER, default_path)}
+
+    def _info(self, name, path, load_seconds=None, rss_delta_mb=None):
+        weights = sum(
+            parameter.numel() * parameter.element_size()
+            for parameter_name, parameter in self.model.named_parameters()
+            if f".{name}." in parameter_name
+        )
+        return {
+            "path": path,
+            "weights_mb": round(weights / 1024 ** 2, 2),
+            "load_seconds": load_seconds,
+            "rss_delta_mb": rss_delta_mb,
+        }
+
+    def names(self):
+        with self._condition:
+            return list(self._adapters)
+
+    def path(self, name):
+        with self._condition:
+            if name not in self._adapters:
+                raise AdapterError(f"Unknown adapter {name!r} (loaded: {', '.join(self._adapters)})")
+            return self._adapters[name]["path"]
+
+    def snapshot(self):
+        with self._condition:
+            return {"active": self._active, "adapters": {name: dict(info) for name, info in self._adapters.items()}}
+
+    @contextmanager
+    def use(self, name):
+        """Run the body with adapter `name` active; other adapters are not swapped in meanwhile"""
+        started = time.monotonic()
+        with self._condition:
+            if name not in self._adapters:
+                raise AdapterError(f"Unknown adapter {name!r} (loaded: {', '.join(self._adapters)})")
+            self._arrivals += 1
+            arrival = self._arrivals
+            self._waiting[name] = self._waiting.get(name, 0) + 1
+            try:
+                while not self._admit(name, arrival):
+                    self._condition.wait()
+                    if name not in self._adapters:
+                        raise AdapterError(f"Adapter {name!r} was unloaded")
+            finally:
+                self._waiting[name] -= 1
+            if self._active != name:
+                swap_started = time.perf_counter()
+                self.model.set_adapter(name, inference_mode=True)
+                _swap_seconds.observe(time.perf_counter() - swap_started)
+                _swaps.inc()
+                self._active = name
+                self._last_swap = self._arrivals
+            self._users += 1
+        _swap_wait.observe(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._users -= 1
+                self._condition.notify_all()
+
+    def _admit(self, name, arrival):
+        if self._exclusive:
+            return False
+        if self._active != name:
+            return self._users == 0
+        # Requests that arrive while another adapter waits queue behind it
+        others_waiting = any(count for other, count in self._waiting.items() if other != name)
+        return not others_waiting or arrival <= self._last_swap
+
+    @contextmanager
+    def _exclusively(self):
+        with self._condition:
+            while self._exclusive:
+                self._condition.wait()
+            # Claimed first, so no new generation starts while the running ones finish
+            self._exclusive = True
+            while self._users:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+    def load(self, name, path):
+        """Load adapter `name` from `path` next to the others; returns its load time and memory cost"""
+        if not _NAME.match(name or ""):
+            raise AdapterError("Adapter names may only contain letters, digits, '_' and '-'")
+        with self._exclusively():
+            if name in self._adapters:
+                raise AdapterError(f"Adapter {name!r} is already loaded; unload it first")
+            rss_before = rss_mb()
+            started = time.perf_counter()
+            try:
+                # Loads the weights without changing the active adapter
+                self.model.load_adapter(path, adapter_name=name)
+            except Exception as e:
+                if name in self.model.peft_config:
+                    self.model.delete_adapter(name)
+                raise AdapterError(f"Failed to load adapter {name!r} from {path}: {e}")
+            info = self._info(name, path, round(time.perf_counter() - started, 3), round(rss_mb() - rss_before, 1))
+            with self._condition:
+                self._adapters[name] = info
+        print(f"Loaded adapter {name!r} from {path} in {info['load_seconds']}s ({info['weights_mb']} MB of weights)")
+        return dict(info)
+
+    def unload(self, name):
+        """Unload adapter `name`, freeing its weights; the default adapter stays loaded"""
+        if name == DEFAULT_ADAPTER:
+            raise AdapterError("The default adapter cannot be unloaded")
+        with self._exclusively():
+            if name not in self._adapters:
+                raise AdapterError(f"Unknown adapter {name!r} (loaded: {', '.join(self._adapters)})")
+            if self._active == name:
+                self.model.set_adapter(DEFAULT_ADAPTER, inference_mode=True)
+                self._active = DEFAULT_ADAPTER
+            self.model.delete_adapter(name)
+            with self._condition:
+                del self._adapters[name]
+        print(f"Unloaded adapter {name!r}")
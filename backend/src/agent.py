@@ -1,37 +1,91 @@
 """
 CLI agent for generating shell commands from natural language.
 Uses the reusable agent_utils module.
+
+By default the instruction is sent to a persistent agent daemon (started on
+first use, see agent_daemon.py) so the model is only loaded once; the model is
+loaded in-process when the daemon is disabled or cannot be reached.
 """
+import argparse
 import sys
 import os
+import time
 
 # Add src to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from agent_utils import generate_command, log_command, initialize_model
-import torch
+import agent_daemon
+from generation_profiles import GENERATION_PROFILE, PROFILES
 
 # Argument parsing
-if len(sys.argv) < 2:
-    print("Usage: python src/agent.py \"<your instruction>\"")
+parser = argparse.ArgumentParser(usage="python src/agent.py [options] \"<your instruction>\"")
+parser.add_argument("instruction", nargs="?")
+parser.add_argument("--daemon", action="store_true", help="run the agent daemon in the foreground")
+parser.add_argument("--stop-daemon", action="store_true", help="stop a running agent daemon")
+parser.add_argument("--no-daemon", action="store_true", help="load the model in this process")
+parser.add_argument("--base-model", default="microsoft/Phi-3-mini-4k-instruct")
+parser.add_argument("--lora", default=None, help="LoRA adapter path (default: lora_adapter/lora_adapter)")
+parser.add_argument("--profile", choices=sorted(PROFILES), default=GENERATION_PROFILE,
+                    help="generation profile (default: GENERATION_PROFILE or balanced)")
+args = parser.parse_args()
+
+if args.daemon:
+    agent_daemon.serve(base_model_name=args.base_model, lora_adapter_path=args.lora)
+    sys.exit(0)
+if args.stop_daemon:
+    print("Agent daemon stopped." if agent_daemon.stop() else "No agent daemon running.")
+    sys.exit(0)
+if not args.instruction:
+    parser.print_usage()
     sys.exit(1)
-user_instruction = sys.argv[1]
+user_instruction = args.instruction
+
+# Fast path: the daemon already has the model loaded
+if agent_daemon.AGENT_DAEMON and agent_daemon.supported() and not args.no_daemon:
+    try:
+        reply = agent_daemon.generate(user_instruction, base_model_name=args.base_model,
+                                      lora_adapter_path=args.lora, profile=args.profile)
+        print(f"Response: {reply['command']}")
+        sys.exit(0)
+    except agent_daemon.DaemonRequestError as e:
+        # The daemon ran the request; loading the model here would fail the same way
+        print(f"Error: {e}")
+        sys.exit(1)
+    except (OSError, ValueError) as e:
+        # Connection or protocol failure (DaemonUnavailableError is an OSError)
+        print(f"Agent daemon unavailable ({e}); loading the model in this process.")
 
-# Print GPU info
-if torch.cuda.is_available():
-    print(f"Using GPU: {torch.cuda.get_device_name(0)}")
-else:
-    print("CUDA GPU not available. Running on CPU.")
+from agent_utils import generate_command, log_command, initialize_model, get_response_cache
+from backends import backend_kind
 
-# Initialize model
-initialize_model()
+# Initialize model (the llama.cpp and remote backends load on first use instead,
+# and never import torch)
+if backend_kind() == "transformers":
+    import torch
+
+    # Print GPU info
+    if torch.cuda.is_available():
+        print(f"Using GPU: {torch.cuda.get_device_name(0)}")
+    else:
+        print("CUDA GPU not available. Running on CPU.")
+
+    initialize_model(args.base_model, args.lora)
 
 # Generate command
 print("Response:", end=" ")
-command, _ = generate_command(user_instruction)
+started = time.perf_counter()
+trace = {}
+command, _ = generate_command(user_instruction, trace=trace,
+                              base_model_name=args.base_model, lora_adapter_path=args.lora, profile=args.profile)
+latency_ms = round((time.perf_counter() - started) * 1000, 1)
 
 # Output the command
 print(f"{command}")
 
-# Log the command
-log_command(user_instruction, command)
+# Log the command (written by the trace logger's flusher, at the latest on exit)
+log_command(user_instruction, command, latency_ms=latency_ms, **trace)
+
+# Persist the response cache (only written when RESPONSE_CACHE_PATH is set)
+cache = get_response_cache()
+if cache is not None:
+    cache.save()
@@ -0,0 +1,323 @@
+"""
+Persistent agent daemon for the CLI.
+`agent.py --daemon` keeps the model loaded behind a Unix domain socket;
+`agent.py "<instruction>"` sends its instruction there (starting the daemon on
+first use), so each command costs one inference instead of a full model load.
+
+A daemon serves the one base model and adapter it was started with: replies
+name them, and the CLI restarts the daemon when it asks for another model.
+
+The socket and its lock live in a private (0700) per-user directory, and the
+CLI only trusts replies from a daemon running as the same user.
+
+Protocol: one JSON object per line in each direction.
+    {"op": "generate", "instruction": ..., "base_model": ..., "lora": ..., "profile": ...}
+        -> {"command", "plan", "cache_hit", "backend", "latency_ms", "base_model", "lora"}
+           or {"error"} (plus "model_mismatch": true and the daemon's model if it serves another one)
+    {"op": "ping"}     -> {"ok": true, "ready": bool, "pid": int, "base_model": ..., "lora": ...}
+    {"op": "shutdown"} -> {"ok": true}
+"""
+import json
+import os
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent.py")
+
+
+def _uid():
+    return os.getuid() if hasattr(os, "getuid") else 0
+
+
+def _default_socket_dir():
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "prompt2shell")
+    return os.path.join("/tmp", f"prompt2shell-{_uid()}")
+
+
+SOCKET_DIR = _default_socket_dir()
+# Unix socket the daemon listens on
+AGENT_SOCKET = os.getenv("AGENT_SOCKET", "") or os.path.join(SOCKET_DIR, "agent.sock")
+# Use (and auto-start) the daemon from the CLI; 0 always loads the model in-process
+AGENT_DAEMON = os.getenv("AGENT_DAEMON", "1") == "1"
+# Seconds without requests after which the daemon exits (0 = never)
+AGENT_DAEMON_IDLE_TIMEOUT = float(os.getenv("AGENT_DAEMON_IDLE_TIMEOUT", "1800"))
+# Seconds to wait for an auto-started daemon to accept connections
+AGENT_DAEMON_START_TIMEOUT = float(os.getenv("AGENT_DAEMON_START_TIMEOUT", "30"))
+# Seconds a CLI request may take, including the daemon's first model load
+AGENT_DAEMON_REQUEST_TIMEOUT = float(os.getenv("AGENT_DAEMON_REQUEST_TIMEOUT", "600"))
+# Daemon stdout/stderr when it was started by the CLI
+AGENT_DAEMON_LOG = os.getenv("AGENT_DAEMON_LOG", os.path.join(BACKEND_DIR, "logs", "agent_daemon.log"))
+
+
+class DaemonUnavailableError(ConnectionError):
+    """No daemon is listening and none could be started."""
+
+
+class DaemonRequestError(RuntimeError):
+    """The daemon ran the request and it failed (loading the model in-process would fail the same way)."""
+
+
+def _model_path(name):
+    """Local model paths made absolute so a daemon started elsewhere compares equal; hub ids unchanged"""
+    if name and os.path.exists(name):
+        return os.path.abspath(name)
+    return name or None
+
+
+def supported():
+    return hasattr(socket, "AF_UNIX")
+
+
+def _private_dir(path):
+    """Create `path` as a 0700 directory, refusing one another user owns, planted as a symlink or opened up"""
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != _uid() or info.st_mode & 0o077:
+        raise DaemonUnavailableError(f"{path} is not a private directory owned by uid {_uid()}")
+
+
+def _socket_dir(socket_path):
+    """Make sure the socket's directory exists; the default one must also be private"""
+    path = os.path.dirname(socket_path) or "."
+    if os.path.abspath(path) == os.path.abspath(SOCKET_DIR):
+        _private_dir(path)
+    else:
+        os.makedirs(path, exist_ok=True)
+
+
+def _open_lock(socket_path):
+    """The socket's lock file, opened without following symlinks or truncating it"""
+    fd = os.open(f"{socket_path}.lock", os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    return os.fdopen(fd, "r+")
+
+
+def _check_peer(sock, socket_path):
+    """Refuse a daemon that runs as another user (Linux SO_PEERCRED; elsewhere the private directory guards)"""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    if uid != _uid():
+        raise DaemonUnavailableError(f"agent daemon at {socket_path} runs as uid {uid}, not {_uid()}")
+
+
+def _call(message, socket_path=AGENT_SOCKET, timeout=AGENT_DAEMON_REQUEST_TIMEOUT):
+    """Send one message and return the daemon's reply"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise DaemonUnavailableError(f"no agent daemon at {socket_path}: {e}")
+        _check_peer(sock, socket_path)
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with sock.makefile("r", encoding="utf-8") as reader:
+            line = reader.readline()
+    finally:
+        sock.close()
+    if not line:
+        raise DaemonUnavailableError("agent daemon closed the connection")
+    return json.loads(line)
+
+
+def ping(socket_path=AGENT_SOCKET):
+    """The daemon's status, or None if none is listening"""
+    try:
+        return _call({"op": "ping"}, socket_path, timeout=2)
+    except (DaemonUnavailableError, OSError, ValueError):
+        return None
+
+
+def start_daemon(socket_path=AGENT_SOCKET, base_model_name=None, lora_adapter_path=None,
+                 timeout=AGENT_DAEMON_START_TIMEOUT):
+    """Spawn a detached daemon and wait until it accepts connections"""
+    command = [sys.executable, AGENT_SCRIPT, "--daemon"]
+    if base_model_name:
+        command += ["--base-model", base_model_name]
+    if lora_adapter_path:
+        command += ["--lora", lora_adapter_path]
+    os.makedirs(os.path.dirname(AGENT_DAEMON_LOG), exist_ok=True)
+    with open(AGENT_DAEMON_LOG, "a", encoding="utf-8") as log:
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                   env=dict(os.environ, AGENT_SOCKET=socket_path), start_new_session=True)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if ping(socket_path) is not None:
+            return
+        if process.poll() is not None and ping(socket_path) is None:
+            raise DaemonUnavailableError(f"agent daemon exited with code {process.returncode} (see {AGENT_DAEMON_LOG})")
+        time.sleep(0.05)
+    raise DaemonUnavailableError(f"agent daemon did not start within {timeout:.0f}s (see {AGENT_DAEMON_LOG})")
+
+
+def _wait_stopped(socket_path=AGENT_SOCKET, timeout=AGENT_DAEMON_START_TIMEOUT):
+    """Wait until no daemon holds the socket's lock"""
+    import fcntl
+
+    deadline = time.monotonic() + timeout
+    with _open_lock(socket_path) as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                return
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise DaemonUnavailableError(f"agent daemon did not stop within {timeout:.0f}s")
+                time.sleep(0.05)
+
+
+def generate(instruction, socket_path=AGENT_SOCKET, base_model_name=None, lora_adapter_path=None, autostart=True,
+             profile=None):
+    """
+    Generate through the daemon, starting it first if needed. A daemon serving
+    another model is restarted with this one (autostart) or reported as a
+    DaemonRequestError.
+    """
+    base_model_name, lora_adapter_path = _model_path(base_model_name), _model_path(lora_adapter_path)
+    message = {"op": "generate", "instruction": instruction, "base_model": base_model_name, "lora": lora_adapter_path,
+               "profile": profile}
+    try:
+        reply = _call(message, socket_path)
+    except DaemonUnavailableError:
+        if not autostart:
+            raise
+        start_daemon(socket_path, base_model_name, lora_adapter_path)
+        reply = _call(message, socket_path)
+    if reply.get("model_mismatch") and autostart:
+        print(f"Agent daemon serves {reply.get('base_model')} ({reply.get('lora') or 'default adapter'}); "
+              f"restarting it for {base_model_name} ({lora_adapter_path or 'default adapter'})")
+        stop(socket_path)
+        _wait_stopped(socket_path)
+        start_daemon(socket_path, base_model_name, lora_adapter_path)
+        reply = _call(message, socket_path)
+    if "error" in reply:
+        raise DaemonRequestError(reply["error"])
+    return reply
+
+
+def stop(socket_path=AGENT_SOCKET):
+    """Ask a running daemon to exit; returns False if none was running"""
+    try:
+        _call({"op": "shutdown"}, socket_path, timeout=5)
+        return True
+    except (DaemonUnavailableError, OSError):
+        return False
+
+
+def serve(socket_path=AGENT_SOCKET, base_model_name="microsoft/Phi-3-mini-4k-instruct", lora_adapter_path=None,
+          idle_timeout=AGENT_DAEMON_IDLE_TIMEOUT):
+    """Run the daemon until idle for `idle_timeout` seconds, a shutdown request or SIGTERM"""
+    import fcntl
+    import signal
+    import socketserver
+
+    base_model_name, lora_adapter_path = _model_path(base_model_name), _model_path(lora_adapter_path)
+
+    # One daemon per socket: the lock is held for the daemon's lifetime
+    _socket_dir(socket_path)
+    lock_file = _open_lock(socket_path)
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print(f"An agent daemon is already running on {socket_path}")
+        return
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # left behind by a daemon that died
+
+    stop_event = threading.Event()
+    state = {"last_request": time.monotonic(), "active": 0}
+    state_lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            with state_lock:
+                state["active"] += 1
+            try:
+                message = json.loads(self.rfile.readline())
+                reply = _handle(message, base_model_name, lora_adapter_path, stop_event)
+            except Exception as e:
+                reply = {"error": f"{type(e).__name__}: {e}"}
+            finally:
+                with state_lock:
+                    state["active"] -= 1
+                    state["last_request"] = time.monotonic()
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+    class Server(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+    # Bind before the heavy imports so clients can connect (and queue) right away
+    old_umask = os.umask(0o177)
+    try:
+        server = Server(socket_path, Handler)
+    finally:
+        os.umask(old_umask)
+    threading.Thread(target=server.serve_forever, name="agent-daemon", daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    print(f"Agent daemon (pid {os.getpid()}) listening on {socket_path}")
+
+    import agent_utils
+    agent_utils.start_model_loading(base_model_name, lora_adapter_path)
+
+    try:
+        while not stop_event.wait(1.0):
+            with state_lock:
+                idle = state["active"] == 0 and time.monotonic() - state["last_request"]
+            if idle_timeout and idle and idle > idle_timeout:
+                print(f"Idle for {idle_timeout:.0f}s; exiting")
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        cache = agent_utils.get_response_cache()
+        if cache is not None:
+            cache.save()
+        lock_file.close()
+
+
+def _handle(message, base_model_name, lora_adapter_path, stop_event):
+    import agent_utils
+
+    model = {"base_model": base_model_name, "lora": lora_adapter_path}
+    op = message.get("op")
+    if op == "ping":
+        return {"ok": True, "ready": agent_utils.load_status.ready, "pid": os.getpid(), **model}
+    if op == "shutdown":
+        stop_event.set()
+        return {"ok": True}
+    if op != "generate":
+        return {"error": f"unknown op {op!r}"}
+    requested = {"base_model": message.get("base_model") or base_model_name, "lora": message.get("lora")}
+    if requested != model:
+        return {"error": f"agent daemon serves {base_model_name} ({lora_adapter_path or 'default adapter'})",
+                "model_mismatch": True, **model}
+
+    started = time.perf_counter()
+    trace = {}
+    command, plan = agent_utils.generate_command(
+        message["instruction"], trace=trace,
+        base_model_name=base_model_name,
+        lora_adapter_path=lora_adapter_path,
+        profile=message.get("profile"),
+    )
+    latency_ms = round((time.perf_counter() - started) * 1000, 1)
+    agent_utils.log_command(message["instruction"], command, latency_ms=latency_ms, **trace)
+    return {"command": command, "plan": plan, "latency_ms": latency_ms, **trace, **model}
@@ -3,19 +3,68 @@ Reusable agent utilities for command generation.
 Can be used by both CLI and API server.
 """
 import os
-import json
 import re
-# Lazy import transformers to avoid dependency check issues at startup
-try:
-    import torch
-except ImportError:
-    torch = None
+import threading
+from contextlib import nullcontext
+
+import metrics
+from batching import MicroBatcher, BATCH_MAX_SIZE
+from response_cache import ResponseCache, RESPONSE_CACHE_SIZE, is_cacheable
+from semantic_cache import SemanticCache, SEMANTIC_CACHE_SIZE
+from retrieval import load_index, RETRIEVAL_THRESHOLD
+from rules import FALLBACK_RULES, PLAN_LINE_RULES, PREFERENCE_RULES, RULE_FAST_PATH, match_intent
+from model_status import load_status
+from model_artifact import find_artifact, load_artifact_model
+from cpu_inference import configure_threads, cpu_mode, load_dtype, optimize_for_cpu
+from backends import InferenceBackend, LlamaCppBackend, RemoteBackend, backend_kind, GGUF_MODEL_PATH
+from remote_client import REMOTE_LOCAL_FALLBACK
+from single_flight import SingleFlight, COALESCE_REQUESTS
+from prefix_cache import get_prefix, invalidate as invalidate_prefixes
+from speculative import assisted_generate, drafting
+from constrained import logits_processors, output_mode, parse_output
+from generation_profiles import get_profile
+from adapters import AdapterError, DEFAULT_ADAPTER, LORA_ADAPTERS, LoraAdapters, parse_adapters
+from prompt_templates import get_template
+from trace_log import get_trace_logger
 
 
 # Global model instance (singleton pattern)
 _model = None
 _tokenizer = None
 _device = None
+_batcher = None
+_response_cache = None
+_semantic_cache = None
+_retrieval_index = None
+_retrieval_lock = threading.Lock()
+# Serialises model loading between the background loader and lazy loads from requests
+_model_lock = threading.Lock()
+_loader = None
+# Named LoRA adapters of the shared model (None when the adapter was merged into the weights)
+_adapters = None
+# Identical prompts generating concurrently share one generation
+_in_flight = SingleFlight()
+# Shared llama.cpp / remote backends, created on first use
+_backends = {}
+_backends_lock = threading.Lock()
+
+# Stop generating once a confident command has been extracted from the partial output
+EARLY_STOP = os.getenv("EARLY_STOP", "1") == "1"
+# Run a short generate after a background load so the first request doesn't pay for cold kernels
+WARMUP_GENERATE = os.getenv("WARMUP_GENERATE", "1") == "1"
+WARMUP_INSTRUCTION = "List all files in the current directory"
+
+_early_stops = metrics.counter("early_stops_total", "Generations ended early by CommandStoppingCriteria")
+_tokens_saved = metrics.counter("tokens_saved_total", "max_new_tokens minus tokens actually generated for early-stopped sequences")
+_rule_hits = metrics.counter("rule_fast_path_hits_total", "Requests answered by INTENT_RULES without the model")
+_generated_tokens = metrics.histogram(
+    "generated_tokens",
+    [8, 16, 32, 64, 96, 128, 150, 256],
+    "New tokens generated per sequence",
+)
+
+# Generate settings for requests that do not name a profile (GENERATION_PROFILE, see generation_profiles.py)
+GENERATION_KWARGS = get_profile()
 
 
 def initialize_model(base_model_name="microsoft/Phi-3-mini-4k-instruct", 
@@ -24,118 +73,58 @@ def initialize_model(base_model_name="microsoft/Phi-3-mini-4k-instruct",
     """
     Initialize the model and tokenizer (singleton pattern).
     Only loads once, subsequent calls return existing model.
+    Waits for a background load (start_model_loading) that is already running.
     """
-    global _model, _tokenizer, _device
-    
     if _model is not None:
         return _model, _tokenizer, _device
     
-    # Lazy import transformers here to avoid dependency check issues at module import time
-    # Workaround for numpy detection issue in transformers dependency check
+    with _model_lock:
+        if _model is None:
+            try:
+                _load_model(base_model_name, lora_adapter_path, device_map)
+            except Exception as e:
+                load_status.fail(e)
+                raise
+            load_status.enter("ready")
+    return _model, _tokenizer, _device
+
+
+def _import_local_inference():
+    """
+    Import torch and transformers. Only the local-inference path calls this, so
+    the proxy path, the llama.cpp backend and the CLI's daemon client never pay
+    for these imports.
+    """
     try:
-        # Ensure numpy is available (it might not be detected by transformers)
-        import numpy
-        numpy_version = numpy.__version__
-        print(f"NumPy version detected: {numpy_version}")
+        import torch
     except ImportError:
-        raise ImportError("NumPy is required but not installed. Please install it: pip install numpy>=1.17")
-    
-    # Import transformers with error handling for numpy detection issues
-    # The problem: transformers checks numpy version during import and fails
-    # Solution: Patch the checking mechanism if error occurs
-    transformers_imported = False
-    
+        raise ImportError("PyTorch (torch) is not installed. Please install it: pip install torch")
     try:
         from transformers import AutoModelForCausalLM, AutoTokenizer
-        from peft import PeftModel
-        transformers_imported = True
     except ValueError as e:
-        # Catch the numpy version check error that occurs during import
-        error_str = str(e)
-        if "Unable to compare versions for numpy" in error_str:
-            print(f"NumPy detection issue detected. NumPy is installed (v{numpy_version}) but transformers can't detect it.")
-            print("This is likely due to corrupted package metadata.")
-            print("Attempting to work around this issue...")
-            
-            # The error happens in dependency_versions_check.py during import
-            # We need to patch it before it runs. Since it already ran and failed,
-            # we can't easily patch it. However, we can try to manually install
-            # or fix the numpy metadata, or use a different import strategy.
-            
-            # Alternative: Manually verify numpy and skip the check
-            # Since we can't patch before import fails, let's try a different approach:
-            # Import transformers by bypassing the dependency check
-            try:
-                # Try to import transformers modules directly, skipping __init__.py
-                import importlib
-                import sys
-                
-                # Manually load transformers components we need
-                transformers_path = None
-                try:
-                    import site
-                    for site_package in site.getsitepackages():
-                        transformers_init = os.path.join(site_package, 'transformers', '__init__.py')
-                        if os.path.exists(transformers_init):
-                            transformers_path = os.path.join(site_package, 'transformers')
-                            break
-                except:
-                    pass
-                
-                if transformers_path:
-                    # Add to path and try direct imports
-                    if transformers_path not in sys.path:
-                        sys.path.insert(0, transformers_path)
-                    
-                    # Try importing the modules we need directly
-                    try:
-                        # Import model classes directly from their files
-                        from transformers.models.auto import modeling_auto, tokenization_auto
-                        AutoModelForCausalLM = modeling_auto.AutoModelForCausalLM
-                        AutoTokenizer = tokenization_auto.AutoTokenizer
-                        
-                        from peft import PeftModel
-                        transformers_imported = True
-                        print("Successfully imported transformers using direct imports!")
-                    except:
-                        # If that fails, provide clear instructions
-                        raise RuntimeError(
-                            f"Transformers cannot detect NumPy (version {numpy_version} is installed). "
-                            f"\n\nThe issue is corrupted package metadata in your Python environment. "
-                            f"\n\nRecommended fix - Clean reinstall of NumPy:\n"
-                            f"  1. pip uninstall numpy -y\n"
-                            f"  2. pip install --no-cache-dir numpy>=1.17\n"
-                            f"  3. Restart the server\n"
-                            f"\nAlternatively, consider using a fresh virtual environment:\n"
-                            f"  python -m venv new_venv\n"
-                            f"  new_venv\\Scripts\\activate  # Windows\n"
-                            f"  pip install -r requirements.txt\n"
-                            f"\nOriginal error: {error_str}"
-                        )
-                else:
-                    raise
-            except Exception as bypass_error:
-                raise RuntimeError(
-                    f"Transformers cannot detect NumPy even though it's installed (version {numpy_version}). "
-                    f"This is due to corrupted package metadata.\n\n"
-                    f"Recommended fix:\n"
-                    f"  pip uninstall numpy -y\n"
-                    f"  pip install --no-cache-dir numpy>=1.17\n"
-                    f"  Then restart the server.\n\n"
-                    f"Original error: {error_str}\n"
-                    f"Bypass attempt failed: {bypass_error}"
-                )
-        else:
+        # transformers' import-time dependency check fails on corrupted numpy metadata
+        if "Unable to compare versions for numpy" not in str(e):
             raise
+        raise RuntimeError(
+            "Transformers cannot detect NumPy even though it's installed. "
+            "This is due to corrupted package metadata.\n\n"
+            "Recommended fix:\n"
+            "  pip uninstall numpy -y\n"
+            "  pip install --no-cache-dir numpy>=1.17\n"
+            "  Then restart the server.\n\n"
+            f"Original error: {e}"
+        )
     except ImportError as e:
-        raise ImportError(f"Failed to import transformers or peft: {e}. Please ensure all dependencies are installed.")
+        raise ImportError(f"Failed to import transformers: {e}. Please ensure all dependencies are installed.")
+    return torch, AutoModelForCausalLM, AutoTokenizer
+
+
+def _load_model(base_model_name, lora_adapter_path, device_map=None):
+    """Load tokenizer, base weights and LoRA adapter into the globals, recording each stage"""
+    global _model, _tokenizer, _device, _adapters
     
-    if not transformers_imported:
-        raise ImportError("Failed to import transformers - see error messages above.")
-    
-    # Ensure torch is imported
-    if torch is None:
-        raise ImportError("PyTorch (torch) is not installed. Please install it: pip install torch")
+    load_status.enter("imports")
+    torch, AutoModelForCausalLM, AutoTokenizer = _import_local_inference()
     
     # Default to relative path from backend directory
     if lora_adapter_path is None:
@@ -158,13 +147,30 @@ def initialize_model(base_model_name="microsoft/Phi-3-mini-4k-instruct",
             print("No CUDA GPU detected, using CPU (will be slower)")
     
     _device = device_map
+    if device_map == "cpu":
+        threads, interop_threads = configure_threads()
+        print(f"CPU inference: {threads} threads ({interop_threads} inter-op), {cpu_mode()} weights")
+    
+    # A pre-merged artifact (src/model_artifact.py) replaces base model + LoRA + runtime quantization
+    artifact = find_artifact(base_model_name, lora_adapter_path)
     
     print(f"Loading tokenizer and base model...")
-    _tokenizer = AutoTokenizer.from_pretrained(base_model_name)
+    load_status.enter("tokenizer")
+    _tokenizer = AutoTokenizer.from_pretrained(artifact[0] if artifact else base_model_name)
     
     # Set padding token if not present (Mistral models might need this)
     if _tokenizer.pad_token is None:
         _tokenizer.pad_token = _tokenizer.eos_token
+    # Left padding keeps every prompt flush against its generated tokens in a batch
+    _tokenizer.padding_side = "left"
+    
+    load_status.enter("base_weights")
+    if artifact is not None:
+        if LORA_ADAPTERS:
+            print("Warning: LORA_ADAPTERS ignored; a merged model artifact has no separate adapters")
+        print(f"Loading merged {artifact[1]['quantization']} model artifact from {artifact[0]}...")
+        _model = _optimize_if_cpu(load_artifact_model(*artifact, device_map), device_map)
+        return _model, _tokenizer, _device
     
     # Use quantization for large models to reduce memory usage
     # 4-bit quantization can reduce memory by ~75%
@@ -198,267 +204,237 @@ def initialize_model(base_model_name="microsoft/Phi-3-mini-4k-instruct",
         base_model = AutoModelForCausalLM.from_pretrained(
             base_model_name,
             device_map=device_map if device_map == "cpu" else "auto",
-            torch_dtype=torch.float32 if device_map == "cpu" else torch.float16
+            torch_dtype=load_dtype() if device_map == "cpu" else torch.float16
         )
     
     print(f"Loading LoRA adapter...")
-    _model = PeftModel.from_pretrained(base_model, lora_adapter_path)
+    load_status.enter("lora")
+    # peft is only needed here; pre-merged artifacts skip it entirely
+    try:
+        from peft import PeftModel
+    except ImportError as e:
+        raise ImportError(f"Failed to import peft: {e}. Please ensure all dependencies are installed.")
+    model = _optimize_if_cpu(PeftModel.from_pretrained(base_model, lora_adapter_path), device_map)
+    if isinstance(model, PeftModel):
+        _adapters = LoraAdapters(model, lora_adapter_path)
+        for name, path in parse_adapters().items():
+            _adapters.load(name, path)
+    elif LORA_ADAPTERS:
+        print(f"Warning: LORA_ADAPTERS ignored; CPU_QUANTIZATION={cpu_mode()} merges the adapter into the weights")
+    _model = model
     
     return _model, _tokenizer, _device
 
 
-def extract_commands_from_text(text):
-    """Extract actual shell commands from Stack Overflow style text"""
-    commands = []
-    lines = text.split('\n')
-    
-    # Extract bash code blocks
-    code_blocks = re.findall(r'```bash\n(.*?)\n```', text, re.DOTALL)
-    for block in code_blocks:
-        block_lines = block.strip().split('\n')
-        for line in block_lines:
-            line = line.strip()
-            if line and not line.startswith('#'):  # Skip comments
-                if len(line.split()) <= 10 and not any(keyword in line for keyword in ['while', 'for', 'if', 'function']):
-                    commands.append(line)
-                    break
-    
-    if commands:
-        return commands
+def _optimize_if_cpu(model, device_map):
+    """Apply the CPU inference mode (CPU_QUANTIZATION) to models that run on CPU"""
+    if device_map != "cpu":
+        return model
+    load_status.enter("cpu_optimize")
+    return optimize_for_cpu(model)
+
+
+def warm_up_model(base_model_name="microsoft/Phi-3-mini-4k-instruct"):
+    """Run one short generate through the normal prompt path to prime kernels and allocator caches"""
+    load_status.enter("warmup")
+    prompt = build_prompt(WARMUP_INSTRUCTION, _tokenizer, base_model_name)
+    with _using_adapter(_model, None):
+        prefix = _prompt_prefix(_model, _tokenizer, base_model_name)
+        generate_texts([prompt], _model, _tokenizer, prefix=prefix, **dict(GENERATION_KWARGS, max_new_tokens=8))
+
+
+def start_model_loading(base_model_name="microsoft/Phi-3-mini-4k-instruct", lora_adapter_path=None):
+    """
+    Load and warm up the configured backend's model on a background thread.
+    Progress and failures are recorded in `load_status`; after a failure the
+    model is loaded lazily by the next request instead.
+    """
+    global _loader
+    if _loader is not None:
+        return _loader
     
-    # Otherwise, look line by line
-    command_starters = ['git', 'cd', 'ls', 'mkdir', 'touch', 'mv', 'cp', 'rm', 'python', 'python3', 
-                       'pip', 'pip3', 'npm', 'node', 'docker', 'curl', 'wget', 'tar', 'grep', 'find', 
-                       'sudo', 'apt', 'yum', 'brew', 'head', 'tail', 'cat', 'sort', 'uniq', 'wc', 'awk', 'sed']
+    def run():
+        try:
+            backend = get_backend(base_model_name, lora_adapter_path)
+            backend.load()
+            if WARMUP_GENERATE:
+                backend.warm_up()
+            load_status.enter("ready")
+            print(f"Model ready after {load_status.elapsed():.1f}s")
+        except Exception as e:
+            load_status.fail(e)
+            print(f"Error initializing model: {e}")
+            print("Model will be loaded on first request...")
     
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        
-        if any(line.startswith(cmd + ' ') for cmd in command_starters):
-            commands.append(line)
-        elif line.startswith('$ '):
-            commands.append(line[2:])
-        elif line.startswith('```') and any(cmd in line for cmd in command_starters):
-            cmd = line.replace('```bash', '').replace('```', '').strip()
-            if cmd:
-                commands.append(cmd)
-        elif line.startswith('`') and line.endswith('`') and len(line) > 2:
-            cmd = line[1:-1]
-            if any(cmd.startswith(c + ' ') for c in command_starters):
+    _loader = threading.Thread(target=run, name="model-loader", daemon=True)
+    _loader.start()
+    return _loader
+
+
+# First words that mark a line as a shell command
+COMMAND_STARTERS = frozenset([
+    'git', 'cd', 'ls', 'mkdir', 'touch', 'mv', 'cp', 'rm', 'python', 'python3',
+    'pip', 'pip3', 'npm', 'node', 'docker', 'curl', 'wget', 'tar', 'grep', 'find',
+    'sudo', 'apt', 'yum', 'brew', 'head', 'tail', 'cat', 'sort', 'uniq', 'wc', 'awk', 'sed',
+])
+# Any starter appearing anywhere in a line (for one-line ``` fences)
+_ANY_STARTER = re.compile("|".join(sorted(COMMAND_STARTERS, key=len, reverse=True)))
+_INLINE_CODE = re.compile(r'`([^`]+)`')
+_CONTROL_FLOW = re.compile('while|for|if|function')
+
+
+def _starts_with_command(text):
+    """True when `text` starts with a command starter followed by a space"""
+    end = text.find(' ')
+    return end > 0 and text[:end] in COMMAND_STARTERS
+
+
+def _line_commands(line, commands):
+    """Append the commands found in one stripped, non-empty line"""
+    if _starts_with_command(line):
+        commands.append(line)
+    elif line.startswith('$ '):
+        commands.append(line[2:])
+    elif line.startswith('```') and _ANY_STARTER.search(line):
+        cmd = line.replace('```bash', '').replace('```', '').strip()
+        if cmd:
+            commands.append(cmd)
+    elif line[0] == '`' and line[-1] == '`' and len(line) > 2:
+        cmd = line[1:-1]
+        if _starts_with_command(cmd):
+            commands.append(cmd)
+    elif '`' in line:
+        for cmd in _INLINE_CODE.findall(line):
+            if _starts_with_command(cmd):
                 commands.append(cmd)
-        elif '`' in line:
-            backtick_commands = re.findall(r'`([^`]+)`', line)
-            for cmd in backtick_commands:
-                if any(cmd.startswith(c + ' ') for c in command_starters):
-                    commands.append(cmd)
-    
-    return commands
+
+
+def _block_command(line):
+    """A line inside a ```bash block counts if it is a short, non-comment, non-loop command"""
+    return (line and line[0] != '#' and len(line.split()) <= 10
+            and _CONTROL_FLOW.search(line) is None)
+
+
+def extract_commands_from_text(text):
+    """
+    Extract actual shell commands from Stack Overflow style text.
+    One pass over the lines: the first usable line of every closed ```bash
+    block wins; without any, commands are picked up line by line.
+    """
+    block_commands = []
+    line_commands = []
+    in_block = False
+    block_start = False  # the line right after an opening fence is always content
+    pending = None       # first usable line of the open block
+
+    for raw in text.split('\n'):
+        if in_block:
+            if not block_start and raw.startswith('```'):
+                # Closing fence; whatever follows it can open the next block
+                in_block = False
+                if pending is not None:
+                    block_commands.append(pending)
+                if raw.endswith('```bash', 3):
+                    in_block, block_start, pending = True, True, None
+            else:
+                block_start = False
+                if pending is None:
+                    line = raw.strip()
+                    if _block_command(line):
+                        pending = line
+        elif raw.endswith('```bash'):
+            in_block, block_start, pending = True, True, None
+
+        # Line-by-line commands only matter until a block has produced one
+        if not block_commands:
+            line = raw.strip()
+            if line:
+                _line_commands(line, line_commands)
+
+    return block_commands or line_commands
 
 
 def get_fallback_command(instruction):
     """Generate fallback command based on instruction keywords"""
-    instruction_lower = instruction.lower()
-    
-    if any(word in instruction_lower for word in ['branch', 'git']):
-        return "git checkout -b <branch-name>"
-    elif any(word in instruction_lower for word in ['list', 'files']):
-        return "ls -la"
-    elif any(word in instruction_lower for word in ['directory', 'folder', 'mkdir']):
-        return "mkdir <directory-name>"
-    elif any(word in instruction_lower for word in ['virtual', 'venv', 'environment']):
-        return "python3 -m venv <env_name>"
-    elif any(word in instruction_lower for word in ['pip', 'install', 'package']):
-        return "pip install <package_name>"
-    elif any(word in instruction_lower for word in ['docker', 'container']):
-        return "docker run <image_name>"
-    elif any(word in instruction_lower for word in ['first', 'lines', 'head']) and any(word in instruction_lower for word in ['file', 'log']):
-        if any(word in instruction_lower for word in ['ten', '10']):
-            return "head -n 10 <filename>"
-        else:
-            return "head <filename>"
-    elif any(word in instruction_lower for word in ['last', 'tail']) and any(word in instruction_lower for word in ['file', 'log']):
-        return "tail <filename>"
-    elif any(word in instruction_lower for word in ['read', 'view', 'show', 'cat']) and any(word in instruction_lower for word in ['file', 'log']):
-        return "cat <filename>"
-    else:
-        return None
+    return FALLBACK_RULES.resolve(instruction)
 
 
 def extract_fallback_from_plan(plan, instruction):
     """Try to extract commands from plan using keyword matching"""
-    commands = []
     lines = [line.strip() for line in plan.split('\n') if line.strip()]
     
     for line in lines[:5]:  # Check first 5 lines
-        if 'git' in line.lower() and any(word in line.lower() for word in ['branch', 'checkout', 'create']):
-            if 'checkout -b' in line.lower():
-                commands.append('git checkout -b <branch-name>')
-                break
-            elif 'branch' in line.lower() and 'create' in line.lower():
-                commands.append('git checkout -b <branch-name>')
-                break
-        elif any(word in line.lower() for word in ['venv', 'virtual', 'environment']) and 'python' in line.lower():
-            if 'python3 -m venv' in line.lower() or 'python -m venv' in line.lower():
-                commands.append('python3 -m venv <env_name>')
-                break
-        elif 'pip' in line.lower() and 'install' in line.lower():
-            if 'requests' in line.lower():
-                commands.append('pip install requests')
-                break
-        elif any(word in line.lower() for word in ['first', 'lines', 'head']) and any(word in line.lower() for word in ['file', '.log', '.txt']):
-            if 'ten' in line.lower() or '10' in line:
-                commands.append('head -n 10 <filename>')
-                break
-    
-    return commands
+        command = PLAN_LINE_RULES.resolve(line)
+        if command:
+            return [command]
+    
+    return []
+
+
+def _command_preferences(instruction):
+    """Predicates, in priority order, for the kind of command the instruction asks for"""
+    rules, _ = PREFERENCE_RULES.all(instruction.lower())
+    return [rule.outcomes[0][1] for rule in rules]
 
 
 def select_best_command(commands, instruction):
     """Select the most relevant command based on the instruction"""
-    instruction_lower = instruction.lower()
-    
-    # For branch creation, prioritize 'checkout -b' over plain 'checkout'
-    if any(word in instruction_lower for word in ['create', 'new']) and 'branch' in instruction_lower:
+    for prefers in _command_preferences(instruction):
         for cmd in commands:
-            if 'checkout -b' in cmd and not any(word in cmd for word in ['merge', 'delete', 'remove']):
-                return cmd
-    
-    # For file operations, prioritize specific file commands
-    if any(word in instruction_lower for word in ['first', 'lines', 'head']):
-        for cmd in commands:
-            if cmd.startswith('head'):
-                return cmd
-    
-    if any(word in instruction_lower for word in ['last', 'tail']):
-        for cmd in commands:
-            if cmd.startswith('tail'):
-                return cmd
-    
-    # For virtual environment, prioritize venv creation
-    if any(word in instruction_lower for word in ['virtual', 'venv', 'environment']):
-        for cmd in commands:
-            if 'python' in cmd and 'venv' in cmd:
-                return cmd
-    
-    # For pip, prioritize install commands
-    if 'install' in instruction_lower:
-        for cmd in commands:
-            if 'pip install' in cmd:
+            if prefers(cmd):
                 return cmd
     
     # Default: return the first command
     return commands[0] if commands else None
 
 
-def generate_command(instruction, model=None, tokenizer=None, device=None, 
-                    base_model_name="microsoft/Phi-3-mini-4k-instruct",
-                    lora_adapter_path=None):
+def is_confident_command(commands, instruction):
     """
-    Generate shell command from natural language instruction.
-    
-    Returns:
-        tuple: (command, plan) where command is the best extracted command and plan is the raw model response
+    True when more output could not change the selected command: either the
+    instruction has no preferences, or its top preference is already satisfied.
     """
-    # If a remote model endpoint is configured, proxy the request instead of loading a local model
-    remote_url = os.getenv("MODEL_ENDPOINT_URL")
-    if remote_url:
-        try:
-            import requests
-            resp = requests.post(remote_url, json={"prompt": instruction}, timeout=120)
-            resp.raise_for_status()
-            data = resp.json()
-            cmd = data.get("response") or data.get("command") or ""
-            plan = cmd
-            if not cmd:
-                return "# No command returned", ""
-            return cmd, plan
-        except Exception as e:
-            # Fall through to local model as a backup if available
-            print(f"Remote MODEL_ENDPOINT_URL call failed: {e}. Falling back to local model if available.")
+    if not commands:
+        return False
+    preferences = _command_preferences(instruction)
+    if not preferences:
+        return True
+    return any(preferences[0](cmd) for cmd in commands)
 
-    # Initialize model if not provided
-    if model is None or tokenizer is None:
-        if lora_adapter_path is None:
-            model, tokenizer, device = initialize_model(base_model_name)
-        else:
-            model, tokenizer, device = initialize_model(base_model_name, lora_adapter_path)
-    
-    # Generate plan using appropriate prompt format based on model
-    # Phi-3-mini uses chat template format (similar to Mistral)
-    if "phi-3" in base_model_name.lower():
-        # Phi-3-mini uses chat template format
-        system_prompt = "You are a helpful assistant that generates shell commands from natural language instructions. Provide clear, executable commands."
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": instruction}
-        ]
-        # Apply chat template if available
-        if hasattr(tokenizer, "apply_chat_template") and tokenizer.chat_template is not None:
-            prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        else:
-            # Fallback format
-            prompt = f"<|user|>\n{instruction}<|end|>\n<|assistant|>"
-    elif "phi-2" in base_model_name.lower() or "phi2" in base_model_name.lower():
-        # Phi-2 format: simple instruction-based prompt
-        system_prompt = "You are a helpful assistant that generates shell commands from natural language instructions."
-        prompt = f"Instruct: {instruction}\nOutput:"
-    elif "mistral" in base_model_name.lower() or "tinyllama" in base_model_name.lower():
-        # Models with chat templates
-        system_prompt = "You are a helpful assistant that generates shell commands from natural language instructions. Provide clear, executable commands."
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": instruction}
-        ]
-        # Apply chat template if available
-        if hasattr(tokenizer, "apply_chat_template") and tokenizer.chat_template is not None:
-            prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        else:
-            # Fallback to simple format
-            prompt = f"[INST] {instruction} [/INST]"
-    else:
-        # Generic format for other models
-        prompt = f"Question: {instruction}\n\nAnswer:"
-    
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-    
-    outputs = model.generate(
-        **inputs,
-        max_new_tokens=150,
-        do_sample=True,
-        temperature=0.7,
-        top_p=0.9,
-        repetition_penalty=1.1,
-        pad_token_id=tokenizer.eos_token_id,
-        eos_token_id=tokenizer.eos_token_id
-    )
+
+class CommandStoppingCriteria:
+    """
+    Stopping criterion for model.generate that ends a sequence as soon as a
+    confident command can be extracted from its partial decode.
+    Rows are only re-checked when their latest token completes a line.
+    """
     
-    response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    
-    # Extract the answer part - handle different model formats
-    if "<|assistant|>" in response:
-        # Phi-3 format: extract text after <|assistant|>
-        plan = response.split("<|assistant|>")[-1].strip()
-        # Remove end token if present
-        if "<|end|>" in plan:
-            plan = plan.split("<|end|>")[0].strip()
-    elif "Output:" in response:
-        # Phi-2 format: extract text after "Output:"
-        plan = response.split("Output:")[-1].strip()
-    elif "[/INST]" in response:
-        # Mistral format: extract text after [/INST]
-        plan = response.split("[/INST]")[-1].strip()
-    elif "Answer:" in response:
-        # Legacy format
-        plan = response.split("Answer:")[-1].strip()
-    else:
-        # Try to extract just the generated part
-        if prompt in response:
-            plan = response.split(prompt)[-1].strip()
-        else:
-            plan = response.strip()
+    def __init__(self, tokenizer, instructions, prompt_length, max_new_tokens):
+        self.tokenizer = tokenizer
+        self.instructions = instructions
+        self.prompt_length = prompt_length
+        self.max_new_tokens = max_new_tokens
+        self.stopped = [False] * len(instructions)
     
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        
+        for row, instruction in enumerate(self.instructions):
+            if self.stopped[row]:
+                continue
+            if "\n" not in self.tokenizer.decode(input_ids[row, -1:]):
+                continue
+            text = self.tokenizer.decode(input_ids[row, self.prompt_length:], skip_special_tokens=True)
+            commands = extract_commands_from_text(text[:text.rfind("\n")])
+            if is_confident_command(commands, instruction):
+                self.stopped[row] = True
+                generated = input_ids.shape[1] - self.prompt_length
+                _early_stops.inc()
+                _tokens_saved.inc(max(0, self.max_new_tokens - generated))
+        return torch.tensor(self.stopped, dtype=torch.bool, device=input_ids.device)
+
+
+def command_from_plan(plan, instruction):
+    """Pick the best command from a model plan, falling back to keyword rules"""
     # Extract commands using the extraction function
     commands = extract_commands_from_text(plan)
     
@@ -470,24 +446,536 @@ def generate_command(instruction, model=None, tokenizer=None, device=None,
     if commands:
         best_command = select_best_command(commands, instruction)
         if best_command:
-            return best_command, plan
+            return best_command
     
     # Fallback based on common tasks
     fallback = get_fallback_command(instruction)
     if fallback:
-        return fallback, plan
+        return fallback
     
-    return "# Command not recognized", plan
+    return "# Command not recognized"
 
 
-def log_command(instruction, command, log_path=None):
-    """Log the instruction and command to a JSONL file"""
-    if log_path is None:
-        # Get backend directory (parent of src)
-        backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        log_path = os.path.join(backend_dir, "logs", "trace.jsonl")
+class IncrementalCommandExtractor:
+    """
+    Runs the command extraction heuristics over a plan as it is streamed.
+    Commands are line-based, so extraction only re-runs when a line completes.
+    """
     
-    os.makedirs(os.path.dirname(log_path), exist_ok=True)
-    with open(log_path, "a", encoding="utf-8") as logf:
-        logf.write(json.dumps({"instruction": instruction, "step": command}) + "\n")
+    def __init__(self, instruction):
+        self.instruction = instruction
+        self.text = ""
+        # True once more output could not change the selected command
+        self.confident = False
+        self._scanned = -1
+    
+    def feed(self, chunk):
+        """Append streamed text; return a command once one is recognised, else None"""
+        self.text += chunk
+        cut = self.text.rfind("\n")
+        if cut <= self._scanned:
+            return None
+        self._scanned = cut
+        commands = extract_commands_from_text(self.text[:cut])
+        if commands:
+            self.confident = is_confident_command(commands, self.instruction)
+            return select_best_command(commands, self.instruction)
+        return None
+
+
+def _resolve_model(model, tokenizer, base_model_name, lora_adapter_path):
+    """Return the given model/tokenizer, or the shared singleton if none were passed"""
+    if model is None or tokenizer is None:
+        if lora_adapter_path is None:
+            model, tokenizer, _ = initialize_model(base_model_name)
+        else:
+            model, tokenizer, _ = initialize_model(base_model_name, lora_adapter_path)
+    return model, tokenizer
+
+
+def build_prompt(instruction, tokenizer, base_model_name="microsoft/Phi-3-mini-4k-instruct"):
+    """Build the model-specific prompt string for an instruction (template resolved once, see prompt_templates.py)"""
+    return get_template(tokenizer, base_model_name).render(instruction)
+
+
+def _prompt_prefix(model, tokenizer, base_model_name, adapter=None):
+    """
+    The model's cached prompt-prefix KV for base_model_name's prompt format (see prefix_cache.py).
+    The KV depends on the adapter, so call this with `adapter` active.
+    """
+    key = base_model_name if adapter is None else (base_model_name, adapter)
+    return get_prefix(model, tokenizer, lambda text: build_prompt(text, tokenizer, base_model_name), key)
+
+
+def _encode_prompts(prompts, model, tokenizer, prefix=None):
+    """Tokenize prompts for model.generate, reusing the prefix KV cache when they all start with it"""
+    # Drafted generation prefills the whole prompt anyway (see speculative.py)
+    inputs = prefix.encode(prompts) if prefix is not None and not drafting(len(prompts)) else None
+    if inputs is None:
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    return inputs
+
+
+def generate_texts(prompts, model, tokenizer, instructions=None, prefix=None, **generation_kwargs):
+    """
+    Run one generate call over a list of prompts.
+    Prompts are left-padded with the tokenizer's pad token so they can share a batch.
+    With a `prefix` (PromptPrefix) only the part after the shared prompt prefix is prefilled.
+    With CONSTRAINED_OUTPUT on, the output is held to its shape (see constrained.py).
+    Otherwise, when `instructions` are given and EARLY_STOP is on, each sequence
+    stops as soon as a confident command has been generated.
+    
+    Returns:
+        list: decoded generated text (prompt excluded), one per input prompt
+    """
+    inputs = _encode_prompts(prompts, model, tokenizer, prefix)
+    prompt_length = inputs["input_ids"].shape[1]
+    
+    processors = logits_processors(tokenizer, prompt_length)
+    if processors:
+        generation_kwargs["logits_processor"] = processors
+    elif instructions is not None and EARLY_STOP:
+        generation_kwargs["stopping_criteria"] = [CommandStoppingCriteria(
+            tokenizer, instructions, prompt_length, generation_kwargs.get("max_new_tokens", 150)
+        )]
+    
+    # Single prompts are drafted for when SPECULATIVE_DECODING is on (see speculative.py)
+    outputs = assisted_generate(
+        model, tokenizer, inputs,
+        **generation_kwargs,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id
+    )
+    
+    generated = outputs[:, prompt_length:]
+    for row in generated:
+        _generated_tokens.observe(int((row != tokenizer.pad_token_id).sum()))
+    
+    # Only the new tokens: no prompt to decode and strip back out
+    return tokenizer.batch_decode(generated, skip_special_tokens=True)
+
+
+def _run_batch(items, key):
+    """MicroBatcher callback: generate for a batch of (prompt, instruction) pairs on the shared model"""
+    settings, base_model_name, adapter = key
+    prompts = [prompt for prompt, _ in items]
+    instructions = [instruction for _, instruction in items]
+    with _using_adapter(_model, adapter):
+        prefix = _prompt_prefix(_model, _tokenizer, base_model_name, adapter)
+        return generate_texts(prompts, _model, _tokenizer, instructions, prefix, **dict(settings))
+
+
+def _get_batcher():
+    global _batcher
+    if _batcher is None:
+        _batcher = MicroBatcher(_run_batch)
+    return _batcher
+
+
+def get_adapters(base_model_name="microsoft/Phi-3-mini-4k-instruct", lora_adapter_path=None):
+    """The shared model's named adapters (see adapters.py), loading the model first if needed"""
+    if backend_kind() != "transformers":
+        raise AdapterError("Named adapters need the local transformers backend")
+    _resolve_model(None, None, base_model_name, lora_adapter_path)
+    if _adapters is None:
+        raise AdapterError(
+            "Named adapters need an unmerged LoRA model (CPU_QUANTIZATION=none and no model artifact)"
+        )
+    return _adapters
+
+
+def load_adapter(name, path, base_model_name="microsoft/Phi-3-mini-4k-instruct", lora_adapter_path=None):
+    """Load a named adapter into the shared model at runtime; returns its load time and memory cost"""
+    return get_adapters(base_model_name, lora_adapter_path).load(name, path)
+
+
+def unload_adapter(name, base_model_name="microsoft/Phi-3-mini-4k-instruct", lora_adapter_path=None):
+    """Unload a named adapter from the shared model"""
+    get_adapters(base_model_name, lora_adapter_path).unload(name)
+    # Its prefix KV would be stale if the name is loaded again from another path
+    invalidate_prefixes(_model)
+
+
+def _resolve_adapter(adapter, model, tokenizer, base_model_name, lora_adapter_path):
+    """Check that a requested adapter is loaded; None stands for the default adapter"""
+    if adapter is None or adapter == DEFAULT_ADAPTER:
+        return None
+    if model is not None or tokenizer is not None:
+        raise AdapterError("Named adapters are only available on the shared model")
+    get_adapters(base_model_name, lora_adapter_path).path(adapter)
+    return adapter
+
+
+def _using_adapter(model, adapter):
+    """Context in which the shared model runs `adapter` (None: the default one) without swaps"""
+    if model is not _model or _adapters is None:
+        return nullcontext()
+    return _adapters.use(adapter or DEFAULT_ADAPTER)
+
+
+def _constrained_answer(output, instruction):
+    """(command, plan) from a CONSTRAINED_OUTPUT answer, falling back to extraction if it did not complete"""
+    command, explanation = parse_output(output)
+    return command or command_from_plan(output, instruction), explanation or output.strip()
+
+
+def _model_scope(model, base_model_name, lora_adapter_path, adapter=None):
+    """Id of the model answering this request, or None for caller-supplied models"""
+    if model is not None:
+        # Caller-supplied models cannot be identified reliably
+        return None
+    kind = backend_kind()
+    if kind == "remote":
+        return os.getenv("MODEL_ENDPOINT_URL")
+    if kind == "llama_cpp":
+        return f"gguf:{GGUF_MODEL_PATH}"
+    scope = f"{base_model_name}:{lora_adapter_path or 'default'}"
+    if adapter is not None:
+        scope += f"+{adapter}={_adapters.path(adapter)}"
+    if output_mode() != "off":
+        scope += f"|{output_mode()}"
+    return scope
+
+
+def _cache_scope(model, base_model_name, lora_adapter_path, adapter, generation_kwargs):
+    """Model id that cached answers are scoped to, or None if this request must not use the caches"""
+    if not is_cacheable(generation_kwargs):
+        return None
+    return _model_scope(model, base_model_name, lora_adapter_path, adapter)
+
+
+def get_response_cache():
+    """Shared response cache (None when RESPONSE_CACHE_SIZE is 0)"""
+    global _response_cache
+    if _response_cache is None and RESPONSE_CACHE_SIZE > 0:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+
+def get_semantic_cache():
+    """Shared semantic cache (None when SEMANTIC_CACHE_SIZE is 0)"""
+    global _semantic_cache
+    if _semantic_cache is None and SEMANTIC_CACHE_SIZE > 0:
+        _semantic_cache = SemanticCache()
+    return _semantic_cache
+
+
+def get_retrieval_index():
+    """Shared retrieval index, loaded once (None when RETRIEVAL_THRESHOLD is 0)"""
+    global _retrieval_index
+    if _retrieval_index is None and RETRIEVAL_THRESHOLD > 0:
+        with _retrieval_lock:
+            if _retrieval_index is None:
+                _retrieval_index = load_index()
+    return _retrieval_index
+
+
+def _cached_response(instruction, scope, generation_kwargs):
+    """Look the instruction up in the exact-match cache, then the semantic cache"""
+    if scope is None:
+        return None
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        cached = response_cache.get(ResponseCache.make_key(instruction, scope, generation_kwargs))
+        if cached is not None:
+            return cached
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None:
+        return semantic_cache.get(instruction, namespace=ResponseCache.make_key("", scope, generation_kwargs))
+    return None
+
+
+def _fast_path(instruction, scope, generation_kwargs, adapter=None, model=None):
+    """
+    Answer without the model when possible: rule intents (RULE_FAST_PATH),
+    then the response/semantic caches, then the retrieval index. A named
+    `adapter` is only answered from its own cached outputs (the cache scope
+    includes it), never from rules or the dataset; a caller-supplied `model`
+    is never answered from the dataset.
+    """
+    if RULE_FAST_PATH and adapter is None:
+        intent = match_intent(instruction)
+        if intent is not None:
+            _rule_hits.inc()
+            command, rule_name = intent
+            return command, f"Matched built-in rule '{rule_name}'."
+    
+    cached = _cached_response(instruction, scope, generation_kwargs)
+    if cached is not None:
+        return cached
+    
+    index = get_retrieval_index() if adapter is None and model is None else None
+    if index is not None:
+        return index.lookup(instruction)
+    return None
+
+
+def _store_response(instruction, scope, result, generation_kwargs):
+    # Placeholder results ("# ...") signal a failure and are worth retrying
+    if scope is None or result[0].startswith("#"):
+        return
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        response_cache.put(ResponseCache.make_key(instruction, scope, generation_kwargs), result)
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None:
+        semantic_cache.put(instruction, result, namespace=ResponseCache.make_key("", scope, generation_kwargs))
+
+
+def generate_command(instruction, model=None, tokenizer=None, device=None, 
+                    base_model_name="microsoft/Phi-3-mini-4k-instruct",
+                    lora_adapter_path=None, fast_paths=True, trace=None, adapter=None, profile=None):
+    """
+    Generate shell command from natural language instruction.
+    Repeated or paraphrased instructions are answered from the response and
+    semantic caches when the generation profile allows it, and close matches
+    to known instructions from the retrieval index. Concurrent identical
+    instructions share one generation (COALESCE_REQUESTS). Pass
+    fast_paths=False to always run the model.
+    
+    Args:
+        trace: Optional dict that receives "cache_hit" and "backend" for the trace log
+        adapter: Name of a loaded LoRA adapter to generate with (see adapters.py); None for the default
+        profile: Name of the generation profile (see generation_profiles.py); None for GENERATION_PROFILE
+    
+    Returns:
+        tuple: (command, plan) where command is the best extracted command and plan is the raw model response
+    """
+    trace = {} if trace is None else trace
+    trace["cache_hit"] = False
+    adapter = _resolve_adapter(adapter, model, tokenizer, base_model_name, lora_adapter_path)
+    generation_kwargs = get_profile(profile) if profile else GENERATION_KWARGS
+    if not fast_paths:
+        return _generate_uncached(instruction, model, tokenizer, base_model_name, lora_adapter_path, adapter,
+                                  generation_kwargs, trace)
+    
+    scope = _cache_scope(model, base_model_name, lora_adapter_path, adapter, generation_kwargs)
+    answered = _fast_path(instruction, scope, generation_kwargs, adapter, model)
+    if answered is not None:
+        trace.update(cache_hit=True, backend=backend_kind() if model is None else "transformers")
+        return answered
+    
+    def generate():
+        result = _generate_uncached(instruction, model, tokenizer, base_model_name, lora_adapter_path, adapter,
+                                    generation_kwargs, trace)
+        # Stored before the flight ends, so later requests hit the cache instead
+        _store_response(instruction, scope, result, generation_kwargs)
+        return result
+    
+    # Unlike caching this also applies to sampled generation: only requests in
+    # flight at the same moment share a sample
+    flight_scope = _model_scope(model, base_model_name, lora_adapter_path, adapter)
+    if not COALESCE_REQUESTS or flight_scope is None:
+        return generate()
+    return _in_flight.do(ResponseCache.make_key(instruction, flight_scope, generation_kwargs), generate)
+
+
+def _generate_uncached(instruction, model, tokenizer, base_model_name, lora_adapter_path, adapter,
+                       generation_kwargs, trace):
+    """Run the configured backend for one instruction"""
+    backend = _select_backend(model, tokenizer, base_model_name, lora_adapter_path, adapter)
+    trace["backend"] = backend.name
+    if backend.name == "remote":
+        try:
+            return backend.generate(instruction, generation_kwargs)
+        except Exception as e:
+            if not REMOTE_LOCAL_FALLBACK:
+                raise
+            print(f"Remote MODEL_ENDPOINT_URL call failed: {e}. Falling back to local model (REMOTE_LOCAL_FALLBACK=1).")
+            backend = TransformersBackend(base_model_name, lora_adapter_path)
+            trace["backend"] = backend.name
+    return backend.generate(instruction, generation_kwargs)
+
+
+class TransformersBackend(InferenceBackend):
+    """
+    transformers + PEFT in this process: the shared singleton model, or a caller-supplied one.
+    `adapter` names one of the shared model's loaded adapters (None: the default one).
+    """
+    
+    name = "transformers"
+    
+    def __init__(self, base_model_name="microsoft/Phi-3-mini-4k-instruct", lora_adapter_path=None,
+                 model=None, tokenizer=None, adapter=None):
+        self.base_model_name = base_model_name
+        self.lora_adapter_path = lora_adapter_path
+        self.model = model
+        self.tokenizer = tokenizer
+        self.adapter = adapter
+    
+    def load(self):
+        if self.model is None:
+            with _model_lock:
+                if _model is None:
+                    _load_model(self.base_model_name, self.lora_adapter_path)
+    
+    def warm_up(self):
+        warm_up_model(self.base_model_name)
+    
+    def generate(self, instruction, generation_kwargs=None):
+        generation_kwargs = GENERATION_KWARGS if generation_kwargs is None else generation_kwargs
+        # Initialize model if not provided
+        model, tokenizer = _resolve_model(self.model, self.tokenizer, self.base_model_name, self.lora_adapter_path)
+        
+        prompt = build_prompt(instruction, tokenizer, self.base_model_name)
+        
+        if BATCH_MAX_SIZE > 1 and model is _model:
+            # Share one batched generate call with other concurrent requests (same settings, prompt format and adapter)
+            settings = tuple(sorted(generation_kwargs.items()))
+            response = _get_batcher().submit((prompt, instruction), key=(settings, self.base_model_name, self.adapter))
+        else:
+            with _using_adapter(model, self.adapter):
+                prefix = _prompt_prefix(model, tokenizer, self.base_model_name, self.adapter)
+                response = generate_texts([prompt], model, tokenizer, [instruction], prefix, **generation_kwargs)[0]
+        
+        if output_mode() != "off":
+            return _constrained_answer(response, instruction)
+        plan = response.strip()
+        
+        return command_from_plan(plan, instruction), plan
+    
+    def stream(self, instruction, generation_kwargs=None):
+        settings = GENERATION_KWARGS if generation_kwargs is None else generation_kwargs
+        model, tokenizer = _resolve_model(self.model, self.tokenizer, self.base_model_name, self.lora_adapter_path)
+        from transformers import TextIteratorStreamer
+        
+        prompt = build_prompt(instruction, tokenizer, self.base_model_name)
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+        
+        def run_generate():
+            try:
+                # The adapter stays active until the whole generation has finished
+                with _using_adapter(model, self.adapter):
+                    prefix = _prompt_prefix(model, tokenizer, self.base_model_name, self.adapter)
+                    inputs = _encode_prompts([prompt], model, tokenizer, prefix)
+                    generation_kwargs = dict(settings)
+                    processors = logits_processors(tokenizer, inputs["input_ids"].shape[1])
+                    if processors:
+                        generation_kwargs["logits_processor"] = processors
+                    elif EARLY_STOP:
+                        generation_kwargs["stopping_criteria"] = [CommandStoppingCriteria(
+                            tokenizer, [instruction], inputs["input_ids"].shape[1], generation_kwargs["max_new_tokens"]
+                        )]
+                    assisted_generate(
+                        model, tokenizer, inputs,
+                        **generation_kwargs,
+                        streamer=streamer,
+                        pad_token_id=tokenizer.pad_token_id,
+                        eos_token_id=tokenizer.eos_token_id
+                    )
+            except Exception as e:
+                errors.append(e)
+                # Unblock the consumer loop below
+                streamer.end()
+        
+        thread = threading.Thread(target=run_generate, name="stream-generate", daemon=True)
+        thread.start()
+        
+        extractor = IncrementalCommandExtractor(instruction)
+        # Constrained answers are parsed whole once they are complete
+        constrained = output_mode() != "off"
+        command = None
+        for text in streamer:
+            if not text:
+                continue
+            yield ("token", text)
+            if constrained or command is not None:
+                extractor.text += text
+            else:
+                command = extractor.feed(text)
+                if command:
+                    # Early preview; the final command is picked from the whole plan below
+                    yield ("command", command, extractor.text.strip())
+        thread.join()
+        
+        if errors:
+            raise errors[0]
+        
+        if constrained:
+            yield ("done", *_constrained_answer(extractor.text, instruction))
+            return
+        plan = extractor.text.strip()
+        yield ("done", command_from_plan(plan, instruction), plan)
+
+
+def get_backend(base_model_name="microsoft/Phi-3-mini-4k-instruct", lora_adapter_path=None, adapter=None):
+    """The inference backend selected by INFERENCE_BACKEND / MODEL_ENDPOINT_URL"""
+    kind = backend_kind()
+    if kind == "transformers":
+        # Cheap to create: the model itself is the module-level singleton
+        return TransformersBackend(base_model_name, lora_adapter_path, adapter=adapter)
+    with _backends_lock:
+        if kind not in _backends:
+            if kind == "remote":
+                url = os.getenv("MODEL_ENDPOINT_URL")
+                if not url:
+                    raise ValueError("INFERENCE_BACKEND=remote requires MODEL_ENDPOINT_URL")
+                _backends[kind] = RemoteBackend(url)
+            else:
+                _backends[kind] = LlamaCppBackend()
+        return _backends[kind]
+
+
+def close_backends():
+    """Release the shared backends' connections (called on API shutdown)"""
+    with _backends_lock:
+        for backend in _backends.values():
+            backend.close()
+        _backends.clear()
+
+
+def _select_backend(model, tokenizer, base_model_name, lora_adapter_path, adapter=None):
+    # Caller-supplied models always run through transformers
+    if model is not None or tokenizer is not None:
+        return TransformersBackend(base_model_name, lora_adapter_path, model, tokenizer)
+    return get_backend(base_model_name, lora_adapter_path, adapter)
+
+
+def stream_command(instruction, model=None, tokenizer=None,
+                   base_model_name="microsoft/Phi-3-mini-4k-instruct",
+                   lora_adapter_path=None, trace=None, adapter=None, profile=None):
+    """
+    Generate a shell command while streaming the model's plan token by token.
+    `trace` is filled in and `adapter` and `profile` selected as for generate_command.
+    
+    Yields:
+        tuple: ("token", text) for each decoded chunk,
+               ("command", command, plan) as soon as a usable command is recognised,
+               ("done", command, plan) once generation has finished
+    """
+    adapter = _resolve_adapter(adapter, model, tokenizer, base_model_name, lora_adapter_path)
+    generation_kwargs = get_profile(profile) if profile else GENERATION_KWARGS
+    backend = _select_backend(model, tokenizer, base_model_name, lora_adapter_path, adapter)
+    if backend.name == "remote":
+        # The remote endpoint does not stream, so emit its single result
+        command, plan = generate_command(instruction, model, tokenizer,
+                                         base_model_name=base_model_name,
+                                         lora_adapter_path=lora_adapter_path, trace=trace, profile=profile)
+        yield ("command", command, plan)
+        yield ("done", command, plan)
+        return
+    
+    trace = {} if trace is None else trace
+    trace.update(cache_hit=False, backend=backend.name)
+    scope = _cache_scope(model, base_model_name, lora_adapter_path, adapter, generation_kwargs)
+    answered = _fast_path(instruction, scope, generation_kwargs, adapter, model)
+    if answered is not None:
+        trace["cache_hit"] = True
+        yield ("command", *answered)
+        yield ("done", *answered)
+        return
+    
+    for event in backend.stream(instruction, generation_kwargs):
+        if event[0] == "done":
+            _store_response(instruction, scope, event[1:], generation_kwargs)
+        yield event
+
+
+def log_command(instruction, command, log_path=None, **fields):
+    """
+    Queue a trace record for the background trace logger (see trace_log.py).
+    Extra fields such as latency_ms, cache_hit and backend are stored with it.
+    """
+    get_trace_logger(log_path).log({"instruction": instruction, "step": command, **fields})
 
@@ -2,13 +2,28 @@
 FastAPI server for Prompt2Shell backend API.
 Provides REST endpoints for command generation.
 """
+import asyncio
+import json
+import time
+
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 # Import agent utilities (assuming src directory is in path)
-from agent_utils import initialize_model, generate_command
+from agent_utils import (generate_command, stream_command, get_response_cache, get_retrieval_index,
+                         start_model_loading, close_backends, log_command,
+                         get_adapters, load_adapter, unload_adapter)
+from adapters import AdapterError
+from generation_profiles import ProfileError
+from backends import backend_kind
+from model_status import load_status
+from inference_executor import InferenceExecutor, QueueFullError, DeadlineExceededError
+from remote_client import RemoteModelError, RemoteUnavailableError
+from trace_log import TRACE_LOG, close_trace_loggers
+import metrics
 
 # Initialize FastAPI app
 app = FastAPI(title="Prompt2Shell API", version="1.0.0")
@@ -43,9 +58,23 @@ else:
 
 app.add_middleware(CORSMiddleware, **cors_kwargs)
 
+# Blocking model calls run here instead of on the event loop
+inference_executor = InferenceExecutor()
+
 # Request/Response models
 class GenerateRequest(BaseModel):
     prompt: str
+    # Optional per-request deadline in seconds (capped at INFERENCE_TIMEOUT)
+    timeout: Optional[float] = None
+    # Optional name of a loaded LoRA adapter (see /adapters); the default adapter if omitted
+    adapter: Optional[str] = None
+    # Optional generation profile: fast (greedy, cacheable), balanced or creative; GENERATION_PROFILE if omitted
+    profile: Optional[str] = None
+
+
+class AdapterRequest(BaseModel):
+    name: str
+    path: str
 
 
 class Step(BaseModel):
@@ -58,20 +87,34 @@ class GenerateResponse(BaseModel):
     steps: List[Step]
 
 
+MODEL_NAME = "Phi-3-mini (QLoRA Fine-Tuned)"
+# Base model and LoRA adapter served by the local backends
+BASE_MODEL = os.getenv("BASE_MODEL", "microsoft/Phi-3-mini-4k-instruct")
+LORA_ADAPTER_PATH = os.getenv("LORA_ADAPTER_PATH") or None
+
+
 # Initialize model on startup
 @app.on_event("startup")
 async def startup_event():
-    """Load model on startup unless proxying to external model."""
-    if os.getenv("MODEL_ENDPOINT_URL"):
+    """Load the retrieval index, and start loading the model in the background unless proxying to external model."""
+    get_retrieval_index()
+    if backend_kind() == "remote":
         print("MODEL_ENDPOINT_URL detected; skipping local model initialization.")
+        load_status.enter("ready")
         return
-    print("Initializing model on server startup...")
-    try:
-        initialize_model()
-        print("Model initialized successfully!")
-    except Exception as e:
-        print(f"Error initializing model: {e}")
-        print("Model will be loaded on first request...")
+    print("Initializing model in the background (see /ready for progress)...")
+    start_model_loading(BASE_MODEL, LORA_ADAPTER_PATH)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop accepting inference work, drop anything still queued and persist caches."""
+    inference_executor.shutdown()
+    close_backends()
+    close_trace_loggers()
+    cache = get_response_cache()
+    if cache is not None:
+        cache.save()
 
 
 @app.get("/health")
@@ -80,6 +123,110 @@ async def health_check():
     return {"status": "healthy", "message": "API is running"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 with the current load stage before that"""
+    status = load_status.snapshot()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Inference executor load plus counters and histograms (batching, caches, ...)"""
+    return {"executor": inference_executor.stats(), "metrics": metrics.snapshot()}
+
+
+async def _run_adapter_op(fn, *args, **kwargs):
+    """Run an adapter operation on the inference executor, mapping its errors to HTTP responses"""
+    try:
+        return await inference_executor.run(fn, *args, **kwargs)
+    except AdapterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+
+@app.get("/adapters")
+async def list_adapters():
+    """Loaded LoRA adapters with their load time and memory cost, and the active one"""
+    return await _run_adapter_op(lambda: get_adapters(BASE_MODEL, LORA_ADAPTER_PATH).snapshot())
+
+
+@app.post("/adapters")
+async def add_adapter(request: AdapterRequest):
+    """Load a LoRA adapter next to the others, without a restart"""
+    info = await _run_adapter_op(load_adapter, request.name, request.path,
+                                 base_model_name=BASE_MODEL, lora_adapter_path=LORA_ADAPTER_PATH)
+    return {"name": request.name, **info}
+
+
+@app.delete("/adapters/{name}")
+async def remove_adapter(name: str):
+    """Unload a LoRA adapter and free its weights"""
+    await _run_adapter_op(unload_adapter, name, base_model_name=BASE_MODEL, lora_adapter_path=LORA_ADAPTER_PATH)
+    return {"name": name, "unloaded": True}
+
+
+def _request_timeout(request: GenerateRequest):
+    """Validate a generate request and return its deadline in seconds."""
+    if not request.prompt or not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt cannot be empty")
+    if request.timeout is not None and request.timeout <= 0:
+        raise HTTPException(status_code=400, detail="Timeout must be positive")
+    
+    timeout = inference_executor.default_timeout
+    if request.timeout is not None:
+        timeout = min(request.timeout, timeout)
+    return timeout
+
+
+def _make_step(command, plan, prompt):
+    """Build a Step, using the plan (first 200 chars) as the explanation."""
+    explanation = plan[:200] + "..." if len(plan) > 200 else plan
+    if not explanation.strip():
+        explanation = f"Generated command for: {prompt[:100]}"
+    return Step(command=command, explanation=explanation)
+
+
+def _error_detail(e):
+    """Log a generation failure and turn it into a user-facing message."""
+    import traceback
+    error_traceback = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+    print(f"Error generating command: {e}")
+    print(f"Full traceback:\n{error_traceback}")
+    
+    # Provide more helpful error messages
+    error_detail = str(e)
+    if "numpy" in error_detail.lower() or "Unable to compare versions" in error_detail:
+        error_detail = (
+            "Model initialization failed due to NumPy version detection issue. "
+            "NumPy is installed but transformers cannot detect it. "
+            "This is likely due to corrupted package metadata. "
+            "Error: " + str(e)
+        )
+    return error_detail
+
+
+def _trace(prompt, command, started, trace):
+    """Queue a trace log record for a served request (TRACE_LOG)"""
+    if TRACE_LOG:
+        log_command(prompt, command, latency_ms=round((time.perf_counter() - started) * 1000, 1),
+                    cache_hit=trace.get("cache_hit"), backend=trace.get("backend"))
+
+
+def _sse(event, data):
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @app.post("/generate", response_model=GenerateResponse)
 async def generate_commands(request: GenerateRequest):
     """
@@ -87,50 +234,122 @@ async def generate_commands(request: GenerateRequest):
     
     Returns a response with model name and list of steps (commands with explanations).
     """
-    if not request.prompt or not request.prompt.strip():
-        raise HTTPException(status_code=400, detail="Prompt cannot be empty")
+    timeout = _request_timeout(request)
+    started = time.perf_counter()
+    trace = {}
     
     try:
-        # Generate command using agent utilities
-        command, plan = generate_command(request.prompt.strip())
-        
-        # Create explanation from plan (first 200 chars or the plan itself)
-        explanation = plan[:200] + "..." if len(plan) > 200 else plan
-        if not explanation.strip():
-            explanation = f"Generated command for: {request.prompt[:100]}"
+        # Generate command on the inference executor so the event loop stays free
+        command, plan = await inference_executor.run(
+            generate_command, request.prompt.strip(), trace=trace, timeout=timeout,
+            base_model_name=BASE_MODEL, lora_adapter_path=LORA_ADAPTER_PATH, adapter=request.adapter,
+            profile=request.profile
+        )
+        _trace(request.prompt.strip(), command, started, trace)
         
         # Return response in format expected by frontend
         return GenerateResponse(
-            model="Phi-3-mini (QLoRA Fine-Tuned)",
-            steps=[
-                Step(
-                    command=command,
-                    explanation=explanation
-                )
-            ]
+            model=MODEL_NAME,
+            steps=[_make_step(command, plan, request.prompt)]
+        )
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RemoteUnavailableError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
         )
+    except RemoteModelError as e:
+        raise HTTPException(status_code=502, detail=f"Remote model endpoint failed: {e}")
+    except (AdapterError, ProfileError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        import traceback
-        error_traceback = traceback.format_exc()
-        print(f"Error generating command: {e}")
-        print(f"Full traceback:\n{error_traceback}")
-        
-        # Provide more helpful error messages
-        error_detail = str(e)
-        if "numpy" in error_detail.lower() or "Unable to compare versions" in error_detail:
-            error_detail = (
-                "Model initialization failed due to NumPy version detection issue. "
-                "NumPy is installed but transformers cannot detect it. "
-                "This is likely due to corrupted package metadata. "
-                "Error: " + str(e)
-            )
-        
         raise HTTPException(
             status_code=500,
-            detail=error_detail
+            detail=_error_detail(e)
         )
 
 
+@app.post("/generate/stream")
+async def generate_commands_stream(request: GenerateRequest):
+    """
+    Streaming variant of /generate using Server-Sent Events.
+    
+    Emits `token` events with plan text as it is generated, a `step` event as soon
+    as a usable command is recognised, then a `done` event carrying the same body
+    as /generate (or an `error` event).
+    """
+    timeout = _request_timeout(request)
+    prompt = request.prompt.strip()
+    started = time.perf_counter()
+    trace = {}
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    
+    def produce():
+        # Runs on an inference worker; hands events back to the event loop
+        for event in stream_command(prompt, base_model_name=BASE_MODEL, lora_adapter_path=LORA_ADAPTER_PATH,
+                                    trace=trace, adapter=request.adapter, profile=request.profile):
+            if event[0] == "done":
+                _trace(prompt, event[1], started, trace)
+            loop.call_soon_threadsafe(events.put_nowait, event)
+    
+    try:
+        job = asyncio.ensure_future(inference_executor.submit(produce, timeout=timeout))
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    def render(event):
+        if event[0] == "token":
+            return _sse("token", {"text": event[1]})
+        step = _make_step(event[1], event[2], request.prompt)
+        if event[0] == "command":
+            return _sse("step", step.model_dump())
+        return _sse("done", GenerateResponse(model=MODEL_NAME, steps=[step]).model_dump())
+    
+    async def event_stream():
+        try:
+            while True:
+                getter = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({getter, job}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield render(getter.result())
+                    continue
+                getter.cancel()
+                # Job finished: flush events it queued before completing
+                while not events.empty():
+                    yield render(events.get_nowait())
+                error = job.exception()
+                if isinstance(error, DeadlineExceededError):
+                    yield _sse("error", {"status": 504, "detail": str(error)})
+                elif isinstance(error, RemoteUnavailableError):
+                    yield _sse("error", {"status": 503, "detail": str(error)})
+                elif isinstance(error, RemoteModelError):
+                    yield _sse("error", {"status": 502, "detail": f"Remote model endpoint failed: {error}"})
+                elif isinstance(error, (AdapterError, ProfileError)):
+                    yield _sse("error", {"status": 400, "detail": str(error)})
+                elif error is not None:
+                    yield _sse("error", {"status": 500, "detail": _error_detail(error)})
+                break
+        finally:
+            if not job.done():
+                job.cancel()
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,215 @@
+"""
+Inference backends behind one generate/stream interface.
+agent_utils.get_backend() picks one from INFERENCE_BACKEND:
+  transformers - transformers + PEFT in this process (agent_utils.TransformersBackend)
+  llama_cpp    - GGUF model run in-process by llama.cpp, CPU-only with mmap'd weights
+  remote       - HTTP endpoint at MODEL_ENDPOINT_URL (e.g. model_server.py)
+"""
+import os
+import threading
+
+import metrics
+from model_status import load_status
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "transformers", "llama_cpp" or "remote" (default: remote when MODEL_ENDPOINT_URL is set, else transformers)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "")
+# GGUF weights for the llama_cpp backend
+GGUF_MODEL_PATH = os.getenv("GGUF_MODEL_PATH", os.path.join(BACKEND_DIR, "models", "phi3-mini.gguf"))
+# Context window for the llama_cpp backend
+GGUF_CONTEXT = int(os.getenv("GGUF_CONTEXT", "2048"))
+# Layers offloaded to a GPU by llama.cpp (0 keeps the backend fully on CPU)
+GGUF_GPU_LAYERS = int(os.getenv("GGUF_GPU_LAYERS", "0"))
+
+BACKENDS = ("transformers", "llama_cpp", "remote")
+
+_early_stops = metrics.counter("early_stops_total", "Generations ended early by CommandStoppingCriteria")
+_tokens_saved = metrics.counter("tokens_saved_total", "max_new_tokens minus tokens actually generated for early-stopped sequences")
+
+
+def backend_kind():
+    """Name of the configured backend"""
+    kind = INFERENCE_BACKEND or ("remote" if os.getenv("MODEL_ENDPOINT_URL") else "transformers")
+    if kind not in BACKENDS:
+        raise ValueError(f"INFERENCE_BACKEND must be one of {BACKENDS}, got {kind!r}")
+    return kind
+
+
+class InferenceBackend:
+    """
+    Interface shared by all backends. `generate` returns (command, plan);
+    `stream` yields the same events as agent_utils.stream_command. Both take
+    the request's generate settings (None: agent_utils.GENERATION_KWARGS).
+    Caching and fast paths are handled by the caller, not the backend.
+    """
+
+    name = None
+
+    def load(self):
+        """Load weights or open connections (idempotent, records progress in load_status)"""
+
+    def warm_up(self):
+        """Run a short generation so the first real request is not cold"""
+
+    def close(self):
+        """Release connections and threads held by the backend"""
+
+    def generate(self, instruction, generation_kwargs=None):
+        raise NotImplementedError
+
+    def stream(self, instruction, generation_kwargs=None):
+        """Backends that cannot stream emit their single result"""
+        command, plan = self.generate(instruction, generation_kwargs)
+        yield ("command", command, plan)
+        yield ("done", command, plan)
+
+
+class RemoteBackend(InferenceBackend):
+    """
+    HTTP model endpoint that takes {"prompt": ...} and returns {"response": command}.
+    `url` may list several equivalent endpoints, comma-separated; requests go
+    through one pooled RemoteModelClient (retries, circuit breaking, hedging).
+    """
+
+    name = "remote"
+
+    def __init__(self, url):
+        from remote_client import RemoteModelClient, endpoint_urls
+
+        self.url = url
+        self.client = RemoteModelClient(endpoint_urls(url))
+
+    def close(self):
+        self.client.close()
+
+    def generate(self, instruction, generation_kwargs=None):
+        # The endpoint applies its own generate settings
+        data = self.client.generate_sync(instruction)
+        cmd = data.get("response") or data.get("command") or ""
+        if not cmd:
+            return "# No command returned", ""
+        return cmd, cmd
+
+
+class LlamaCppBackend(InferenceBackend):
+    """
+    GGUF model run in-process by llama.cpp. Weights are memory-mapped, so the
+    model starts in seconds, shares the page cache across processes, and needs
+    neither torch nor a GPU.
+    """
+
+    name = "llama_cpp"
+
+    def __init__(self, model_path=GGUF_MODEL_PATH, n_ctx=GGUF_CONTEXT, n_gpu_layers=GGUF_GPU_LAYERS, threads=None):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_gpu_layers = n_gpu_layers
+        self.threads = threads
+        self._llm = None
+        # A llama.cpp context is not thread-safe; generations run one at a time
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._llm is not None:
+                return False
+            load_status.enter("imports")
+            try:
+                from llama_cpp import Llama
+            except ImportError as e:
+                raise ImportError(f"INFERENCE_BACKEND=llama_cpp needs llama-cpp-python: {e}. "
+                                  f"Install it with: pip install llama-cpp-python")
+            if not os.path.exists(self.model_path):
+                raise FileNotFoundError(f"GGUF model not found at {self.model_path} (set GGUF_MODEL_PATH)")
+
+            from cpu_inference import available_cpus, CPU_THREADS
+            threads = self.threads or CPU_THREADS or available_cpus()
+            load_status.enter("base_weights")
+            print(f"Loading GGUF model {self.model_path} with llama.cpp ({threads} threads)...")
+            self._llm = Llama(
+                model_path=self.model_path,
+                n_ctx=self.n_ctx,
+                n_threads=threads,
+                n_threads_batch=threads,
+                n_gpu_layers=self.n_gpu_layers,
+                use_mmap=True,
+                use_mlock=False,
+                verbose=False,
+            )
+            return True
+
+    def _ensure_loaded(self):
+        # Lazy load from a request (no background loader ran or it failed)
+        try:
+            if self.load():
+                load_status.enter("ready")
+        except Exception as e:
+            load_status.fail(e)
+            raise
+
+    def warm_up(self):
+        load_status.enter("warmup")
+        from agent_utils import GENERATION_KWARGS, WARMUP_INSTRUCTION
+        for _ in self._chunks(WARMUP_INSTRUCTION, GENERATION_KWARGS, max_tokens=8):
+            pass
+
+    @staticmethod
+    def _completion_kwargs(generation_kwargs):
+        sampled = generation_kwargs.get("do_sample", False)
+        return {
+            "max_tokens": generation_kwargs.get("max_new_tokens", 150),
+            "temperature": generation_kwargs.get("temperature", 1.0) if sampled else 0.0,
+            "top_p": generation_kwargs.get("top_p", 1.0) if sampled else 1.0,
+            "repeat_penalty": generation_kwargs.get("repetition_penalty", 1.0),
+        }
+
+    def _chunks(self, instruction, generation_kwargs, **overrides):
+        """Text chunks (roughly one per token) of the model's answer; closing the generator stops generation"""
+        from prompt_templates import SYSTEM_PROMPT
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": instruction},
+        ]
+        kwargs = dict(self._completion_kwargs(generation_kwargs), **overrides)
+        with self._lock:
+            for chunk in self._llm.create_chat_completion(messages=messages, stream=True, **kwargs):
+                text = chunk["choices"][0]["delta"].get("content")
+                if text:
+                    yield text
+
+    def stream(self, instruction, generation_kwargs=None):
+        from agent_utils import EARLY_STOP, GENERATION_KWARGS, IncrementalCommandExtractor, command_from_plan
+
+        self._ensure_loaded()
+        generation_kwargs = GENERATION_KWARGS if generation_kwargs is None else generation_kwargs
+        max_tokens = generation_kwargs.get("max_new_tokens", 150)
+        extractor = IncrementalCommandExtractor(instruction)
+        command = None
+        chunks = self._chunks(instruction, generation_kwargs)
+        try:
+            for count, text in enumerate(chunks, 1):
+                yield ("token", text)
+                found = extractor.feed(text)
+                if command is None and found:
+                    # Early preview; the final command is picked from the whole output below
+                    command = found
+                    yield ("command", command, extractor.text.strip())
+                if EARLY_STOP and extractor.confident:
+                    # Same rule as CommandStoppingCriteria on the transformers path
+                    _early_stops.inc()
+                    _tokens_saved.inc(max(0, max_tokens - count))
+                    break
+        finally:
+            chunks.close()
+
+        plan = extractor.text.strip()
+        yield ("done", command_from_plan(plan, instruction), plan)
+
+    def generate(self, instruction, generation_kwargs=None):
+        result = None
+        for event in self.stream(instruction, generation_kwargs):
+            if event[0] == "done":
+                result = event[1], event[2]
+        return result
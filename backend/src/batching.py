@@ -0,0 +1,99 @@
+"""
+Dynamic micro-batching for concurrent generation requests.
+Callers block in submit() while a scheduler thread gathers prompts for a short
+window (or until the batch is full) and runs them through one batched call.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+
+# Largest number of prompts sent through one model.generate call (1 disables batching)
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "1"))
+# How long the scheduler waits for more prompts after the first one arrives
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "10"))
+
+_queue_wait = metrics.histogram(
+    "batch_queue_wait_seconds",
+    [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+    "Time a prompt waited in the batching queue before its batch started",
+)
+_batch_size = metrics.histogram(
+    "batch_size",
+    [1, 2, 4, 8, 16, 32, 64],
+    "Number of prompts per batched generate call",
+)
+
+
+class MicroBatcher:
+    """
+    Collects items from many threads and runs them in batches.
+
+    `run_batch(items, key)` receives items that share the same `key` (e.g. the
+    generation settings) and must return one result per item, in order.
+    """
+
+    def __init__(self, run_batch, max_batch_size=BATCH_MAX_SIZE, window_ms=BATCH_WINDOW_MS):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, item, key=None):
+        """Queue `item` for the next batch and block until its result is ready."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, key, future, time.monotonic()))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+
+            # Items with different settings cannot share a generate call
+            groups = {}
+            for entry in batch:
+                groups.setdefault(entry[1], []).append(entry)
+
+            for key, entries in groups.items():
+                started = time.monotonic()
+                for _, _, _, enqueued in entries:
+                    _queue_wait.observe(started - enqueued)
+                _batch_size.observe(len(entries))
+
+                try:
+                    results = list(self.run_batch([entry[0] for entry in entries], key))
+                    if len(results) != len(entries):
+                        # Which result belongs to which caller is unknown, so none get one
+                        raise RuntimeError(f"Batch returned {len(results)} results for {len(entries)} requests")
+                except Exception as e:
+                    for _, _, future, _ in entries:
+                        future.set_exception(e)
+                    continue
+                for (_, _, future, _), result in zip(entries, results):
+                    future.set_result(result)
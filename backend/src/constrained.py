@@ -0,0 +1,226 @@
+"""
+Grammar-constrained decoding.
+A logits processor only lets the model pick tokens that keep its output in a
+fixed shape, so it answers with the command itself instead of a free-form plan
+that the extraction heuristics have to dig through:
+
+    command: one shell command line, ended by a newline or end-of-sequence
+    json:    {"command": "...", "explanation": "..."} on one line
+
+Each shape is a character-level state machine. The tokens allowed in a state
+are found by running every token's text through the machine once per tokenizer
+and state, and cached; during generation a row's state comes from memoized
+(state, token) transitions.
+"""
+import json
+import os
+import re
+import threading
+import weakref
+
+import metrics
+
+
+# Shape the local model's output is constrained to: off (free-form plan), command or json
+CONSTRAINED_OUTPUT = os.getenv("CONSTRAINED_OUTPUT", "off")
+
+MODES = ("off", "command", "json")
+
+# Characters a command may start with, and the rest of its first word
+_COMMAND_START = frozenset("abcdefghijklmnopqrstuvwxyz./~_")
+_COMMAND_WORD = _COMMAND_START | frozenset("0123456789-+")
+_JSON_ESCAPES = frozenset('"\\/bfnrt')
+_SPACES = frozenset(" \t")
+_OPEN = '{"command": "'
+_MIDDLE = '", "explanation": "'
+_CLOSE = '"}'
+# Completed command string of a JSON answer cut off by max_new_tokens
+_PARTIAL_JSON = re.compile(r'\{"command": ("(?:[^"\\]|\\.)*")')
+
+_unparsed = metrics.counter("constrained_unparsed_total", "Constrained outputs that did not complete their shape")
+
+_grammars = weakref.WeakKeyDictionary()
+_grammars_lock = threading.Lock()
+
+
+def _step_command(state, char):
+    """command shape: optional spaces, a command word, the rest of the line"""
+    if state == "start":
+        if char in _SPACES:
+            return "start"
+        return "word" if char in _COMMAND_START else None
+    if state == "end" or char == "`":
+        return None
+    if char == "\n":
+        return "end"
+    if state == "word":
+        if char in _COMMAND_WORD:
+            return "word"
+        return "line" if char in _SPACES else None
+    return "line"
+
+
+def _step_json(state, char):
+    """json shape: the literals in order, with a command string and an explanation string between them"""
+    part, position = state
+    if part == "open":
+        if position == 0 and char in _SPACES:
+            return state
+        if char != _OPEN[position]:
+            return None
+        return ("command", "start") if position + 1 == len(_OPEN) else ("open", position + 1)
+    if part == "command":
+        if position == "start":
+            return ("command", "word") if char in _COMMAND_START else None
+        if position == "escape":
+            return ("command", "line") if char in _JSON_ESCAPES else None
+        if char == '"':
+            return ("middle", 1)
+        if position == "word" and char not in _COMMAND_WORD:
+            return ("command", "line") if char in _SPACES else None
+        if char == "\n" or char == "`":
+            return None
+        return ("command", "escape") if char == "\\" else ("command", position)
+    if part == "middle":
+        if char != _MIDDLE[position]:
+            return None
+        return ("text", "") if position + 1 == len(_MIDDLE) else ("middle", position + 1)
+    if part == "text":
+        if position == "escape":
+            return ("text", "") if char in _JSON_ESCAPES else None
+        if char == '"':
+            return ("close", 1)
+        if char == "\n":
+            return None
+        return ("text", "escape") if char == "\\" else state
+    if part == "close" and position < len(_CLOSE) and char == _CLOSE[position]:
+        return ("close", position + 1)
+    return None
+
+
+# mode: (initial state, step function, states in which the output may end)
+_SHAPES = {
+    "command": ("start", _step_command, lambda state: state in ("word", "line", "end")),
+    "json": (("open", 0), _step_json, lambda state: state == ("close", len(_CLOSE))),
+}
+
+
+def _token_texts(tokenizer):
+    """Text each token adds when decoded after other text; None for control tokens"""
+    base = tokenizer.encode("a", add_special_tokens=False)[-1:]
+    base_text = tokenizer.decode(base)
+    control = set(tokenizer.all_special_ids) | set(getattr(tokenizer, "added_tokens_decoder", {}))
+    texts = []
+    for token in range(len(tokenizer)):
+        if token in control:
+            texts.append(None)
+            continue
+        text = tokenizer.decode(base + [token])
+        texts.append(text[len(base_text):] if text.startswith(base_text) else tokenizer.decode([token]))
+    return texts
+
+
+class Grammar:
+    """One output shape over one tokenizer's vocabulary, with cached token masks and transitions."""
+
+    def __init__(self, tokenizer, mode):
+        self.initial, self._step, self._accepting = _SHAPES[mode]
+        self.eos_token_id = tokenizer.eos_token_id
+        self._texts = _token_texts(tokenizer)
+        self._masks = {}
+        self._transitions = {}
+        self._lock = threading.Lock()
+
+    def _advance(self, state, text):
+        for char in text:
+            state = self._step(state, char)
+            if state is None:
+                return None
+        return state
+
+    def state_after(self, tokens):
+        """State after the generated `tokens`; None once the output has ended"""
+        state = self.initial
+        for token in tokens:
+            if token == self.eos_token_id:
+                return None
+            key = (state, token)
+            if key not in self._transitions:
+                text = self._texts[token] if token < len(self._texts) else None
+                self._transitions[key] = self._advance(state, text) if text else None
+            state = self._transitions[key]
+            if state is None:
+                return None
+        return state
+
+    def mask(self, state, vocab_size):
+        """Boolean tensor of the tokens allowed in `state`"""
+        import torch
+
+        key = (state, vocab_size)
+        with self._lock:
+            if key not in self._masks:
+                allowed = torch.zeros(vocab_size, dtype=torch.bool)
+                for token, text in enumerate(self._texts[:vocab_size]):
+                    if text and self._advance(state, text) is not None:
+                        allowed[token] = True
+                if self._accepting(state) or not allowed.any():
+                    allowed[self.eos_token_id] = True
+                self._masks[key] = allowed
+            return self._masks[key]
+
+
+def get_grammar(tokenizer, mode):
+    """The cached Grammar for this tokenizer and mode"""
+    with _grammars_lock:
+        per_tokenizer = _grammars.setdefault(tokenizer, {})
+        if mode not in per_tokenizer:
+            per_tokenizer[mode] = Grammar(tokenizer, mode)
+        return per_tokenizer[mode]
+
+
+class GrammarLogitsProcessor:
+    """Logits processor that masks every token that would leave the grammar, per row."""
+
+    def __init__(self, grammar, prompt_length):
+        self.grammar = grammar
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores):
+        for row in range(input_ids.shape[0]):
+            state = self.grammar.state_after(input_ids[row, self.prompt_length:].tolist())
+            if state is None:
+                continue
+            mask = self.grammar.mask(state, scores.shape[-1]).to(scores.device)
+            scores[row] = scores[row].masked_fill(~mask, float("-inf"))
+        return scores
+
+
+def output_mode():
+    if CONSTRAINED_OUTPUT not in MODES:
+        raise ValueError(f"CONSTRAINED_OUTPUT must be one of {MODES}, got {CONSTRAINED_OUTPUT!r}")
+    return CONSTRAINED_OUTPUT
+
+
+def logits_processors(tokenizer, prompt_length):
+    """Logits processors for model.generate enforcing CONSTRAINED_OUTPUT ([] when off)"""
+    mode = output_mode()
+    if mode == "off":
+        return []
+    return [GrammarLogitsProcessor(get_grammar(tokenizer, mode), prompt_length)]
+
+
+def parse_output(text):
+    """(command, explanation) from a constrained output; command is None if it did not complete"""
+    text = text.strip()
+    if output_mode() == "json":
+        try:
+            answer = json.loads(text)
+            return answer["command"].strip() or None, answer["explanation"].strip()
+        except (ValueError, KeyError, TypeError, AttributeError):
+            _unparsed.inc()
+            partial = _PARTIAL_JSON.match(text)
+            command = json.loads(partial.group(1)).strip() if partial else ""
+            return command or None, ""
+    line = text.split("\n", 1)[0].strip()
+    return line or None, line
@@ -0,0 +1,127 @@
+"""
+CPU inference mode: thread tuning from the cgroup CPU quota plus dynamic int8
+quantization or bfloat16 weights for the merged model.
+Used by initialize_model() whenever the model runs on CPU.
+"""
+import gc
+import math
+import os
+import warnings
+
+
+# "int8" (dynamic quantization of Linear layers), "bf16" (bfloat16 weights, where supported) or "none"
+CPU_QUANTIZATION = os.getenv("CPU_QUANTIZATION", "none")
+# Intra-op threads for torch (0 = derive from the cgroup CPU quota / CPU affinity)
+CPU_THREADS = int(os.getenv("CPU_THREADS", "0"))
+# Inter-op threads for torch (0 = 1, generate() has little inter-op parallelism)
+CPU_INTEROP_THREADS = int(os.getenv("CPU_INTEROP_THREADS", "0"))
+
+CPU_QUANTIZATIONS = ("none", "int8", "bf16")
+
+
+def _cgroup_quota():
+    """CPUs allowed by the cgroup quota (v2 cpu.max or v1 cfs quota), or None if unlimited"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus():
+    """CPUs this process may actually use: CPU affinity capped by the cgroup quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS/Windows
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_quota()
+    if quota is not None:
+        # A 1.5 CPU quota still only sustains one busy thread without throttling
+        cpus = min(cpus, max(1, math.floor(quota)))
+    return max(1, cpus)
+
+
+def configure_threads(threads=CPU_THREADS, interop_threads=CPU_INTEROP_THREADS):
+    """Set torch's intra-op and inter-op thread counts; returns the counts in effect"""
+    import torch
+
+    threads = threads or available_cpus()
+    torch.set_num_threads(threads)
+    try:
+        # Only allowed before any inter-op parallel work has started
+        torch.set_num_interop_threads(interop_threads or 1)
+    except RuntimeError:
+        pass
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def bf16_supported():
+    import torch
+
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def cpu_mode(quantization=CPU_QUANTIZATION):
+    """The CPU mode that will actually be used (bf16 falls back to none on CPUs without support)"""
+    if quantization not in CPU_QUANTIZATIONS:
+        raise ValueError(f"CPU_QUANTIZATION must be one of {CPU_QUANTIZATIONS}, got {quantization!r}")
+    if quantization == "bf16" and not bf16_supported():
+        print("Warning: this CPU has no bfloat16 support; running in float32")
+        return "none"
+    return quantization
+
+
+def load_dtype(quantization=CPU_QUANTIZATION):
+    """dtype to load CPU weights in (bfloat16 directly, to never materialise float32 copies)"""
+    import torch
+
+    return torch.bfloat16 if cpu_mode(quantization) == "bf16" else torch.float32
+
+
+def optimize_for_cpu(model, quantization=CPU_QUANTIZATION):
+    """
+    Prepare a loaded model for CPU inference. LoRA adapters are merged first,
+    so quantization applies to the final weights.
+    """
+    import torch
+
+    mode = cpu_mode(quantization)
+    if mode == "none":
+        return model
+    if hasattr(model, "merge_and_unload"):
+        model = model.merge_and_unload()
+    if mode == "bf16":
+        return model.to(torch.bfloat16)
+
+    from torch.ao.quantization import quantize_dynamic
+
+    with warnings.catch_warnings():
+        # Eager-mode quantization is deprecated in favour of torchao, which is not a dependency
+        warnings.simplefilter("ignore")
+        model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    # The remaining float tensors (embeddings, norms) still view the memory-mapped
+    # checkpoint, which keeps the whole mapping alive, including the pages of the
+    # replaced Linear weights. Copying them lets the mapping go.
+    with torch.no_grad():
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            tensor.data = tensor.data.clone()
+    # The replaced float modules are only reachable through reference cycles
+    gc.collect()
+    return model
@@ -0,0 +1,48 @@
+"""
+Named generation profiles.
+A profile is one set of generate settings, picked per request (the API's
+"profile" field, agent.py --profile) or for the whole server
+(GENERATION_PROFILE). Greedy profiles are deterministic, so their answers are
+cached like any other (see response_cache.is_cacheable).
+"""
+import os
+
+
+# Profile used when a request does not name one
+GENERATION_PROFILE = os.getenv("GENERATION_PROFILE", "balanced")
+
+PROFILES = {
+    # Greedy and short, without repetition penalty: lowest latency, deterministic
+    "fast": {
+        "max_new_tokens": 64,
+        "do_sample": False,
+    },
+    # The original sampling settings
+    "balanced": {
+        "max_new_tokens": 150,
+        "do_sample": True,
+        "temperature": 0.7,
+        "top_p": 0.9,
+        "repetition_penalty": 1.1,
+    },
+    # Hotter sampling and a longer plan, for alternative commands
+    "creative": {
+        "max_new_tokens": 200,
+        "do_sample": True,
+        "temperature": 1.0,
+        "top_p": 0.95,
+        "repetition_penalty": 1.1,
+    },
+}
+
+
+class ProfileError(ValueError):
+    """A request for a generation profile that does not exist"""
+
+
+def get_profile(name=None):
+    """A copy of the generate settings of profile `name` (default: GENERATION_PROFILE), safe to modify"""
+    name = name or GENERATION_PROFILE
+    if name not in PROFILES:
+        raise ProfileError(f"Unknown generation profile {name!r} (available: {', '.join(PROFILES)})")
+    return dict(PROFILES[name])
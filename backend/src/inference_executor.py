@@ -0,0 +1,146 @@
+"""
+Bounded inference executor for the API server.
+Runs blocking model calls on dedicated worker threads so the event loop
+(and cheap endpoints like /health) stay responsive during generation.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Number of threads allowed to run inference at the same time
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+# Number of requests allowed to wait for a free worker before we shed load
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "16"))
+# Default per-request deadline in seconds (queue wait + generation)
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "120"))
+
+
+class QueueFullError(Exception):
+    """Raised when the admission queue has no free slots."""
+
+    def __init__(self, retry_after):
+        super().__init__("Inference queue is full, try again later")
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a request's deadline passes before its result is ready."""
+
+
+class InferenceExecutor:
+    """
+    Thread pool with a bounded admission queue and per-request deadlines.
+
+    At most `workers` jobs run at once and at most `queue_size` more may wait.
+    Jobs still queued when their deadline passes are cancelled without running.
+    """
+
+    def __init__(self, workers=INFERENCE_WORKERS, queue_size=INFERENCE_QUEUE_SIZE,
+                 default_timeout=INFERENCE_TIMEOUT):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.default_timeout = default_timeout
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._running = 0
+        # Exponential moving average of job duration, used for Retry-After hints
+        self._avg_duration = None
+
+    def stats(self):
+        """Return a snapshot of executor load."""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "running": self._running,
+                "queued": self._admitted - self._running,
+                "avg_duration_s": round(self._avg_duration, 3) if self._avg_duration else None,
+            }
+
+    def retry_after(self):
+        """Estimate how many seconds a rejected client should wait before retrying."""
+        with self._lock:
+            avg = self._avg_duration or 1.0
+            backlog = self._admitted
+        return max(1, int(round(avg * backlog / self.workers)))
+
+    def _admit(self):
+        with self._lock:
+            if self._admitted >= self.workers + self.queue_size:
+                return False
+            self._admitted += 1
+            return True
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._admitted -= 1
+
+    def _call(self, deadline, fn, args, kwargs):
+        # Drop work whose caller has already given up while it sat in the queue
+        if time.monotonic() >= deadline:
+            raise DeadlineExceededError("Request deadline passed while queued")
+        with self._lock:
+            self._running += 1
+        start = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            duration = time.monotonic() - start
+            with self._lock:
+                self._running -= 1
+                if self._avg_duration is None:
+                    self._avg_duration = duration
+                else:
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        """
+        Admit `fn(*args, **kwargs)` and schedule it on an inference worker.
+        
+        Returns an awaitable for the result. Admission happens immediately, so
+        callers can reject a request before starting a response.
+
+        Raises:
+            QueueFullError: if all worker and queue slots are taken
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        if not self._admit():
+            raise QueueFullError(self.retry_after())
+
+        deadline = time.monotonic() + timeout
+        try:
+            future = self._pool.submit(self._call, deadline, fn, args, kwargs)
+        except RuntimeError:
+            # Pool is shutting down
+            self._release()
+            raise
+        # The slot is held until the job finishes or is cancelled, so work that
+        # keeps running after a timeout still counts against admission
+        future.add_done_callback(self._release)
+        return self._wait(future, timeout)
+
+    async def _wait(self, future, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # Cancels the job if it has not started yet
+            future.cancel()
+            raise DeadlineExceededError(f"Request did not complete within {timeout:.1f}s")
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` on an inference worker and await its result.
+
+        Raises:
+            QueueFullError: if all worker and queue slots are taken
+            DeadlineExceededError: if the result is not ready within `timeout` seconds
+        """
+        return await self.submit(fn, *args, timeout=timeout, **kwargs)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,105 @@
+"""
+Lightweight in-process metrics (counters and histograms).
+Shared by the agent utilities and the API server; exposed via GET /metrics.
+"""
+import bisect
+import threading
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Counter:
+    """Monotonically increasing, thread-safe counter."""
+
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return {"type": "counter", "description": self.description, "value": self._value}
+
+
+class Histogram:
+    """Fixed-bucket histogram with cumulative counts (Prometheus-style)."""
+
+    def __init__(self, name, buckets, description=""):
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def quantile(self, q):
+        """Approximate quantile: upper bound of the bucket holding the q-th observation."""
+        with self._lock:
+            if self._count == 0:
+                return None
+            target = q * self._count
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= target:
+                    return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            cumulative = {}
+            seen = 0
+            for bound, count in zip(self.buckets + ["+Inf"], self._counts):
+                seen += count
+                cumulative[str(bound)] = seen
+            count, total = self._count, self._sum
+        return {
+            "type": "histogram",
+            "description": self.description,
+            "count": count,
+            "sum": round(total, 6),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": cumulative,
+        }
+
+
+def counter(name, description=""):
+    """Get or create the counter registered under `name`."""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Counter(name, description)
+        return _registry[name]
+
+
+def histogram(name, buckets, description=""):
+    """Get or create the histogram registered under `name`."""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Histogram(name, buckets, description)
+        return _registry[name]
+
+
+def snapshot():
+    """Return all registered metrics as a JSON-serialisable dict."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.snapshot() for metric in metrics}
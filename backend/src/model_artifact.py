@@ -0,0 +1,209 @@
+"""
+Pre-merged model artifacts for fast cold starts.
+The build step merges the LoRA adapter into the base weights once, optionally
+serializes them pre-quantized (bitsandbytes int8/int4), and writes safetensors
+plus a manifest. initialize_model() then memory-maps the artifact directly:
+no PEFT wrapping and no quantization at load time.
+
+Build an artifact (run from the backend directory):
+    python src/model_artifact.py build [--quantize int8|int4] [--dtype float16]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASE_MODEL = "microsoft/Phi-3-mini-4k-instruct"
+DEFAULT_LORA_ADAPTER = os.path.join(BACKEND_DIR, "lora_adapter", "lora_adapter")
+
+# Directory holding a built artifact; used by initialize_model() when its manifest matches the requested model
+MODEL_ARTIFACT_PATH = os.getenv("MODEL_ARTIFACT_PATH", os.path.join(BACKEND_DIR, "model_artifact"))
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_FORMAT = 1
+QUANTIZATIONS = ("none", "int8", "int4")
+# Adapter files that determine the merged weights
+_ADAPTER_FILES = ("adapter_config.json", "adapter_model.safetensors", "adapter_model.bin")
+
+
+def adapter_fingerprint(lora_adapter_path):
+    """sha256 over the adapter config and weights, so stale artifacts can be detected"""
+    digest = hashlib.sha256()
+    for name in _ADAPTER_FILES:
+        path = os.path.join(lora_adapter_path, name)
+        if os.path.exists(path):
+            digest.update(name.encode("utf-8"))
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    """Manifest of the artifact at `path`, or None if there is no complete artifact there"""
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not path or not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: unreadable model artifact manifest {manifest_path}: {e}")
+        return None
+    for name, info in manifest.get("files", {}).items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != info["bytes"]:
+            print(f"Warning: model artifact at {path} is incomplete ({name} missing or truncated)")
+            return None
+    return manifest
+
+
+def find_artifact(base_model_name, lora_adapter_path, path=MODEL_ARTIFACT_PATH):
+    """
+    Return (path, manifest) when the artifact at `path` was built from this
+    base model and adapter, else None (the caller loads base + LoRA instead).
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+    if manifest.get("format") != MANIFEST_FORMAT or manifest.get("base_model") != base_model_name:
+        print(f"Model artifact at {path} was built for {manifest.get('base_model')}; ignoring it")
+        return None
+    if manifest.get("adapter_fingerprint") != adapter_fingerprint(lora_adapter_path):
+        print(f"Model artifact at {path} does not match the LoRA adapter at {lora_adapter_path}; "
+              f"rebuild it with 'python src/model_artifact.py build'")
+        return None
+    return path, manifest
+
+
+def load_artifact_model(path, manifest, device_map):
+    """Load merged weights straight from the artifact's safetensors (memory-mapped)"""
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    if manifest["quantization"] != "none":
+        if device_map == "cpu":
+            raise RuntimeError(f"{manifest['quantization']} model artifacts need a CUDA GPU (bitsandbytes)")
+        # The serialized quantization config in config.json makes this load the
+        # pre-quantized weights as they are
+        return AutoModelForCausalLM.from_pretrained(path, device_map="auto", low_cpu_mem_usage=True)
+
+    torch_dtype = getattr(torch, manifest["dtype"])
+    if device_map == "cpu":
+        # float16 matmuls are slow or unsupported on CPU; use the CPU mode's dtype instead
+        from cpu_inference import load_dtype
+        torch_dtype = load_dtype()
+    return AutoModelForCausalLM.from_pretrained(
+        path,
+        device_map=device_map if device_map == "cpu" else "auto",
+        torch_dtype=torch_dtype,
+        low_cpu_mem_usage=True,
+    )
+
+
+def build_artifact(output, base_model_name=DEFAULT_BASE_MODEL, lora_adapter_path=DEFAULT_LORA_ADAPTER,
+                   quantize="none", dtype="float16"):
+    """Merge the adapter into the base model and write safetensors plus manifest to `output`"""
+    import torch
+    import transformers
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from peft import PeftModel
+
+    if quantize not in QUANTIZATIONS:
+        raise ValueError(f"quantize must be one of {QUANTIZATIONS}")
+    if quantize != "none" and not torch.cuda.is_available():
+        raise RuntimeError("int8/int4 artifacts are quantized with bitsandbytes and need a CUDA GPU")
+
+    # Drop any old manifest first so a half-written artifact is never picked up
+    os.makedirs(output, exist_ok=True)
+    if os.path.exists(os.path.join(output, MANIFEST_NAME)):
+        os.remove(os.path.join(output, MANIFEST_NAME))
+
+    print(f"Loading {base_model_name} and merging {lora_adapter_path}...")
+    base = AutoModelForCausalLM.from_pretrained(base_model_name, torch_dtype=getattr(torch, dtype),
+                                                device_map="cpu", low_cpu_mem_usage=True)
+    merged = PeftModel.from_pretrained(base, lora_adapter_path).merge_and_unload()
+
+    if quantize == "none":
+        merged.save_pretrained(output, safe_serialization=True)
+    else:
+        from transformers import BitsAndBytesConfig
+
+        staging = f"{output}.merged"
+        merged.save_pretrained(staging, safe_serialization=True)
+        del merged, base
+        if quantize == "int4":
+            # Same settings initialize_model uses for runtime quantization
+            config = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=torch.float16,
+                                        bnb_4bit_use_double_quant=True, bnb_4bit_quant_type="nf4")
+        else:
+            config = BitsAndBytesConfig(load_in_8bit=True)
+        print(f"Quantizing merged weights to {quantize}...")
+        quantized = AutoModelForCausalLM.from_pretrained(staging, quantization_config=config,
+                                                         device_map="auto", torch_dtype=torch.float16)
+        quantized.save_pretrained(output, safe_serialization=True)
+        shutil.rmtree(staging)
+
+    AutoTokenizer.from_pretrained(base_model_name).save_pretrained(output)
+
+    files = {
+        name: {"bytes": os.path.getsize(os.path.join(output, name)), "sha256": _file_sha256(os.path.join(output, name))}
+        for name in sorted(os.listdir(output)) if name.endswith(".safetensors")
+    }
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "base_model": base_model_name,
+        "lora_adapter": os.path.abspath(lora_adapter_path),
+        "adapter_fingerprint": adapter_fingerprint(lora_adapter_path),
+        "quantization": quantize,
+        "dtype": dtype,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "torch_version": torch.__version__,
+        "transformers_version": transformers.__version__,
+        "files": files,
+    }
+    tmp_path = os.path.join(output, f"{MANIFEST_NAME}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(output, MANIFEST_NAME))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the pre-merged model artifact")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    build = subparsers.add_parser("build", help="merge the LoRA adapter and write the artifact")
+    build.add_argument("--output", default=MODEL_ARTIFACT_PATH)
+    build.add_argument("--base-model", default=DEFAULT_BASE_MODEL)
+    build.add_argument("--lora", default=DEFAULT_LORA_ADAPTER)
+    build.add_argument("--quantize", choices=QUANTIZATIONS, default="none")
+    build.add_argument("--dtype", choices=("float16", "bfloat16", "float32"), default="float16")
+    info = subparsers.add_parser("info", help="print the manifest of a built artifact")
+    info.add_argument("--path", default=MODEL_ARTIFACT_PATH)
+    args = parser.parse_args()
+
+    if args.action == "build":
+        start = time.perf_counter()
+        manifest = build_artifact(args.output, args.base_model, args.lora, args.quantize, args.dtype)
+        size_mb = sum(f["bytes"] for f in manifest["files"].values()) / 1e6
+        print(f"Wrote {manifest['quantization']} artifact ({size_mb:.0f} MB) to {args.output} "
+              f"in {time.perf_counter() - start:.1f}s")
+    else:
+        manifest = read_manifest(args.path)
+        print(json.dumps(manifest, indent=2) if manifest else f"No complete artifact at {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Model load progress for readiness checks.
+The model loads in stages on a background thread; /ready reports the current
+stage so load balancers only route traffic to replicas that are warm.
+"""
+import threading
+import time
+
+
+# Load stages, in order
+STAGES = ("pending", "imports", "tokenizer", "base_weights", "lora", "cpu_optimize", "warmup", "ready")
+
+
+def rss_mb():
+    """Current resident set size of this process in MB (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class LoadStatus:
+    """Thread-safe record of the current load stage, per-stage timings and the last error."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage = "pending"
+        self.error = None
+        self._started_at = None
+        self._stage_started_at = None
+        self._durations = {}
+        self._ready_after = None
+        self._ready_rss_mb = None
+
+    @property
+    def ready(self):
+        return self.stage == "ready"
+
+    def enter(self, stage):
+        """Move to `stage`, closing the timing of the previous one"""
+        now = time.monotonic()
+        with self._lock:
+            if self._started_at is None:
+                self._started_at = now
+            if self._stage_started_at is not None and self.error is None:
+                self._durations[self.stage] = round(now - self._stage_started_at, 3)
+            self.stage = stage
+            self.error = None
+            self._stage_started_at = now
+            if stage == "ready":
+                self._ready_after = round(now - self._started_at, 3)
+                self._ready_rss_mb = round(rss_mb(), 1)
+        print(f"Model load stage: {stage}")
+
+    def fail(self, error):
+        """Record a failed load; the stage stays at the one that failed"""
+        with self._lock:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def elapsed(self):
+        """Seconds since loading started (0 if it has not)"""
+        with self._lock:
+            return time.monotonic() - self._started_at if self._started_at is not None else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "ready": self.stage == "ready",
+                "stage": self.stage,
+                "error": self.error,
+                "stage_seconds": dict(self._durations),
+                "time_to_ready_seconds": self._ready_after,
+                "rss_mb_at_ready": self._ready_rss_mb,
+            }
+
+
+# Progress of the shared model load, reported by the API's /ready endpoint
+load_status = LoadStatus()
@@ -0,0 +1,127 @@
+"""
+Prompt-prefix KV cache.
+Every chat prompt starts with the same tokens (template header + SYSTEM_PROMPT).
+Their past-key-values are computed once per model and copied into each
+generate call, so only the instruction suffix is prefilled. Batches are laid out
+as [prefix][padding][suffix] so every row shares the cached prefix positions.
+"""
+import copy
+import os
+import threading
+import weakref
+
+import metrics
+
+
+# Reuse the constant prompt prefix's past-key-values instead of prefilling it per request
+PREFIX_CACHE = os.getenv("PREFIX_CACHE", "1") == "1"
+
+_prefix_hits = metrics.counter("prefix_cache_hits_total", "Prompts generated from the cached prompt-prefix KV")
+_prefix_tokens = metrics.counter("prefix_tokens_reused_total", "Prompt tokens not prefilled thanks to the prefix KV cache")
+
+# Two instructions with nothing in common: their prompts share exactly the template prefix
+_PROBES = ("a", "Z9")
+
+_prefixes = weakref.WeakKeyDictionary()
+_prefixes_lock = threading.Lock()
+
+
+class PromptPrefix:
+    """Token ids and past-key-values of a model's constant prompt prefix."""
+
+    def __init__(self, model, tokenizer, token_ids):
+        import torch
+
+        self.tokenizer = tokenizer
+        self.token_ids = token_ids
+        self.device = model.device
+        with torch.no_grad():
+            ids = torch.tensor([token_ids], device=self.device)
+            self.past_key_values = model(input_ids=ids, use_cache=True).past_key_values
+        self._shareable = _shareable(self.past_key_values)
+
+    def __len__(self):
+        return len(self.token_ids)
+
+    def encode(self, prompts):
+        """
+        Tokenize prompts for model.generate with the prefix KV attached.
+        Returns None when a prompt does not start with the cached prefix tokens,
+        in which case the caller should prefill the full prompts as usual.
+        """
+        import torch
+
+        rows = self.tokenizer(list(prompts))["input_ids"]
+        size = len(self.token_ids)
+        if any(len(row) <= size or row[:size] != self.token_ids for row in rows):
+            return None
+        suffix_length = max(len(row) - size for row in rows)
+        pad = self.tokenizer.pad_token_id
+        input_ids, attention_mask = [], []
+        for row in rows:
+            padding = suffix_length - (len(row) - size)
+            input_ids.append(self.token_ids + [pad] * padding + row[size:])
+            attention_mask.append([1] * size + [0] * padding + [1] * (len(row) - size))
+
+        past_key_values = self._copy_cache()
+        if len(rows) > 1:
+            past_key_values.batch_repeat_interleave(len(rows))
+        _prefix_hits.inc(len(rows))
+        _prefix_tokens.inc(size * len(rows))
+        return {
+            "input_ids": torch.tensor(input_ids, device=self.device),
+            "attention_mask": torch.tensor(attention_mask, device=self.device),
+            "past_key_values": past_key_values,
+        }
+
+    def _copy_cache(self):
+        """A cache for one generate() call, which extends it"""
+        if not self._shareable:
+            return copy.deepcopy(self.past_key_values)
+        # Dynamic layers grow by concatenation and never write to the prefix tensors,
+        # so new cache and layer objects can share them
+        past_key_values = copy.copy(self.past_key_values)
+        past_key_values.layers = [copy.copy(layer) for layer in self.past_key_values.layers]
+        return past_key_values
+
+
+def _shareable(past_key_values):
+    """Whether every layer of the cache only ever replaces (never modifies) its tensors"""
+    from transformers.cache_utils import DynamicLayer
+
+    layers = getattr(past_key_values, "layers", None)
+    return bool(layers) and all(isinstance(layer, DynamicLayer) for layer in layers)
+
+
+def _common_prefix(rows):
+    length = 0
+    while all(len(row) > length for row in rows) and len({row[length] for row in rows}) == 1:
+        length += 1
+    return rows[0][:length]
+
+
+def get_prefix(model, tokenizer, build_prompt, key):
+    """
+    The cached PromptPrefix for `model` and prompt format `key`, computed on first use.
+    `build_prompt(instruction)` renders a full prompt; None if there is no shared prefix.
+    """
+    if not PREFIX_CACHE:
+        return None
+    with _prefixes_lock:
+        per_model = _prefixes.setdefault(model, {})
+        if key not in per_model:
+            prefix = None
+            try:
+                token_ids = _common_prefix([tokenizer(build_prompt(probe))["input_ids"] for probe in _PROBES])
+                if token_ids:
+                    prefix = PromptPrefix(model, tokenizer, token_ids)
+            except Exception as e:
+                print(f"Warning: prompt-prefix KV cache disabled for this model ({e})")
+            per_model[key] = prefix
+        return per_model[key]
+
+
+def invalidate(model):
+    """Forget `model`'s cached prefixes, e.g. after its adapters changed"""
+    with _prefixes_lock:
+        _prefixes.pop(model, None)
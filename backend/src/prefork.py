@@ -0,0 +1,164 @@
+"""
+Pre-fork multi-worker serving (run_server.py --workers N).
+The master process loads the model once, binds the listening socket and forks
+the workers. Workers inherit the weights copy-on-write: inference only reads
+them, so their pages stay shared and N workers cost about one model's memory.
+Each worker runs its own event loop and inference queue (InferenceExecutor)
+on the shared socket; the kernel spreads connections across them.
+
+Trace records from all workers go through a queue to a single trace-writer
+process, so the trace log keeps exactly one writer (and one rotator). The
+master itself never starts threads, so forking a replacement for a worker
+that died is always safe.
+"""
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+
+# Number of server processes; 1 serves from a single process without forking
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+# torch intra-op threads per worker (0 = this machine's CPUs divided between the workers)
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0"))
+
+
+def _preload(base_model_name, lora_adapter_path):
+    """Load what workers should share before forking; False if the backend cannot be forked"""
+    import agent_utils
+    from backends import backend_kind
+
+    agent_utils.get_retrieval_index()
+    if backend_kind() != "transformers":
+        # Remote: no weights. llama.cpp: each worker mmaps the GGUF file, sharing the page cache.
+        return True
+    torch = agent_utils._import_local_inference()[0]
+    if torch.cuda.is_available():
+        print("CUDA cannot be shared across fork(); serving from a single process")
+        return False
+    print("Loading the model once for all workers...")
+    agent_utils.initialize_model(base_model_name, lora_adapter_path)
+    import speculative
+    if speculative.SPECULATIVE_DECODING == "draft":
+        speculative.get_draft_model()
+    return True
+
+
+def _bind(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _fork(target, *args):
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = target(*args)
+        except BaseException as e:
+            print(f"{target.__name__} (pid {os.getpid()}) failed: {e}")
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+    return pid
+
+
+def _worker(app, sock, workers, trace_queue):
+    """Worker process: serve `app` on the inherited socket"""
+    import uvicorn
+    import trace_log
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    trace_log.forward_trace_logs(trace_queue)
+    if "torch" in sys.modules:
+        from cpu_inference import available_cpus, configure_threads
+        configure_threads(WORKER_THREADS or max(1, available_cpus() // workers))
+
+    server = uvicorn.Server(uvicorn.Config(app))
+    server.run(sockets=[sock])
+    # Hand queued trace records to the writer before exiting
+    trace_queue.close()
+    trace_queue.join_thread()
+    return 0 if server.started else 3
+
+
+def _trace_writer(trace_queue):
+    """Trace-writer process: the only process writing (and rotating) the trace log"""
+    import trace_log
+
+    # Ctrl-C reaches the whole process group; keep draining until the master's sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        for path, record in iter(trace_queue.get, None):
+            trace_log.get_trace_logger(path).log(record)
+    finally:
+        trace_log.close_trace_loggers()
+    return 0
+
+
+def serve(app, host="0.0.0.0", port=5000, workers=SERVER_WORKERS,
+          base_model_name="microsoft/Phi-3-mini-4k-instruct", lora_adapter_path=None):
+    """Serve `app` from `workers` forked processes sharing one loaded model"""
+    import uvicorn
+
+    if workers <= 1 or not hasattr(os, "fork") or not _preload(base_model_name, lora_adapter_path):
+        uvicorn.run(app, host=host, port=port)
+        return
+
+    import multiprocessing
+
+    sock = _bind(host, port)
+    trace_queue = multiprocessing.get_context("fork").Queue()
+    # Keep the collector from touching (and so copying) the pages of everything loaded so far
+    gc.collect()
+    gc.freeze()
+
+    writer = _fork(_trace_writer, trace_queue)
+    children = {}
+    for slot in range(workers):
+        children[_fork(_worker, app, sock, workers, trace_queue)] = slot
+    print(f"Serving on {host}:{port} with {workers} workers (pids {', '.join(map(str, children))})")
+
+    stopping = []
+
+    def stop(signum, _frame):
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while children:
+        pid, status = os.wait()
+        if pid == writer:
+            writer = None
+            if not stopping:
+                print(f"Trace writer exited (status {status}); restarting it")
+                writer = _fork(_trace_writer, trace_queue)
+        if pid not in children:
+            continue
+        slot = children.pop(pid)
+        if stopping:
+            continue
+        print(f"Worker {slot} (pid {pid}) exited (status {status}); restarting it")
+        time.sleep(1)  # don't spin on a worker that fails at startup
+        if not stopping:
+            children[_fork(_worker, app, sock, workers, trace_queue)] = slot
+
+    if writer is not None:
+        trace_queue.put(None)
+        os.waitpid(writer, 0)
+    sock.close()
@@ -0,0 +1,92 @@
+"""
+Prompt template registry.
+Each model family maps to one prompt format, resolved once per tokenizer and
+base model. Chat templates are rendered once around a placeholder and split
+into a fixed prefix and suffix, so building a prompt is a string concatenation
+instead of a Jinja render per request.
+"""
+import threading
+import weakref
+
+
+SYSTEM_PROMPT = "You are a helpful assistant that generates shell commands from natural language instructions. Provide clear, executable commands."
+
+# (name, substrings of the lowercased base model name, uses the tokenizer's chat template,
+#  format used when it does not / the tokenizer has none), first match wins
+TEMPLATES = [
+    ("phi-3", ("phi-3",), True, "<|user|>\n{instruction}<|end|>\n<|assistant|>"),
+    ("phi-2", ("phi-2", "phi2"), False, "Instruct: {instruction}\nOutput:"),
+    ("chat", ("mistral", "tinyllama"), True, "[INST] {instruction} [/INST]"),
+]
+DEFAULT_TEMPLATE = ("generic", (), False, "Question: {instruction}\n\nAnswer:")
+
+# Stands in for the instruction when compiling a chat template
+_PLACEHOLDER = "\x00instruction\x00"
+# Instructions a compiled template must render exactly like the chat template does
+_CHECKS = ("ls", "  padded {{ text }} \n", "multi\nline")
+
+_templates = weakref.WeakKeyDictionary()
+_templates_lock = threading.Lock()
+
+
+class PromptTemplate:
+    """A prompt format: prefix + instruction + suffix, or a per-call render when that is not exact."""
+
+    def __init__(self, name, prefix="", suffix="", render=None):
+        self.name = name
+        self.prefix = prefix
+        self.suffix = suffix
+        self._render = render
+
+    @property
+    def compiled(self):
+        return self._render is None
+
+    def render(self, instruction):
+        if self._render is not None:
+            return self._render(instruction)
+        return self.prefix + instruction + self.suffix
+
+
+def _split(text):
+    prefix, _, suffix = text.partition("{instruction}")
+    return prefix, suffix
+
+
+def _compile_chat(name, tokenizer):
+    """Compile the tokenizer's chat template, or fall back to rendering it per call"""
+    def render(instruction):
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": instruction},
+        ]
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    rendered = render(_PLACEHOLDER)
+    if rendered.count(_PLACEHOLDER) == 1:
+        template = PromptTemplate(name, *rendered.split(_PLACEHOLDER))
+        # Templates that trim or escape the content cannot be reduced to concatenation
+        if all(template.render(check) == render(check) for check in _CHECKS):
+            return template
+    return PromptTemplate(name, render=render)
+
+
+def resolve_template(tokenizer, base_model_name):
+    """Pick and compile the prompt template for a tokenizer and base model"""
+    lowered = base_model_name.lower()
+    name, _, chat, fallback = next(
+        (entry for entry in TEMPLATES if any(key in lowered for key in entry[1])), DEFAULT_TEMPLATE
+    )
+    if chat and getattr(tokenizer, "chat_template", None) is not None:
+        return _compile_chat(name, tokenizer)
+    return PromptTemplate(name, *_split(fallback))
+
+
+def get_template(tokenizer, base_model_name):
+    """The cached PromptTemplate for this tokenizer and base model"""
+    with _templates_lock:
+        per_tokenizer = _templates.setdefault(tokenizer, {})
+        template = per_tokenizer.get(base_model_name)
+        if template is None:
+            template = per_tokenizer[base_model_name] = resolve_template(tokenizer, base_model_name)
+        return template
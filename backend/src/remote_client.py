@@ -0,0 +1,254 @@
+"""
+Pooled async HTTP client for the remote model endpoint(s).
+One httpx.AsyncClient with keep-alive runs on its own event-loop thread and is
+shared by every caller (sync callers block on generate_sync). Requests are
+bounded by a semaphore, retried with jittered backoff, skipped for endpoints
+whose circuit breaker is open, and optionally hedged across several URLs.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+import metrics
+
+
+# Seconds to establish a connection to the endpoint
+REMOTE_CONNECT_TIMEOUT = float(os.getenv("REMOTE_CONNECT_TIMEOUT", "5"))
+# Seconds to wait for the endpoint's response
+REMOTE_READ_TIMEOUT = float(os.getenv("REMOTE_READ_TIMEOUT", "60"))
+# Maximum in-flight requests (also the keep-alive pool size)
+REMOTE_MAX_CONCURRENCY = int(os.getenv("REMOTE_MAX_CONCURRENCY", "32"))
+# Retries after a failed attempt (connection errors, timeouts, 429 and 5xx)
+REMOTE_RETRIES = int(os.getenv("REMOTE_RETRIES", "2"))
+# Base backoff in seconds; retry n sleeps uniformly in [0, base * 2^(n-1)]
+REMOTE_RETRY_BACKOFF = float(os.getenv("REMOTE_RETRY_BACKOFF", "0.2"))
+# Send the request to the next endpoint URL if no response arrived after this many ms (0 disables hedging)
+REMOTE_HEDGE_DELAY_MS = float(os.getenv("REMOTE_HEDGE_DELAY_MS", "0"))
+# Consecutive failures that open an endpoint's circuit breaker
+REMOTE_BREAKER_THRESHOLD = int(os.getenv("REMOTE_BREAKER_THRESHOLD", "5"))
+# Seconds an open breaker rejects requests before letting a trial request through
+REMOTE_BREAKER_COOLDOWN = float(os.getenv("REMOTE_BREAKER_COOLDOWN", "30"))
+# Serve requests from the local model when the remote endpoint fails (off: the error is returned)
+REMOTE_LOCAL_FALLBACK = os.getenv("REMOTE_LOCAL_FALLBACK", "0") == "1"
+
+_requests = metrics.counter("remote_requests_total", "HTTP requests sent to the remote model endpoint")
+_failures = metrics.counter("remote_failures_total", "Remote endpoint requests that failed (before retries)")
+_retries = metrics.counter("remote_retries_total", "Retried remote generate calls")
+_hedges = metrics.counter("remote_hedges_total", "Hedged requests sent to a second endpoint URL")
+_breaker_opens = metrics.counter("remote_breaker_opens_total", "Times an endpoint's circuit breaker opened")
+_latency = metrics.histogram(
+    "remote_latency_seconds",
+    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+    "Remote generate latency including retries and hedging",
+)
+
+
+class RemoteModelError(Exception):
+    """The remote endpoint failed (after retries)."""
+
+
+class RemoteUnavailableError(RemoteModelError):
+    """Every endpoint's circuit breaker is open."""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f"Remote model endpoint unavailable, retry in {self.retry_after}s")
+
+
+class _ClientError(RemoteModelError):
+    """4xx response: the request itself is bad, so retrying will not help."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects requests for
+    `cooldown` seconds; after that, requests are let through again and a single
+    failure re-opens it while a success closes it.
+    """
+
+    def __init__(self, threshold=REMOTE_BREAKER_THRESHOLD, cooldown=REMOTE_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        return self.opened_at is None or time.monotonic() - self.opened_at >= self.cooldown
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None or self.allow():
+                _breaker_opens.inc()
+            self.opened_at = time.monotonic()
+
+
+class RemoteModelClient:
+    """Shared client for one or more equivalent endpoint URLs."""
+
+    def __init__(self, urls, connect_timeout=REMOTE_CONNECT_TIMEOUT, read_timeout=REMOTE_READ_TIMEOUT,
+                 max_concurrency=REMOTE_MAX_CONCURRENCY, retries=REMOTE_RETRIES,
+                 retry_backoff=REMOTE_RETRY_BACKOFF, hedge_delay_ms=REMOTE_HEDGE_DELAY_MS,
+                 breaker_threshold=REMOTE_BREAKER_THRESHOLD, breaker_cooldown=REMOTE_BREAKER_COOLDOWN):
+        self.urls = list(urls)
+        if not self.urls:
+            raise ValueError("RemoteModelClient needs at least one endpoint URL")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_concurrency = max(1, max_concurrency)
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.hedge_delay = hedge_delay_ms / 1000.0
+        self.breakers = {url: CircuitBreaker(breaker_threshold, breaker_cooldown) for url in self.urls}
+        self._next = 0
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            import httpx
+
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="remote-client", daemon=True).start()
+
+            async def setup():
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._client = httpx.AsyncClient(
+                    timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                    limits=httpx.Limits(max_connections=self.max_concurrency,
+                                        max_keepalive_connections=self.max_concurrency),
+                )
+
+            asyncio.run_coroutine_threadsafe(setup(), loop).result()
+            self._loop = loop
+
+    def generate_sync(self, prompt):
+        """Blocking generate for worker threads; returns the endpoint's JSON body"""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._generate(prompt), self._loop).result()
+
+    async def generate(self, prompt):
+        """Awaitable generate usable from any event loop"""
+        self._ensure_started()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._generate(prompt), self._loop))
+
+    def close(self):
+        with self._start_lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+    async def _generate(self, prompt):
+        start = time.perf_counter()
+        try:
+            async with self._semaphore:
+                return await self._with_retries(prompt)
+        finally:
+            _latency.observe(time.perf_counter() - start)
+
+    async def _with_retries(self, prompt):
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                _retries.inc()
+                # Full jitter keeps retrying clients from synchronising
+                await asyncio.sleep(random.uniform(0, self.retry_backoff * 2 ** (attempt - 1)))
+            try:
+                return await self._hedged(prompt)
+            except (RemoteUnavailableError, _ClientError):
+                raise
+            except RemoteModelError as e:
+                error = e
+        raise error
+
+    def _available_urls(self):
+        """URLs whose breaker allows a request, rotated so load spreads across endpoints"""
+        start = self._next
+        self._next = (self._next + 1) % len(self.urls)
+        ordered = self.urls[start:] + self.urls[:start]
+        return [url for url in ordered if self.breakers[url].allow()]
+
+    async def _hedged(self, prompt):
+        urls = self._available_urls()
+        if not urls:
+            raise RemoteUnavailableError(min(breaker.retry_after() for breaker in self.breakers.values()))
+
+        tasks = {asyncio.ensure_future(self._post(urls.pop(0), prompt))}
+        error = None
+        try:
+            while tasks:
+                hedge = self.hedge_delay > 0 and urls
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay if hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Slow response: race the next endpoint
+                    _hedges.inc()
+                    tasks.add(asyncio.ensure_future(self._post(urls.pop(0), prompt)))
+                    continue
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    if isinstance(error, _ClientError):
+                        raise error
+                if not tasks and urls:
+                    # Fail over to the next endpoint straight away
+                    tasks.add(asyncio.ensure_future(self._post(urls.pop(0), prompt)))
+        finally:
+            for task in tasks:
+                task.cancel()
+        raise error
+
+    async def _post(self, url, prompt):
+        import httpx
+
+        breaker = self.breakers[url]
+        _requests.inc()
+        try:
+            resp = await self._client.post(url, json={"prompt": prompt})
+        except httpx.HTTPError as e:
+            _failures.inc()
+            breaker.record_failure()
+            raise RemoteModelError(f"{url}: {type(e).__name__}: {e}")
+        if resp.status_code == 429 or resp.status_code >= 500:
+            _failures.inc()
+            breaker.record_failure()
+            raise RemoteModelError(f"{url}: HTTP {resp.status_code}")
+        if resp.status_code >= 400:
+            # The endpoint answered, so it is healthy even if it rejected the request
+            breaker.record_success()
+            raise _ClientError(f"{url}: HTTP {resp.status_code}: {resp.text[:200]}")
+        try:
+            data = resp.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            # e.g. an HTML error page from a proxy in front of the endpoint
+            _failures.inc()
+            breaker.record_failure()
+            raise RemoteModelError(f"{url}: HTTP {resp.status_code} without a JSON object body: {resp.text[:200]!r}")
+        breaker.record_success()
+        return data
+
+
+def endpoint_urls(value):
+    """MODEL_ENDPOINT_URL may list several equivalent endpoints, comma-separated"""
+    return [url.strip() for url in (value or "").split(",") if url.strip()]
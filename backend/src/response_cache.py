@@ -0,0 +1,157 @@
+"""
+Response cache for generated commands.
+Keyed on the normalized instruction plus model and generation settings, with
+LRU size and TTL eviction and optional on-disk persistence.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+# Maximum number of cached responses (0 disables the cache)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+# Seconds a cached response stays valid
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Optional JSON file the cache is loaded from and saved to
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
+# Also cache outputs produced with do_sample=True (otherwise only deterministic settings are cached)
+RESPONSE_CACHE_SAMPLED = os.getenv("RESPONSE_CACHE_SAMPLED", "0") == "1"
+# Minimum seconds between automatic saves to RESPONSE_CACHE_PATH
+_SAVE_INTERVAL = 5.0
+
+_hits = metrics.counter("response_cache_hits_total", "Responses served from the exact-match cache")
+_misses = metrics.counter("response_cache_misses_total", "Exact-match cache lookups that missed")
+_evictions = metrics.counter("response_cache_evictions_total", "Cache entries dropped for size or TTL")
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_instruction(instruction):
+    """Fold case, punctuation and whitespace so trivial variations share a key"""
+    text = _PUNCTUATION.sub(" ", instruction.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def is_cacheable(generation_kwargs):
+    """Sampled outputs are only cached when RESPONSE_CACHE_SAMPLED is set"""
+    return RESPONSE_CACHE_SAMPLED or not generation_kwargs.get("do_sample", False)
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with per-entry TTL and optional JSON persistence."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 path=RESPONSE_CACHE_PATH or None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        # Saves run one at a time, each writing the latest snapshot
+        self._save_lock = threading.Lock()
+        self._last_save = 0.0
+        if self.path:
+            self.load()
+
+    @staticmethod
+    def make_key(instruction, model_id, generation_kwargs):
+        """Hash the normalized instruction together with the model and generation settings"""
+        payload = json.dumps(
+            [normalize_instruction(instruction), model_id, sorted(generation_kwargs.items())],
+            default=str,
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss or expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                _evictions.inc()
+                entry = None
+            if entry is None:
+                _misses.inc()
+                return None
+            self._entries.move_to_end(key)
+            _hits.inc()
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                _evictions.inc()
+            save_due = self.path and time.time() - self._last_save > _SAVE_INTERVAL
+            if save_due:
+                # Claimed here so concurrent puts don't all save
+                self._last_save = time.time()
+        if save_due:
+            self.save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self):
+        """Load unexpired entries from `path`, if it exists"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not load response cache from {self.path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, stored_at, value in stored:
+                if now - stored_at <= self.ttl:
+                    self._entries[key] = (stored_at, tuple(value))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        print(f"Loaded {len(self._entries)} cached responses from {self.path}")
+
+    def save(self):
+        """
+        Atomically write all unexpired entries to `path`. Failures are logged, not
+        raised, so a full disk never fails the request that triggered the save.
+        """
+        if not self.path:
+            return False
+        with self._save_lock:
+            now = time.time()
+            with self._lock:
+                stored = [
+                    [key, stored_at, list(value)]
+                    for key, (stored_at, value) in self._entries.items()
+                    if now - stored_at <= self.ttl
+                ]
+                self._last_save = now
+            directory = os.path.dirname(os.path.abspath(self.path))
+            tmp_path = None
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(self.path)}.", suffix=".tmp", dir=directory)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(stored, f)
+                os.replace(tmp_path, self.path)
+            except (OSError, TypeError, ValueError) as e:
+                print(f"Warning: could not save response cache to {self.path}: {e}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                return False
+        return True
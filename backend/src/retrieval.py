@@ -0,0 +1,230 @@
+"""
+Retrieval-backed fast path over known instruction/command pairs.
+Builds a compact inverted index (plain .npy arrays, memory-mapped at load time)
+from the curated Q&A dataset and the trace log records explicitly marked
+"curated": true, so high-confidence matches can be answered without running the
+model. Everything else in the trace log is unvetted model output and is never
+indexed. A match must also name the same numbers, paths and file names as the
+instruction (see semantic_cache.literals).
+
+Build the index offline (run from the backend directory):
+    python src/retrieval.py build
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+import metrics
+from semantic_cache import HashedVectorizer, literals
+from trace_log import TRACE_LOG_PATH, iter_records, segments
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_PATH = os.path.join(BACKEND_DIR, "data", "data", "command_qa_cleaned.json")
+TRACE_PATH = TRACE_LOG_PATH
+
+# Directory holding the prebuilt index (built in memory from the sources if missing)
+RETRIEVAL_INDEX_PATH = os.getenv("RETRIEVAL_INDEX_PATH", os.path.join(BACKEND_DIR, "data", "retrieval_index"))
+# Minimum cosine similarity for a retrieved command to be returned directly (0 disables retrieval)
+RETRIEVAL_THRESHOLD = float(os.getenv("RETRIEVAL_THRESHOLD", "0.8"))
+# Long Stack Overflow questions are truncated before indexing
+_MAX_QUESTION_CHARS = 300
+
+_hits = metrics.counter("retrieval_hits_total", "Requests answered directly from the retrieval index")
+_misses = metrics.counter("retrieval_misses_total", "Retrieval lookups below the confidence threshold")
+_vetoes = metrics.counter(
+    "retrieval_vetoes_total",
+    "Retrieval matches rejected because their numbers, paths or file names differ",
+)
+
+
+def _dataset_pairs(path):
+    """(instruction, command, plan) from the Q&A dataset, for answers containing a command"""
+    from agent_utils import extract_commands_from_text, select_best_command, is_confident_command
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    for qa in data:
+        commands = extract_commands_from_text(qa["answer"])
+        if is_confident_command(commands, qa["question"]):
+            question = qa["question"][:_MAX_QUESTION_CHARS]
+            yield question, select_best_command(commands, question), qa["answer"]
+
+
+def _trace_pairs(path):
+    """(instruction, command, plan) from "curated": true steps (live file and rotated segments), one per distinct instruction"""
+    from agent_utils import extract_commands_from_text, select_best_command, is_confident_command
+
+    steps = {}
+    for record in iter_records(path):
+        if record.get("instruction") and record.get("step") and record.get("curated"):
+            steps.setdefault(record["instruction"], []).append(record["step"])
+    for instruction, lines in steps.items():
+        plan = "\n".join(lines)
+        commands = extract_commands_from_text(plan)
+        # Skip logged answers that miss what the instruction asked for (e.g. tail for "first lines")
+        if is_confident_command(commands, instruction):
+            yield instruction, select_best_command(commands, instruction), plan
+
+
+def load_pairs(dataset_path=DATASET_PATH, trace_path=TRACE_PATH):
+    """Collect instruction/command pairs from every available source"""
+    pairs = []
+    if os.path.exists(trace_path) or segments(trace_path):
+        pairs.extend((i, c, p, "trace") for i, c, p in _trace_pairs(trace_path))
+    if os.path.exists(dataset_path):
+        pairs.extend((i, c, p, "dataset") for i, c, p in _dataset_pairs(dataset_path))
+    return pairs
+
+
+class RetrievalIndex:
+    """
+    Immutable inverted index stored as sorted feature ids with CSR postings.
+    Every array is a flat .npy file, so a saved index loads with mmap in O(1).
+    """
+
+    def __init__(self, vocab, idf, offsets, postings, weights, entries, vectorizer=None):
+        self.vocab = vocab          # sorted unique feature ids
+        self.idf = idf              # idf weight per vocab feature
+        self.offsets = offsets      # postings for vocab[i] are [offsets[i], offsets[i + 1])
+        self.postings = postings    # entry ids
+        self.weights = weights      # idf-weighted, L2-normalized entry weights
+        self.entries = entries      # [{"instruction", "command", "plan", "source"}]
+        self.vectorizer = vectorizer or HashedVectorizer()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def build(cls, pairs, vectorizer=None):
+        vectorizer = vectorizer or HashedVectorizer()
+        vectors = [vectorizer.transform(instruction) for instruction, _, _, _ in pairs]
+
+        # Document frequency -> smoothed idf
+        all_ids = np.concatenate([ids for ids, _ in vectors]) if vectors else np.empty(0, dtype=np.int64)
+        vocab, df = np.unique(all_ids, return_counts=True)
+        idf = (np.log((len(pairs) + 1) / (df + 1)) + 1.0).astype(np.float32)
+
+        columns = {}
+        for entry_id, (ids, values) in enumerate(vectors):
+            values = values * idf[np.searchsorted(vocab, ids)]
+            norm = np.linalg.norm(values)
+            for feature, weight in zip(ids.tolist(), (values / norm if norm else values).tolist()):
+                columns.setdefault(feature, []).append((entry_id, weight))
+
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        postings, weights = [], []
+        for i, feature in enumerate(vocab.tolist()):
+            column = columns[feature]
+            postings.extend(entry_id for entry_id, _ in column)
+            weights.extend(weight for _, weight in column)
+            offsets[i + 1] = len(postings)
+
+        entries = [
+            {"instruction": instruction, "command": command, "plan": plan, "source": source}
+            for instruction, command, plan, source in pairs
+        ]
+        return cls(vocab, idf, offsets, np.array(postings, dtype=np.int32),
+                   np.array(weights, dtype=np.float32), entries, vectorizer)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ("vocab", "idf", "offsets", "postings", "weights"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "entries.json"), "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in ("vocab", "idf", "offsets", "postings", "weights")
+        }
+        with open(os.path.join(path, "entries.json"), "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        return cls(entries=entries, **arrays)
+
+    def search(self, text):
+        """Return (entry, similarity) for the closest indexed instruction, or (None, 0.0)"""
+        ids, values = self.vectorizer.transform(text)
+        if not len(ids) or not len(self.vocab):
+            return None, 0.0
+        positions = np.searchsorted(self.vocab, ids)
+        positions = np.minimum(positions, len(self.vocab) - 1)
+        known = self.vocab[positions] == ids
+        if not known.any():
+            return None, 0.0
+
+        # Query gets the same idf weighting as the indexed entries; unseen
+        # features count as maximally rare, so they pull the similarity down
+        unseen_idf = math.log(len(self.entries) + 1) + 1.0
+        values = values * np.where(known, self.idf[positions], unseen_idf)
+        values /= np.linalg.norm(values)
+
+        entry_ids, contributions = [], []
+        for position, weight in zip(positions[known].tolist(), values[known].tolist()):
+            start, end = self.offsets[position], self.offsets[position + 1]
+            entry_ids.append(self.postings[start:end])
+            contributions.append(self.weights[start:end] * weight)
+        scores = np.bincount(np.concatenate(entry_ids), weights=np.concatenate(contributions))
+        best = int(np.argmax(scores))
+        return self.entries[best], float(scores[best])
+
+    def lookup(self, instruction, threshold=RETRIEVAL_THRESHOLD):
+        """Return (command, plan) when the best match clears `threshold`, else None"""
+        entry, score = self.search(instruction)
+        if entry is None or score < threshold:
+            _misses.inc()
+            return None
+        if literals(entry["instruction"]) != literals(instruction):
+            _vetoes.inc()
+            _misses.inc()
+            return None
+        _hits.inc()
+        return entry["command"], entry["plan"]
+
+
+def load_index(path=RETRIEVAL_INDEX_PATH):
+    """Load the prebuilt index, or build one in memory from the sources"""
+    if os.path.exists(os.path.join(path, "entries.json")):
+        index = RetrievalIndex.load(path)
+        print(f"Loaded retrieval index with {len(index)} entries from {path}")
+    else:
+        index = RetrievalIndex.build(load_pairs())
+        print(f"Built in-memory retrieval index with {len(index)} entries "
+              f"(run 'python src/retrieval.py build' to prebuild it)")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the command retrieval index")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    build = subparsers.add_parser("build", help="build the index from the dataset and trace log")
+    build.add_argument("--output", default=RETRIEVAL_INDEX_PATH)
+    build.add_argument("--dataset", default=DATASET_PATH)
+    build.add_argument("--trace", default=TRACE_PATH)
+    query = subparsers.add_parser("query", help="look up an instruction in a built index")
+    query.add_argument("instruction")
+    query.add_argument("--index", default=RETRIEVAL_INDEX_PATH)
+    args = parser.parse_args()
+
+    if args.action == "build":
+        start = time.perf_counter()
+        index = RetrievalIndex.build(load_pairs(args.dataset, args.trace))
+        index.save(args.output)
+        print(f"Indexed {len(index)} instruction/command pairs into {args.output} "
+              f"in {time.perf_counter() - start:.2f}s")
+    else:
+        entry, score = load_index(args.index).search(args.instruction)
+        if entry is None:
+            print("No match")
+        else:
+            print(f"{score:.3f} [{entry['source']}] {entry['instruction'][:80]!r} -> {entry['command']}")
+
+
+if __name__ == "__main__":
+    main()
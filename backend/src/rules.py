@@ -0,0 +1,254 @@
+"""
+Declarative keyword rules compiled into a single-pass matcher.
+All keywords of a rule set are folded into one regex that finds every keyword
+occurring in the text (substring semantics, like `word in text`) in a single
+scan; rules are then resolved in priority order using only the rules indexed
+under the keywords actually found.
+"""
+import os
+import re
+
+
+# Answer top intents straight from INTENT_RULES without running the model
+RULE_FAST_PATH = os.getenv("RULE_FAST_PATH", "0") == "1"
+
+
+def _groups(spec):
+    """Normalise a condition: a keyword, a tuple of alternatives, or a list of such groups (all required)"""
+    if spec is None:
+        return ()
+    if isinstance(spec, str):
+        return (frozenset([spec]),)
+    if isinstance(spec, tuple):
+        return (frozenset(spec),)
+    return tuple(frozenset([group]) if isinstance(group, str) else frozenset(group) for group in spec)
+
+
+class Condition:
+    """
+    Keyword condition: every group in `all_of` must have at least one keyword
+    present, and no keyword from `none_of` may be present.
+    """
+
+    __slots__ = ("groups", "excluded")
+
+    def __init__(self, all_of=None, none_of=()):
+        self.groups = _groups(all_of)
+        self.excluded = frozenset([none_of] if isinstance(none_of, str) else none_of)
+
+    def keywords(self):
+        return set().union(*self.groups, self.excluded)
+
+    def matches(self, found):
+        return all(group & found for group in self.groups) and not (self.excluded & found)
+
+
+class Rule:
+    """
+    A guarded rule. When the guard matches, `then` is resolved in order: each
+    outcome is `(condition, value)` or a bare value; the first outcome whose
+    condition matches is the result (None if none do).
+    """
+
+    __slots__ = ("name", "when", "outcomes")
+
+    def __init__(self, name, when, then, none_of=()):
+        self.name = name
+        self.when = when if isinstance(when, Condition) else Condition(when, none_of)
+        if not isinstance(then, list):
+            then = [then]
+        self.outcomes = [
+            (Condition(item[0]) if not isinstance(item[0], Condition) else item[0], item[1])
+            if isinstance(item, tuple) else (None, item)
+            for item in then
+        ]
+
+    def keywords(self):
+        keywords = self.when.keywords()
+        for condition, _ in self.outcomes:
+            if condition is not None:
+                keywords |= condition.keywords()
+        return keywords
+
+    def resolve(self, found):
+        for condition, value in self.outcomes:
+            if condition is None or condition.matches(found):
+                return value
+        return None
+
+
+def _trie_pattern(keywords):
+    """
+    Regex source matching any keyword, structured as a character trie so the
+    engine branches on each character instead of trying every alternative.
+    Longer keywords are preferred over their prefixes.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def render(node):
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A keyword ends here: extending it is optional (greedy, so longest wins)
+            return "(?:" + body + ")?"
+        return body
+
+    return render(trie)
+
+
+def _prefixes(text):
+    return (text[:end] for end in range(1, len(text)))
+
+
+class RuleSet:
+    """Rules compiled into one keyword regex plus a keyword -> rule index."""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        keywords = set().union(*(rule.keywords() for rule in self.rules))
+        # The lookahead reports the longest keyword starting at every position;
+        # shorter keywords inside it are added back through `_contained`.
+        self._pattern = re.compile("(?=(" + _trie_pattern(keywords) + "))") if keywords else None
+        self._contained = {}
+        for keyword in keywords:
+            contained = {keyword}
+            for match in self._pattern.finditer(keyword):
+                contained.add(match.group(1))
+                # Prefixes of that match are keywords too only if listed
+                contained.update(k for k in _prefixes(match.group(1)) if k in keywords)
+            self._contained[keyword] = frozenset(contained)
+
+        # A rule can only fire if one of its first guard group's keywords is present
+        self._by_keyword = {}
+        self._unconditional = []
+        for priority, rule in enumerate(self.rules):
+            if rule.when.groups:
+                for keyword in rule.when.groups[0]:
+                    self._by_keyword.setdefault(keyword, []).append(priority)
+            else:
+                self._unconditional.append(priority)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def keywords_in(self, text_lower):
+        """All rule keywords occurring in already-lowercased text"""
+        found = set()
+        if self._pattern is not None:
+            for match in self._pattern.finditer(text_lower):
+                found |= self._contained[match.group(1)]
+        return found
+
+    def _candidates(self, found):
+        candidates = set(self._unconditional)
+        for keyword in found:
+            candidates.update(self._by_keyword.get(keyword, ()))
+        return sorted(candidates)
+
+    def first(self, text_lower, found=None):
+        """(rule, found keywords) for the highest-priority rule whose guard matches, or (None, found)"""
+        if found is None:
+            found = self.keywords_in(text_lower)
+        for priority in self._candidates(found):
+            rule = self.rules[priority]
+            if rule.when.matches(found):
+                return rule, found
+        return None, found
+
+    def all(self, text_lower):
+        """Every rule whose guard matches, in priority order"""
+        found = self.keywords_in(text_lower)
+        return [self.rules[p] for p in self._candidates(found) if self.rules[p].when.matches(found)], found
+
+    def resolve(self, text):
+        """Value of the first matching rule for `text` (None if no rule or outcome matches)"""
+        rule, found = self.first(text.lower())
+        return rule.resolve(found) if rule is not None else None
+
+
+class CommandPattern:
+    """Case-sensitive predicate over a candidate command string."""
+
+    __slots__ = ("startswith", "contains", "excludes")
+
+    def __init__(self, startswith=None, contains=(), excludes=()):
+        self.startswith = startswith
+        self.contains = tuple(contains)
+        self.excludes = tuple(excludes)
+
+    def __call__(self, cmd):
+        if self.startswith is not None and not cmd.startswith(self.startswith):
+            return False
+        return all(part in cmd for part in self.contains) and not any(part in cmd for part in self.excludes)
+
+
+# Instruction keywords -> generic command when nothing usable was generated
+FALLBACK_RULES = RuleSet([
+    Rule("git-branch", ("branch", "git"), "git checkout -b <branch-name>"),
+    Rule("list-files", ("list", "files"), "ls -la"),
+    Rule("make-directory", ("directory", "folder", "mkdir"), "mkdir <directory-name>"),
+    Rule("virtualenv", ("virtual", "venv", "environment"), "python3 -m venv <env_name>"),
+    Rule("pip-install", ("pip", "install", "package"), "pip install <package_name>"),
+    Rule("docker-run", ("docker", "container"), "docker run <image_name>"),
+    Rule("head-file", [("first", "lines", "head"), ("file", "log")],
+         [(("ten", "10"), "head -n 10 <filename>"), "head <filename>"]),
+    Rule("tail-file", [("last", "tail"), ("file", "log")], "tail <filename>"),
+    Rule("cat-file", [("read", "view", "show", "cat"), ("file", "log")], "cat <filename>"),
+])
+
+# Plan line keywords -> command, for plans where no command could be extracted
+PLAN_LINE_RULES = RuleSet([
+    Rule("git-branch", ["git", ("branch", "checkout", "create")],
+         [("checkout -b", "git checkout -b <branch-name>"),
+          (["branch", "create"], "git checkout -b <branch-name>")]),
+    Rule("virtualenv", [("venv", "virtual", "environment"), "python"],
+         [(("python3 -m venv", "python -m venv"), "python3 -m venv <env_name>")]),
+    Rule("pip-install", ["pip", "install"], [("requests", "pip install requests")]),
+    Rule("head-file", [("first", "lines", "head"), ("file", ".log", ".txt")],
+         [(("ten", "10"), "head -n 10 <filename>")]),
+])
+
+# Instruction keywords -> which extracted command to prefer (all matching rules apply, in order)
+PREFERENCE_RULES = RuleSet([
+    # For branch creation, prioritize 'checkout -b' over plain 'checkout'
+    Rule("branch-create", [("create", "new"), "branch"],
+         CommandPattern(contains=["checkout -b"], excludes=["merge", "delete", "remove"])),
+    # For file operations, prioritize specific file commands
+    Rule("head", ("first", "lines", "head"), CommandPattern(startswith="head")),
+    Rule("tail", ("last", "tail"), CommandPattern(startswith="tail")),
+    # For virtual environment, prioritize venv creation
+    Rule("virtualenv", ("virtual", "venv", "environment"), CommandPattern(contains=["python", "venv"])),
+    # For pip, prioritize install commands
+    Rule("pip-install", "install", CommandPattern(contains=["pip install"])),
+])
+
+# High-precision intents that can be answered without the model (RULE_FAST_PATH)
+INTENT_RULES = RuleSet([
+    Rule("git-status", ["git", "status"], "git status"),
+    Rule("git-init", [("initialize", "initialise", "init "), "git", ("repo",)], "git init"),
+    Rule("git-branch-create", [("create", "new", "make"), "branch"], "git checkout -b <branch-name>",
+         none_of=("delete", "remove", "rename", "merge", "list", "remote")),
+    Rule("list-files", [("list", "show"), ("files", "contents")], "ls -la",
+         none_of=("python", ".py", "modified", "larger", "size", "recursive", "hidden", "git", "find", "count")),
+    Rule("current-directory", [("current", "working"), ("directory", "folder"), ("print", "show", "where", "which")],
+         "pwd", none_of=("files", "list", "size")),
+    Rule("disk-usage", ["disk", ("usage", "space", "free")], "df -h", none_of=("folder", "directory", "file")),
+    Rule("python-version", ["python", "version"], "python3 --version", none_of=("install", "switch", "change")),
+    Rule("virtualenv-create", [("create", "set up", "make", "new"), ("virtual environment", "venv", "virtualenv")],
+         "python3 -m venv <env_name>", none_of=("install", "activate", "delete", "remove", "conda")),
+])
+
+
+def match_intent(instruction):
+    """(command, rule name) when the instruction hits a fast-path intent, else None"""
+    rule, found = INTENT_RULES.first(instruction.lower())
+    if rule is None:
+        return None
+    return rule.resolve(found), rule.name
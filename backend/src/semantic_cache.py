@@ -0,0 +1,256 @@
+"""
+Semantic nearest-neighbour cache for paraphrased instructions.
+Instructions are embedded as sparse hashed word/bigram vectors (with a small
+synonym map) and searched through an inverted index, so lookups stay well
+under a millisecond even with ~100k cached entries. A match is only served when
+both instructions name the same numbers, paths and file names: "older than 7
+days" and "older than 30 days" are similar sentences but different commands.
+"""
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import metrics
+
+
+# Maximum number of cached instructions per model/settings namespace (0 disables the cache)
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "10000"))
+# Minimum cosine similarity for a cached answer to be reused
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+
+_hits = metrics.counter("semantic_cache_hits_total", "Responses served from the semantic cache")
+_misses = metrics.counter("semantic_cache_misses_total", "Semantic cache lookups below the similarity threshold")
+_vetoes = metrics.counter(
+    "semantic_cache_vetoes_total",
+    "Semantic cache matches rejected because their numbers, paths or file names differ",
+)
+_lookup_seconds = metrics.histogram(
+    "semantic_cache_lookup_seconds",
+    [0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01],
+    "Semantic cache lookup latency",
+)
+
+_TOKEN = re.compile(r"[a-z0-9_\-]+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+# Paths (anything with / or ~) and file names or extensions (reports.tar.gz, .pyc)
+_PATH = re.compile(r"[\w.~-]*[/~][\w./~-]*|[\w-]*(?:\.[a-z0-9_]+)+")
+
+STOP_WORDS = frozenset([
+    "a", "an", "the", "to", "of", "in", "on", "for", "and", "it", "its", "is",
+    "me", "my", "i", "please", "can", "you", "how", "do", "with", "that", "this",
+    "into", "from", "using", "use", "called", "named", "some", "then", "also",
+    "all", "every", "each", "only", "just", "but", "intact", "want", "need",
+])
+
+# Canonical forms for common shell-task paraphrases
+SYNONYMS = {
+    "make": "create", "new": "create", "add": "create", "generate": "create",
+    "init": "initialize", "initialise": "initialize", "setup": "create",
+    "switch": "checkout", "change": "checkout", "move": "mv",
+    "remove": "delete", "erase": "delete", "rm": "delete", "del": "delete",
+    "folder": "directory", "dir": "directory", "folders": "directory", "directories": "directory",
+    "show": "list", "display": "list", "print": "list", "view": "list", "ls": "list",
+    "fetch": "get", "retrieve": "get", "download": "get",
+    "compress": "archive", "zip": "archive", "tar": "archive",
+    "search": "find", "locate": "find", "look": "find", "grep": "find",
+    "copy": "cp", "duplicate": "cp",
+    "venv": "virtualenv", "virtual": "virtualenv", "environment": "virtualenv", "env": "virtualenv",
+    "repo": "repository", "ten": "10", "five": "5", "first": "head", "top": "head",
+    "last": "tail", "bottom": "tail", "larger": "bigger", "greater": "bigger",
+}
+
+# Spelled-out numbers, compared as digits
+NUMBER_WORDS = {
+    "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6",
+    "seven": "7", "eight": "8", "nine": "9", "ten": "10", "eleven": "11", "twelve": "12",
+    "fifteen": "15", "twenty": "20", "thirty": "30", "fifty": "50", "hundred": "100",
+}
+
+# Two-word phrases folded to a single token before synonym mapping
+PHRASES = {
+    ("check", "out"): "checkout",
+    ("set", "up"): "setup",
+    ("look", "for"): "find",
+    ("virtual", "environment"): "virtualenv",
+}
+
+
+def _canonical_tokens(text):
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in STOP_WORDS:
+            continue
+        # Fold two-word phrases ("check it out" -> "checkout") once stop words are gone
+        if tokens and (tokens[-1], token) in PHRASES:
+            token = PHRASES[(tokens.pop(), token)]
+        tokens.append(token)
+    
+    canonical = []
+    for token in tokens:
+        token = SYNONYMS.get(token, token)
+        # Cheap plural folding ("files" -> "file"), leaving short words alone
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        canonical.append(token)
+    return canonical
+
+
+def literals(text):
+    """Numbers, paths and file names in an instruction; a cached answer must name exactly the same ones"""
+    text = text.lower()
+    found = set(_NUMBER.findall(text))
+    found.update(NUMBER_WORDS[token] for token in _TOKEN.findall(text) if token in NUMBER_WORDS)
+    found.update(path.rstrip("./") or path for path in _PATH.findall(text))
+    return frozenset(found)
+
+
+class HashedVectorizer:
+    """
+    Sparse bag of canonical words and adjacent word pairs, hashed with crc32 so the
+    feature ids are stable across processes (and usable in on-disk indexes).
+    """
+
+    def __init__(self, n_features=2 ** 22, bigram_weight=0.25, idf=None):
+        self.n_features = n_features
+        self.bigram_weight = bigram_weight
+        # Optional {feature_id: weight} table, e.g. fitted on a corpus
+        self.idf = idf
+
+    def _hash(self, feature):
+        return zlib.crc32(feature.encode("utf-8")) % self.n_features
+
+    def transform(self, text):
+        """Return (feature_ids, weights) as an L2-normalized sparse vector"""
+        tokens = _canonical_tokens(text)
+        weights = {}
+        for token in tokens:
+            feature = self._hash(token)
+            weights[feature] = weights.get(feature, 0.0) + 1.0
+        for pair in zip(tokens, tokens[1:]):
+            # Unordered, so reworded instructions ("reports folder" / "folder reports") still match
+            feature = self._hash(" ".join(sorted(pair)))
+            weights[feature] = weights.get(feature, 0.0) + self.bigram_weight
+        if not weights:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        ids = np.fromiter(weights.keys(), dtype=np.int64, count=len(weights))
+        values = np.fromiter(weights.values(), dtype=np.float32, count=len(weights))
+        # Sublinear term frequency, then optional IDF weighting
+        values = 1.0 + np.log(values, where=values > 1.0, out=np.zeros_like(values))
+        if self.idf is not None:
+            values *= np.array([self.idf.get(int(i), 1.0) for i in ids], dtype=np.float32)
+        norm = np.linalg.norm(values)
+        if norm > 0:
+            values /= norm
+        return ids, values
+
+
+class _Posting:
+    """Growable (entry id, weight) arrays for one feature"""
+
+    __slots__ = ("ids", "weights", "size")
+
+    def __init__(self):
+        self.ids = np.empty(4, dtype=np.int32)
+        self.weights = np.empty(4, dtype=np.float32)
+        self.size = 0
+
+    def append(self, entry_id, weight):
+        if self.size == len(self.ids):
+            self.ids = np.resize(self.ids, self.size * 2)
+            self.weights = np.resize(self.weights, self.size * 2)
+        self.ids[self.size] = entry_id
+        self.weights[self.size] = weight
+        self.size += 1
+
+
+class SemanticIndex:
+    """
+    Inverted index over sparse unit vectors. Scoring sums query-weighted
+    postings with np.bincount, which gives exact cosine similarity for every
+    entry sharing at least one feature with the query.
+    """
+
+    def __init__(self, vectorizer=None):
+        self.vectorizer = vectorizer or HashedVectorizer()
+        self._postings = {}
+        self._values = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, text, value):
+        entry_id = len(self._values)
+        ids, weights = self.vectorizer.transform(text)
+        for feature, weight in zip(ids.tolist(), weights.tolist()):
+            posting = self._postings.get(feature)
+            if posting is None:
+                posting = self._postings[feature] = _Posting()
+            posting.append(entry_id, weight)
+        self._values.append(value)
+
+    def search(self, text):
+        """Return (value, similarity) of the nearest entry, or (None, 0.0)"""
+        ids, weights = self.vectorizer.transform(text)
+        entry_ids = []
+        contributions = []
+        for feature, weight in zip(ids.tolist(), weights.tolist()):
+            posting = self._postings.get(feature)
+            if posting is not None:
+                entry_ids.append(posting.ids[:posting.size])
+                contributions.append(posting.weights[:posting.size] * weight)
+        if not entry_ids:
+            return None, 0.0
+        scores = np.bincount(np.concatenate(entry_ids), weights=np.concatenate(contributions))
+        best = int(np.argmax(scores))
+        return self._values[best], float(scores[best])
+
+
+class SemanticCache:
+    """
+    Thread-safe semantic cache in front of generation. Entries live in
+    separate namespaces (model + generation settings) and the oldest half of a
+    namespace is dropped when it reaches `max_entries`.
+    """
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_SIZE,
+                 vectorizer=None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.vectorizer = vectorizer or HashedVectorizer()
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, instruction, namespace=""):
+        """Return the value cached for the most similar instruction above the threshold, or None"""
+        start = time.perf_counter()
+        with self._lock:
+            index = self._indexes.get(namespace)
+            value, score = index.search(instruction) if index is not None else (None, 0.0)
+        _lookup_seconds.observe(time.perf_counter() - start)
+        if value is None or score < self.threshold:
+            _misses.inc()
+            return None
+        if literals(value[0]) != literals(instruction):
+            _vetoes.inc()
+            _misses.inc()
+            return None
+        _hits.inc()
+        return value[1]
+
+    def put(self, instruction, value, namespace=""):
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = self._indexes[namespace] = SemanticIndex(self.vectorizer)
+            if len(index) >= self.max_entries:
+                # Rebuild from the newer half; amortised over max_entries / 2 inserts
+                keep = index._values[len(index) // 2:]
+                index = self._indexes[namespace] = SemanticIndex(self.vectorizer)
+                for text, kept in keep:
+                    index.add(text, (text, kept))
+            index.add(instruction, (instruction, value))
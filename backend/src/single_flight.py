@@ -0,0 +1,63 @@
+"""
+Single-flight request coalescing.
+Concurrent calls with the same key share one execution: the first caller runs
+the function, later callers wait for it and receive the same result (or error).
+generate_command uses it so a burst of identical prompts runs the model once.
+"""
+import os
+import threading
+
+import metrics
+
+
+# Share one in-flight generation between concurrent identical (normalized) prompts
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") == "1"
+
+_leaders = metrics.counter("single_flight_leaders_total", "Generations started by single-flight (one per distinct in-flight prompt)")
+_coalesced = metrics.counter("coalesced_requests_total", "Requests that waited for an identical in-flight generation instead of starting their own")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Thread-safe map of in-flight calls by key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key, fn):
+        """Return fn(), or the result of the identical call already in flight for `key`"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            _coalesced.inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        _leaders.inc()
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
@@ -0,0 +1,114 @@
+"""
+Speculative (assisted) decoding.
+A cheap drafter proposes several tokens and the main model verifies them all in
+one forward pass, keeping the longest prefix it agrees with plus one token of
+its own. Greedy outputs are unchanged and sampled outputs keep the main model's
+distribution; only the number of main-model passes drops. Drafts come from a
+small model (SPECULATIVE_DECODING=draft) or from n-grams of the prompt itself
+(prompt_lookup). transformers drafts one sequence at a time, so batched
+generate calls decode normally.
+"""
+import os
+import threading
+
+import metrics
+
+
+# Drafter for single-sequence generation: off, prompt_lookup or draft (DRAFT_MODEL)
+SPECULATIVE_DECODING = os.getenv("SPECULATIVE_DECODING", "off")
+# Small model drafting for the main one when SPECULATIVE_DECODING=draft
+DRAFT_MODEL = os.getenv("DRAFT_MODEL", "TinyLlama/TinyLlama-1.1B-Chat-v1.0")
+# Tokens drafted per verification step
+SPECULATIVE_TOKENS = int(os.getenv("SPECULATIVE_TOKENS", "5"))
+
+MODES = ("off", "prompt_lookup", "draft")
+
+_drafted = metrics.counter("speculative_draft_tokens_total", "Draft tokens proposed to the main model")
+_accepted = metrics.counter("speculative_accepted_tokens_total", "Draft tokens the main model accepted")
+
+_draft = None
+_draft_lock = threading.Lock()
+
+
+def get_draft_model(device="cpu"):
+    """The draft model (DRAFT_MODEL) and its tokenizer, loaded once"""
+    global _draft
+    if _draft is None:
+        with _draft_lock:
+            if _draft is None:
+                import torch
+                from transformers import AutoModelForCausalLM, AutoTokenizer
+                from cpu_inference import load_dtype
+
+                print(f"Loading draft model {DRAFT_MODEL}...")
+                dtype = load_dtype() if device == "cpu" else torch.float16
+                model = AutoModelForCausalLM.from_pretrained(DRAFT_MODEL, dtype=dtype).to(device).eval()
+                _draft = model, AutoTokenizer.from_pretrained(DRAFT_MODEL)
+    return _draft
+
+
+def draft_kwargs(model, tokenizer, mode, tokens=None):
+    """model.generate kwargs that enable `mode` drafting for a single sequence ({} for off)"""
+    tokens = tokens or SPECULATIVE_TOKENS
+    if mode not in MODES:
+        raise ValueError(f"SPECULATIVE_DECODING must be one of {MODES}, got {mode!r}")
+    if mode == "prompt_lookup":
+        return {"prompt_lookup_num_tokens": tokens}
+    if mode == "draft":
+        draft_model, draft_tokenizer = get_draft_model(str(model.device))
+        draft_model.generation_config.num_assistant_tokens = tokens
+        kwargs = {"assistant_model": draft_model}
+        if draft_model.config.vocab_size != model.config.vocab_size:
+            # Different vocabularies: drafts are translated through text
+            kwargs.update(tokenizer=tokenizer, assistant_tokenizer=draft_tokenizer)
+        return kwargs
+    return {}
+
+
+def drafting(batch_size, mode=None):
+    """Whether a generate call over `batch_size` sequences is drafted for"""
+    return batch_size == 1 and (mode or SPECULATIVE_DECODING) != "off"
+
+
+def assisted_generate(model, tokenizer, inputs, mode=None, **generation_kwargs):
+    """
+    model.generate with `mode` (default: SPECULATIVE_DECODING) drafting when `inputs` hold a single sequence.
+    Drafted and accepted tokens are counted from the main model's verification
+    passes: each pass feeds the previous step's own token plus the drafts and
+    yields the accepted drafts plus one new token.
+    """
+    draft = draft_kwargs(model, tokenizer, mode or SPECULATIVE_DECODING) if inputs["input_ids"].shape[0] == 1 else {}
+    if not draft:
+        return model.generate(**inputs, **generation_kwargs)
+
+    # transformers runs the underlying model, not a PEFT wrapper
+    get_base_model = getattr(model, "get_base_model", None)
+    target = get_base_model() if get_base_model is not None else model
+    thread = threading.get_ident()
+    fed = []
+
+    def record(_module, _args, kwargs):
+        if threading.get_ident() == thread:
+            fed.append(kwargs["input_ids"].shape[1])
+
+    # The assisted loop prefills the whole prompt on its first pass, even over a
+    # cache it was given, so the prompt-prefix KV cannot be reused here
+    inputs = {key: value for key, value in inputs.items() if key != "past_key_values"}
+    hook = target.register_forward_pre_hook(record, with_kwargs=True)
+    try:
+        outputs = model.generate(**inputs, **draft, **generation_kwargs)
+    finally:
+        hook.remove()
+
+    if fed:
+        drafted = sum(fed) - inputs["input_ids"].shape[1] - (len(fed) - 1)
+        new_tokens = outputs.shape[1] - inputs["input_ids"].shape[1]
+        _drafted.inc(drafted)
+        _accepted.inc(min(drafted, max(0, new_tokens - len(fed))))
+    return outputs
+
+
+def acceptance_rate():
+    """Share of drafted tokens accepted so far (None before any drafting)"""
+    drafted = _drafted.value
+    return _accepted.value / drafted if drafted else None
@@ -0,0 +1,400 @@
+"""
+Buffered trace log of served requests (logs/trace.jsonl).
+log() only appends to an in-memory ring buffer; a background thread writes
+batches, fsyncs on an interval and rotates the file by size or age. Rotated
+segments are gzip-compressed JSONL, or compressed columnar .npz files
+(TRACE_SEGMENT_FORMAT=columnar) that analysis scripts can scan without
+parsing JSON. iter_records()/scan() read the live file and all segments. Pre-fork
+workers (prefork.py) forward their records to the one process writing the file.
+
+Summarise a trace log (run from the backend directory):
+    python src/trace_log.py stats
+"""
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from collections import deque
+
+import metrics
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Live trace file; rotated segments are written next to it
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(BACKEND_DIR, "logs", "trace.jsonl"))
+# Log served requests from the API (the CLI always logs)
+TRACE_LOG = os.getenv("TRACE_LOG", "1") == "1"
+# Records held in memory between flushes; the oldest are dropped when it is full
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "10000"))
+# Seconds between background writes
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "1"))
+# Seconds between fsyncs of the live file (0 = after every write)
+TRACE_FSYNC_INTERVAL = float(os.getenv("TRACE_FSYNC_INTERVAL", "10"))
+# Rotate the live file once it reaches this many bytes (0 = no size limit)
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Rotate the live file once its first record is this many seconds old (0 = no age limit)
+TRACE_ROTATE_SECONDS = float(os.getenv("TRACE_ROTATE_SECONDS", "0"))
+# Rotated segments to keep (0 = keep all)
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "20"))
+# "gzip" (compressed JSONL) or "columnar" (compressed .npz columns) for rotated segments
+TRACE_SEGMENT_FORMAT = os.getenv("TRACE_SEGMENT_FORMAT", "gzip")
+
+SEGMENT_FORMATS = ("gzip", "columnar")
+# Columns stored in columnar segments; other record fields are only kept in JSONL
+COLUMNS = ("ts", "latency_ms", "cache_hit", "backend", "curated", "instruction", "step")
+
+_records = metrics.counter("trace_records_total", "Records written to the trace log")
+_dropped = metrics.counter("trace_dropped_total", "Trace records dropped because the ring buffer was full")
+_rotations = metrics.counter("trace_rotations_total", "Trace log rotations")
+
+
+class TraceLogger:
+    """Ring buffer plus background flusher for one trace file."""
+
+    def __init__(self, path=TRACE_LOG_PATH, buffer_size=TRACE_BUFFER_SIZE, flush_interval=TRACE_FLUSH_INTERVAL,
+                 fsync_interval=TRACE_FSYNC_INTERVAL, max_bytes=TRACE_MAX_BYTES,
+                 rotate_seconds=TRACE_ROTATE_SECONDS, backups=TRACE_BACKUPS, segment_format=TRACE_SEGMENT_FORMAT):
+        if segment_format not in SEGMENT_FORMATS:
+            raise ValueError(f"TRACE_SEGMENT_FORMAT must be one of {SEGMENT_FORMATS}, got {segment_format!r}")
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.segment_format = segment_format
+        self._buffer = deque(maxlen=max(1, buffer_size))
+        self._lock = threading.Lock()
+        # Held while writing, so a flush from close() never interleaves with the background one
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+        self._file = None
+        self._segment_started = None
+        self._last_fsync = 0.0
+
+    def log(self, record):
+        """Queue one record; never blocks on I/O"""
+        record.setdefault("ts", round(time.time(), 3))
+        with self._lock:
+            if self._closed:
+                return
+            if len(self._buffer) == self._buffer.maxlen:
+                _dropped.inc()
+            self._buffer.append(record)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-flusher", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Warning: could not write trace log {self.path}: {e}")
+
+    def flush(self, fsync=False):
+        """Write everything buffered so far"""
+        with self._write_lock:
+            with self._lock:
+                records = list(self._buffer)
+                self._buffer.clear()
+            if records:
+                self._open()
+                self._file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                self._file.flush()
+                _records.inc(len(records))
+            if self._file is None:
+                return
+            now = time.time()
+            if fsync or now - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._last_fsync = now
+            if self._rotation_due(now):
+                self._rotate()
+
+    def close(self):
+        """Stop the flusher and write out the remaining records"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.flush(fsync=True)
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self):
+        if self._file is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._segment_started = _first_timestamp(self.path) or time.time()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _rotation_due(self, now):
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            return True
+        return bool(self.rotate_seconds) and now - self._segment_started >= self.rotate_seconds
+
+    def _rotate(self):
+        """Move the live file aside (new records go to a fresh file), then compress it"""
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        stem = self.path[:-len(".jsonl")] if self.path.endswith(".jsonl") else self.path
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(self._segment_started))
+        # The sequence number keeps segments started in the same second in order
+        prefix = f"{stem}-{stamp}-"
+        taken = [int(p[len(prefix):].split(".")[0]) for p in segments(self.path) if p.startswith(prefix)]
+        name = f"{prefix}{max(taken, default=-1) + 1:03d}"
+        segment = f"{name}.jsonl"
+        os.replace(self.path, segment)
+        _rotations.inc()
+
+        if self.segment_format == "columnar":
+            write_columnar(segment, f"{name}.npz")
+        else:
+            with open(segment, "rb") as src, gzip.open(f"{segment}.gz.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(f"{segment}.gz.tmp", f"{segment}.gz")
+        os.remove(segment)
+
+        if self.backups:
+            for old in segments(self.path)[:-self.backups]:
+                os.remove(old)
+
+
+def _first_timestamp(path):
+    """Timestamp of the first record in `path` (None if empty, missing or without one)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.loads(f.readline()).get("ts")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def segments(path=TRACE_LOG_PATH):
+    """Rotated segments of the trace file at `path`, oldest first"""
+    stem = path[:-len(".jsonl")] if path.endswith(".jsonl") else path
+    found = [p for p in glob.glob(f"{glob.escape(stem)}-*") if p.endswith((".jsonl.gz", ".npz", ".jsonl"))]
+    return sorted(found)
+
+
+def _columns_from_records(records):
+    import numpy as np
+
+    records = list(records)
+    backends = sorted({r.get("backend") or "" for r in records})
+    codes = {name: i for i, name in enumerate(backends)}
+    columns = {
+        "ts": np.array([r.get("ts") or 0.0 for r in records], dtype=np.float64),
+        "latency_ms": np.array([r["latency_ms"] if r.get("latency_ms") is not None else np.nan for r in records],
+                               dtype=np.float32),
+        # -1 where the record does not say (e.g. older traces)
+        "cache_hit": np.array([-1 if r.get("cache_hit") is None else int(r["cache_hit"]) for r in records],
+                              dtype=np.int8),
+        "curated": np.array([-1 if r.get("curated") is None else int(r["curated"]) for r in records], dtype=np.int8),
+        "backend": np.array([codes[r.get("backend") or ""] for r in records], dtype=np.uint8),
+        "backend_names": np.array(backends, dtype=str),
+    }
+    for name in ("instruction", "step"):
+        encoded = [(r.get(name) or "").encode("utf-8") for r in records]
+        columns[f"{name}_offsets"] = np.cumsum([0] + [len(e) for e in encoded], dtype=np.int64)
+        columns[f"{name}_bytes"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return columns
+
+
+def write_columnar(jsonl_path, npz_path):
+    """Convert a JSONL trace segment to a compressed columnar .npz"""
+    import numpy as np
+
+    columns = _columns_from_records(_read_jsonl(jsonl_path))
+    with open(f"{npz_path}.tmp", "wb") as f:
+        np.savez_compressed(f, **columns)
+    os.replace(f"{npz_path}.tmp", npz_path)
+
+
+def _read_jsonl(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _strings(data, name):
+    offsets, blob = data[f"{name}_offsets"], data[f"{name}_bytes"].tobytes()
+    return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def _select(data, columns):
+    """Decode the requested columns from stored arrays (an .npz or _columns_from_records output)"""
+    import numpy as np
+
+    result = {}
+    for name in columns:
+        if name in ("instruction", "step"):
+            result[name] = np.array(_strings(data, name), dtype=object)
+        elif name == "backend":
+            result[name] = data["backend_names"][data["backend"]]
+        elif name == "curated" and name not in data:
+            # Segments written before the column existed
+            result[name] = np.full(len(data["ts"]), -1, dtype=np.int8)
+        else:
+            result[name] = data[name]
+    return result
+
+
+def _read_columnar(path, columns):
+    """Requested columns of a columnar segment (only those arrays are decompressed)"""
+    import numpy as np
+
+    with np.load(path) as data:
+        return _select(data, columns)
+
+
+def iter_records(path=TRACE_LOG_PATH):
+    """Every record from the rotated segments (oldest first), then the live file"""
+    for segment in segments(path) + ([path] if os.path.exists(path) else []):
+        if segment.endswith(".npz"):
+            data = _read_columnar(segment, COLUMNS)
+            for i in range(len(data["ts"])):
+                latency, cache_hit, curated = (float(data["latency_ms"][i]), int(data["cache_hit"][i]),
+                                               int(data["curated"][i]))
+                record = {"instruction": data["instruction"][i], "step": data["step"][i], "ts": float(data["ts"][i])}
+                # Optional fields the original record did not have are left out, as in JSONL
+                optional = {
+                    "latency_ms": None if math.isnan(latency) else latency,
+                    "cache_hit": None if cache_hit < 0 else bool(cache_hit),
+                    "backend": str(data["backend"][i]) or None,
+                    "curated": None if curated < 0 else bool(curated),
+                }
+                record.update((key, value) for key, value in optional.items() if value is not None)
+                yield record
+        else:
+            yield from _read_jsonl(segment)
+
+
+def scan(path=TRACE_LOG_PATH, columns=("ts", "latency_ms", "cache_hit", "backend")):
+    """Columns across all segments and the live file, as numpy arrays"""
+    import numpy as np
+
+    parts = []
+    for segment in segments(path) + ([path] if os.path.exists(path) else []):
+        if segment.endswith(".npz"):
+            parts.append(_read_columnar(segment, columns))
+        else:
+            parts.append(_select(_columns_from_records(_read_jsonl(segment)), columns))
+    if not parts:
+        return {name: np.empty(0) for name in columns}
+    return {name: np.concatenate([part[name] for part in parts]) for name in columns}
+
+
+class ForwardingTraceLogger:
+    """Stands in for TraceLogger in processes that do not own the trace file (pre-fork workers)."""
+
+    def __init__(self, path, queue):
+        self.path = path
+        self.queue = queue
+
+    def log(self, record):
+        """Hand one record to the writer process; never blocks on I/O"""
+        record.setdefault("ts", round(time.time(), 3))
+        try:
+            self.queue.put_nowait((self.path, record))
+        except Exception:
+            _dropped.inc()
+
+    def flush(self, fsync=False):
+        pass
+
+    def close(self):
+        pass
+
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+# Set in pre-fork workers: records are sent here instead of being written
+_forward_queue = None
+
+
+def forward_trace_logs(queue):
+    """Send this process's trace records to `queue` as (path, record) instead of writing them"""
+    global _forward_queue
+    with _loggers_lock:
+        _forward_queue = queue
+        _loggers.clear()
+
+
+def get_trace_logger(path=None):
+    """Shared logger for `path` (default TRACE_LOG_PATH)"""
+    path = path or TRACE_LOG_PATH
+    with _loggers_lock:
+        if path not in _loggers:
+            if _forward_queue is not None:
+                _loggers[path] = ForwardingTraceLogger(path, _forward_queue)
+            else:
+                _loggers[path] = TraceLogger(path)
+        return _loggers[path]
+
+
+def close_trace_loggers():
+    """Flush and close every logger (called on API shutdown)"""
+    with _loggers_lock:
+        loggers = list(_loggers.values())
+        _loggers.clear()
+    for logger in loggers:
+        logger.close()
+
+
+def main():
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description="Summarise or convert the trace log")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    stats = subparsers.add_parser("stats", help="request count, cache hit rate and latency per backend")
+    stats.add_argument("--path", default=TRACE_LOG_PATH)
+    convert = subparsers.add_parser("convert", help="convert a JSONL(.gz) segment to columnar .npz")
+    convert.add_argument("segment")
+    convert.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    if args.action == "convert":
+        output = args.output or args.segment.split(".jsonl")[0] + ".npz"
+        write_columnar(args.segment, output)
+        print(f"Wrote {output}")
+        return
+
+    start = time.perf_counter()
+    data = scan(args.path)
+    print(f"{len(data['ts'])} records in {len(segments(args.path))} segments + live file "
+          f"(scanned in {time.perf_counter() - start:.2f}s)")
+    known = data["cache_hit"] >= 0
+    if known.any():
+        print(f"Cache hit rate: {data['cache_hit'][known].mean():.1%} of {known.sum()} requests")
+    for backend in sorted(set(data["backend"].tolist())):
+        latency = data["latency_ms"][(data["backend"] == backend) & ~np.isnan(data["latency_ms"])]
+        if len(latency):
+            print(f"{backend or '(unknown)'}: {len(latency)} requests, latency p50 {np.percentile(latency, 50):.1f} ms, "
+                  f"p99 {np.percentile(latency, 99):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()